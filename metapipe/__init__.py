@@ -0,0 +1 @@
+"""Support modules for the MetaGenomics pipeline orchestrator"""
@@ -0,0 +1,162 @@
+#####################################################################
+#            THREAD SCALING PROFILES AND CORE ALLOCATION           #
+#####################################################################
+
+import gzip
+import heapq
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+PROFILE_VERSION = 1
+DEFAULT_PAIRS = 200000
+# Relative difference in projected time treated as measurement noise
+NOISE = 0.05
+
+
+def thread_counts(cores, counts=None):
+    """Thread counts to measure: the given ones up to cores, else powers of two up to cores and cores itself"""
+    given = sorted({int(c) for c in counts or [] if 0 < int(c) <= cores})
+    if given:
+        return given
+    measured = {cores}
+    threads = 1
+    while threads < cores:
+        measured.add(threads)
+        threads *= 2
+    return sorted(measured)
+
+
+def subsample_reads(source, target, pairs=DEFAULT_PAIRS, compress_level=1):
+    """Copy the first pairs records of a FASTQ file (gzip or plain) to a gzip file"""
+    with open(source, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    with (gzip.open(source, 'rb') if compressed else open(source, 'rb')) as src, \
+            gzip.open(tmp_path, 'wb', compresslevel=compress_level) as dst:
+        for _ in range(4 * pairs):
+            line = src.readline()
+            if not line:
+                break
+            dst.write(line)
+    os.replace(tmp_path, target)
+    return target
+
+
+def lpt_makespan(durations, slots):
+    """Finish time of durations run longest first on slots parallel slots"""
+    finish = [0.0] * max(1, slots)
+    for duration in sorted(durations, reverse=True):
+        heapq.heappush(finish, heapq.heappop(finish) + duration)
+    return max(finish)
+
+
+class ScalingProfiles:
+    """Wall-clock seconds of each stage per thread count, measured on a read subsample
+
+    Times scale linearly with the size of a sample's raw reads relative to
+    the subsample (input_bytes); thread counts between two measurements use
+    the lower one, and counts above the largest measured use the largest.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path).expanduser()
+        self._lock = threading.Lock()
+        self.data = {'version': PROFILE_VERSION, 'input_bytes': 0, 'stages': {}}
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+                if data.get('version') == PROFILE_VERSION:
+                    self.data = data
+            except (OSError, ValueError):
+                pass
+
+    @property
+    def input_bytes(self):
+        return self.data['input_bytes']
+
+    def stages(self):
+        """Stages with at least one measurement"""
+        return [stage for stage, timings in self.data['stages'].items() if timings]
+
+    def measured(self, stage):
+        """{threads: seconds} of a stage"""
+        return {int(t): seconds for t, seconds in self.data['stages'].get(stage, {}).items()}
+
+    def reset(self, input_bytes, sample, pairs):
+        """Drop previous measurements before profiling a new subsample"""
+        with self._lock:
+            self.data = {'version': PROFILE_VERSION, 'input_bytes': int(input_bytes), 'sample': sample,
+                         'pairs': pairs, 'measured': datetime.now().isoformat(timespec='seconds'), 'stages': {}}
+
+    def record(self, stage, threads, seconds):
+        """Store the time of one stage at one thread count"""
+        with self._lock:
+            self.data['stages'].setdefault(stage, {})[str(int(threads))] = round(float(seconds), 3)
+
+    def seconds(self, stage, threads, input_bytes):
+        """Projected seconds of one task of a stage on a sample of input_bytes raw reads"""
+        timings = self.measured(stage)
+        usable = [t for t in timings if t <= threads] or [min(timings)]
+        scale = input_bytes / self.input_bytes if self.input_bytes else 1.0
+        return timings[max(usable)] * scale
+
+    def speedup(self, stage, threads):
+        """Speedup of a stage at a measured thread count over its fewest measured threads"""
+        timings = self.measured(stage)
+        return timings[min(timings)] / timings[threads] if timings.get(threads) else None
+
+    def save(self):
+        """Write the profiles atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = json.dumps(self.data, indent=1)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+def plan_stage(profiles, stage, sample_bytes, cores):
+    """(threads per task, concurrent tasks, projected seconds) minimising a stage's makespan
+
+    Every measured thread count up to cores is tried. More threads must
+    be at least NOISE faster to win: ties go to fewer threads, which leaves
+    more cores to tasks of other stages.
+    """
+    best = None
+    for threads in sorted(profiles.measured(stage)):
+        if threads > cores:
+            break
+        slots = max(1, min(len(sample_bytes), cores // threads))
+        makespan = lpt_makespan([profiles.seconds(stage, threads, size) for size in sample_bytes], slots)
+        if best is None or makespan < best[2] * (1 - NOISE):
+            best = (threads, slots, makespan)
+    return best
+
+
+def plan_allocation(profiles, stages, sample_bytes, cores):
+    """{stage: (threads, concurrent tasks, projected seconds)} for the profiled stages"""
+    plan = {}
+    for stage in stages:
+        if profiles.measured(stage):
+            allocation = plan_stage(profiles, stage, sample_bytes, cores)
+            if allocation is not None:
+                plan[stage] = allocation
+    return plan
+
+
+def uniform_allocation(profiles, stages, sample_bytes, cores, threads):
+    """Projection of the same layout as plan_allocation with a fixed thread count per task"""
+    slots = max(1, min(len(sample_bytes), cores // threads))
+    return {stage: (threads, slots, lpt_makespan([profiles.seconds(stage, threads, size) for size in sample_bytes],
+                                                 slots))
+            for stage in stages if profiles.measured(stage)}
+
+
+def projected_seconds(plan):
+    """Wall-clock of a run if the stages ran one after the other (an upper bound: the DAG overlaps them)"""
+    return sum(seconds for _, _, seconds in plan.values())
@@ -0,0 +1,316 @@
+#####################################################################
+#           REPRODUCIBLE BENCHMARKS OF THE FULL PIPELINE           #
+#####################################################################
+
+# Runs 'metapipeline -m all' on synthetic metagenomes (metapipe.synthetic)
+# with the stand-in tools (metapipe.stubtools) for every combination of
+# sample count, core budget and configuration variant, and appends one JSON
+# line per run: throughput, per-stage latency, peak disk usage and scheduler
+# idle time.
+#
+#   python3 -m metapipe.benchmark /scratch/bench --samples 1 4 --cores 4 8
+
+import argparse
+import configparser
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from metapipe import stubtools, synthetic
+from metapipe.lifecycle import path_size
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+PIPELINE = REPO_DIR / "metapipeline_improved.py"
+PATTERN_F, PATTERN_R, EXTENSION = '_R1', '_R2', 'fastq.gz'
+PREFIX = 'S'
+DISK_INTERVAL = 0.5
+# Configuration variants: settings applied over config/pipeline.conf
+VARIANTS = {
+    'default': {},
+    # Sharded streaming host removal that keeps and merges the audit BAMs
+    'sharded-audit': {
+        'HOST_REMOVAL': {'streaming': 'true', 'keep_bam': 'true'},
+        'SCHEDULER': {'shards': '2', 'shard_min_gb': '0'},
+    },
+}
+
+
+class DiskSampler:
+    """Largest size of a directory tree seen while a run is in progress"""
+
+    def __init__(self, path, interval=DISK_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while True:
+            try:
+                self.peak = max(self.peak, path_size(self.path))
+            except OSError:
+                # Files deleted while the tree was walked
+                pass
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, path_size(self.path))
+
+
+def repo_revision():
+    """VERSION file and git commit of the pipeline being measured"""
+    version_file = REPO_DIR / "VERSION"
+    version = version_file.read_text().splitlines()[0].strip() if version_file.exists() else None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return version, commit
+
+
+def prepare_databases(workdir):
+    """Placeholder database paths accepted by the pipeline and the stand-in tools"""
+    db_dir = Path(workdir) / "databases"
+    kraken_db = db_dir / "kraken2"
+    kraken_db.mkdir(parents=True, exist_ok=True)
+    for name in ('hash.k2d', 'opts.k2d', 'taxo.k2d'):
+        (kraken_db / name).touch()
+    for name in ('phylophlan', 'eggnog', 'kofam_profiles'):
+        (db_dir / name).mkdir(exist_ok=True)
+    (db_dir / "ko_list").touch()
+    return {
+        'bowtieDB': str(db_dir / "host"),
+        'krakenDB': str(kraken_db),
+        'phylophlanDB': str(db_dir / "phylophlan"),
+        'eggNOGDB': str(db_dir / "eggnog"),
+        'koProfiles': str(db_dir / "kofam_profiles"),
+        'koList': str(db_dir / "ko_list"),
+    }
+
+
+def write_config(path, run_dir, variant='default'):
+    """Copy of the pipeline configuration keeping every cache and log of a run in run_dir"""
+    config = configparser.ConfigParser(interpolation=None)
+    config.read(REPO_DIR / "config" / "pipeline.conf")
+    for section in ('RESOURCES', 'METRICS', 'SCHEDULER'):
+        if not config.has_section(section):
+            config.add_section(section)
+    for section, settings in VARIANTS[variant].items():
+        if not config.has_section(section):
+            config.add_section(section)
+        config[section].update(settings)
+    # Cold caches every run, so repeated runs measure the same work
+    config['DEFAULT']['checksum_cache'] = str(run_dir / "cache" / "checksums.json")
+    config['DEFAULT']['tool_cache'] = str(run_dir / "cache" / "tool_versions.json")
+    config['RESOURCES']['memory_history'] = str(run_dir / "cache" / "memory_history.json")
+    config['METRICS']['events_log'] = str(run_dir / "step_metrics.jsonl")
+    config['SCHEDULER']['timeline'] = str(run_dir / "timeline.json")
+    with open(path, 'w') as f:
+        config.write(f)
+    return path
+
+
+def stage_latency(timeline):
+    """Task count, mean, max and summed wall seconds of each stage"""
+    stages = {}
+    for task in timeline['tasks']:
+        if task['end'] is None:
+            continue
+        stages.setdefault(task['stage'] or task['name'], []).append(task['end'] - task['start'])
+    return {stage: {'tasks': len(times), 'mean_seconds': round(sum(times) / len(times), 3),
+                    'max_seconds': round(max(times), 3), 'total_seconds': round(sum(times), 3)}
+            for stage, times in stages.items()}
+
+
+def scheduler_idle(timeline):
+    """Core-seconds the scheduler left unused between its first and last task"""
+    if timeline['start'] is None or timeline['end'] is None:
+        return {'span_seconds': 0.0, 'busy_core_seconds': 0.0, 'idle_core_seconds': 0.0, 'idle_fraction': None}
+    span = timeline['end'] - timeline['start']
+    busy = sum(t['cores'] * (t['end'] - t['start']) for t in timeline['tasks'] if t['end'] is not None)
+    capacity = timeline['max_cores'] * span
+    idle = max(0.0, capacity - busy)
+    return {'span_seconds': round(span, 3), 'busy_core_seconds': round(busy, 3), 'idle_core_seconds': round(idle, 3),
+            'idle_fraction': round(idle / capacity, 4) if capacity else None}
+
+
+class Benchmark:
+    """One work directory holding the reads, stand-in tools and per-run projects"""
+
+    def __init__(self, workdir, pairs=100000, read_length=150, genomes=8, genome_length=200000, seed=1,
+                 profile=None, jobs=None, keep=False):
+        self.workdir = Path(workdir).resolve()
+        self.pairs = pairs
+        self.read_length = read_length
+        self.genomes = genomes
+        self.genome_length = genome_length
+        self.seed = seed
+        self.profile = Path(profile).resolve() if profile else None
+        self.jobs = jobs
+        self.keep = keep
+        self.version, self.commit = repo_revision()
+
+    def prepare(self, max_samples):
+        """Generate the reads of max_samples samples (once) and install the stand-in tools"""
+        self.reads_dir = self.workdir / "reads"
+        manifest_path = self.reads_dir / "community.json"
+        settings = {'pairs': self.pairs, 'read_length': self.read_length, 'seed': self.seed}
+        manifest = {}
+        if manifest_path.exists():
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        if (any(manifest.get(key) != value for key, value in settings.items())
+                or len(manifest.get('samples', {})) < max_samples
+                or len(manifest.get('genomes', [])) != self.genomes
+                or manifest['genomes'][0]['length'] != self.genome_length):
+            print(f"Writing {max_samples} synthetic samples of {self.pairs} read pairs to {self.reads_dir}")
+            synthetic.write_samples(self.reads_dir, max_samples, self.pairs, self.read_length, self.genomes,
+                                    self.genome_length, seed=self.seed, prefix=PREFIX, pattern_f=PATTERN_F,
+                                    pattern_r=PATTERN_R, extension=EXTENSION)
+        self.bin_dir = stubtools.install(self.workdir / "bin")
+        self.databases = prepare_databases(self.workdir)
+
+    def reads_for(self, samples):
+        """Directory with the reads of the first n samples only"""
+        subset = self.workdir / f"reads_{samples}"
+        subset.mkdir(exist_ok=True)
+        for i in range(1, samples + 1):
+            for pattern in (PATTERN_F, PATTERN_R):
+                name = f"{PREFIX}{i}{pattern}.{EXTENSION}"
+                link = subset / name
+                if not link.exists():
+                    link.symlink_to(self.reads_dir / name)
+        return subset
+
+    def pipeline_command(self, cores):
+        """Full pipeline call on the placeholder databases"""
+        db = self.databases
+        cmd = [sys.executable, str(PIPELINE), 'metapipeline', '-m', 'all', '-t', str(cores),
+               '-p1', PATTERN_F, '-p2', PATTERN_R, '-e', EXTENSION, '-n', PREFIX, '-opt', '1',
+               '-bDB', db['bowtieDB'], '-kDB', db['krakenDB'], '-pDB', db['phylophlanDB'],
+               '-eDB', db['eggNOGDB'], '-profile', db['koProfiles'], '-kL', db['koList']]
+        if self.jobs:
+            cmd += ['-j', str(self.jobs)]
+        return cmd
+
+    def run(self, samples, cores, repeat=0, variant='default'):
+        """Set up a fresh project and time one full pipeline run"""
+        run_name = f"n{samples}_c{cores}_r{repeat}" + ('' if variant == 'default' else f"_{variant}")
+        run_dir = self.workdir / "runs" / run_name
+        if run_dir.exists():
+            shutil.rmtree(run_dir)
+        project = run_dir / "project"
+        run_dir.mkdir(parents=True)
+        env = dict(os.environ)
+        env['PATH'] = f"{self.bin_dir}{os.pathsep}{env.get('PATH', '')}"
+        env['METAPIPELINE_CONFIG'] = str(write_config(run_dir / "pipeline.conf", run_dir, variant))
+        if self.profile:
+            env['METAPIPELINE_STUB_PROFILE'] = str(self.profile)
+
+        with open(run_dir / "pipeline.log", 'w') as log:
+            subprocess.run([sys.executable, str(PIPELINE), 'setup', str(self.reads_for(samples)), str(project),
+                            PATTERN_F, EXTENSION, '--mode', 'symlink'],
+                           cwd=run_dir, env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+            baseline = path_size(project)
+            print(f"Running {run_name}")
+            start = time.time()
+            with DiskSampler(project) as disk:
+                result = subprocess.run(self.pipeline_command(cores), cwd=project, env=env, stdout=log,
+                                        stderr=subprocess.STDOUT)
+            wall = time.time() - start
+
+        timeline = {'max_cores': cores, 'start': None, 'end': None, 'tasks': []}
+        if (run_dir / "timeline.json").exists():
+            with open(run_dir / "timeline.json") as f:
+                timeline = json.load(f)
+        pairs = samples * self.pairs
+        record = {
+            'run': run_name,
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'version': self.version,
+            'commit': self.commit,
+            'samples': samples,
+            'cores': cores,
+            'jobs': self.jobs,
+            'repeat': repeat,
+            'variant': variant,
+            'pairs_per_sample': self.pairs,
+            'read_length': self.read_length,
+            'stub_profile': str(self.profile) if self.profile else None,
+            'returncode': result.returncode,
+            'failed_tasks': [t['name'] for t in timeline['tasks'] if t['state'] == 'failed'],
+            'wall_seconds': round(wall, 3),
+            'throughput': {'read_pairs_per_second': round(pairs / wall, 2),
+                           'bases_per_second': round(2 * pairs * self.read_length / wall, 1),
+                           'samples_per_hour': round(3600 * samples / wall, 3)},
+            'stages': stage_latency(timeline),
+            'disk': {'baseline_bytes': baseline, 'peak_bytes': disk.peak,
+                     'peak_added_bytes': max(0, disk.peak - baseline)},
+            'scheduler': scheduler_idle(timeline),
+        }
+        if not self.keep:
+            shutil.rmtree(project, ignore_errors=True)
+        return record
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Benchmark the full pipeline on synthetic metagenomes "
+                                                 "with stand-in tools")
+    parser.add_argument("workdir", help="Directory for reads, stand-in tools and run projects")
+    parser.add_argument("--samples", type=int, nargs='+', default=[1, 4], help="Sample counts to run")
+    parser.add_argument("--cores", type=int, nargs='+', default=[4], help="Core budgets (-t) to run")
+    parser.add_argument("--variants", nargs='+', default=['default'], choices=sorted(VARIANTS),
+                        help="Configuration variants to run")
+    parser.add_argument("--repeats", type=int, default=1, help="Runs of each combination")
+    parser.add_argument("-j", "--jobs", type=int, help="Concurrent tasks (default: the pipeline's auto)")
+    parser.add_argument("-n", "--pairs", type=int, default=100000, help="Read pairs per sample")
+    parser.add_argument("-l", "--read-length", type=int, default=150, help="Read length")
+    parser.add_argument("-g", "--genomes", type=int, default=8, help="Genomes in the mock community")
+    parser.add_argument("--genome-length", type=int, default=200000, help="Length of each genome")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the reads")
+    parser.add_argument("--profile", help="JSON of per-tool stand-in load (CPU, memory, I/O), see stubtools.py")
+    parser.add_argument("-o", "--output", help="JSONL results, appended (default: <workdir>/results.jsonl)")
+    parser.add_argument("--keep", action="store_true", help="Keep the project directory of every run")
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args.workdir, args.pairs, args.read_length, args.genomes, args.genome_length, args.seed,
+                          args.profile, args.jobs, args.keep)
+    benchmark.workdir.mkdir(parents=True, exist_ok=True)
+    benchmark.prepare(max(args.samples))
+    output = Path(args.output or benchmark.workdir / "results.jsonl")
+
+    print("variant\tsamples\tcores\twall_s\tpairs/s\tidle\tpeak_disk_MB\tstatus")
+    for variant in args.variants:
+        for samples in args.samples:
+            for cores in args.cores:
+                for repeat in range(args.repeats):
+                    record = benchmark.run(samples, cores, repeat, variant)
+                    with open(output, 'a') as f:
+                        f.write(json.dumps(record) + '\n')
+                    idle = record['scheduler']['idle_fraction']
+                    status = 'ok' if record['returncode'] == 0 else f"failed: {', '.join(record['failed_tasks'])}"
+                    print(f"{variant}\t{samples}\t{cores}\t{record['wall_seconds']:.1f}\t"
+                          f"{record['throughput']['read_pairs_per_second']:.0f}\t"
+                          f"{'-' if idle is None else f'{idle:.1%}'}\t"
+                          f"{record['disk']['peak_added_bytes'] / 1e6:.1f}\t{status}")
+    print(f"Results appended to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#####################################################################
+#                  CONTENT-ADDRESSED STEP CACHE                    #
+#####################################################################
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from metapipe.checksums import hash_file
+
+MANIFEST_VERSION = 1
+
+
+def output_present(path):
+    """True for an existing file or a non-empty directory"""
+    if os.path.isdir(path):
+        return any(os.scandir(path))
+    return os.path.exists(path)
+
+
+class StepCache:
+    """Persistent manifest of completed steps keyed by their inputs and parameters
+
+    Every step key is a hash of the parameters (tool version, databases,
+    options) and of the content of each input file. File hashes are
+    remembered by (size, mtime), so an unchanged file is never read twice;
+    a rewritten file with identical content keeps its hash and does not
+    invalidate the steps that consume it.
+    """
+
+    def __init__(self, manifest_path, logger=None):
+        self.manifest_path = Path(manifest_path)
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.manifest = self._load()
+
+    def _load(self):
+        """Read the manifest, starting afresh when missing or unreadable"""
+        empty = {'version': MANIFEST_VERSION, 'files': {}, 'steps': {}, 'released': {}}
+        if not self.manifest_path.exists():
+            return empty
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable cache manifest {self.manifest_path}: {e}")
+            return empty
+        if manifest.get('version') != MANIFEST_VERSION:
+            return empty
+        manifest.setdefault('released', {})
+        return manifest
+
+    def save(self):
+        """Write the manifest atomically"""
+        with self._lock:
+            data = json.dumps(self.manifest, indent=1, sort_keys=True)
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_name(f"{self.manifest_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.manifest_path)
+
+    def file_digest(self, path):
+        """Content hash of a file, reusing the stored one while size and mtime match"""
+        path = str(path)
+        st = os.stat(path)
+        with self._lock:
+            entry = self.manifest['files'].get(path)
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return entry['sha256']
+
+        digest = hash_file(path)
+        with self._lock:
+            self.manifest['files'][path] = {
+                'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns,
+                'sha256': digest,
+            }
+        return digest
+
+    def step_key(self, inputs, params):
+        """Hash of the step parameters and the content of its inputs"""
+        key = hashlib.sha256()
+        key.update(json.dumps(params, sort_keys=True, default=str).encode())
+        for path in sorted(str(p) for p in inputs):
+            if os.path.isfile(path):
+                digest = self.file_digest(path)
+            else:
+                # A deleted intermediate keeps the hash it had when released
+                with self._lock:
+                    digest = self.manifest['released'].get(path, 'missing')
+            key.update(f"\0{path}\0{digest}".encode())
+        return key.hexdigest()
+
+    def is_current(self, name, key):
+        """True when the step already ran with this key and its outputs still exist"""
+        with self._lock:
+            entry = self.manifest['steps'].get(name)
+        if not entry or entry['key'] != key:
+            return False
+        with self._lock:
+            released = set(self.manifest['released'])
+        return all(output in released or output_present(output) for output in entry['outputs'])
+
+    def record(self, name, key, outputs):
+        """Store a successful step and persist the manifest"""
+        with self._lock:
+            for output in outputs:
+                self.manifest['released'].pop(str(output), None)
+            self.manifest['steps'][name] = {
+                'key': key,
+                'outputs': [str(o) for o in outputs],
+                'completed': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+        self.save()
+
+    def release(self, path):
+        """Remember an intermediate about to be deleted, so its consumers stay cached"""
+        path = str(path)
+        digest = self.file_digest(path) if os.path.isfile(path) else 'released'
+        with self._lock:
+            self.manifest['released'][path] = digest
+        self.save()
+
+    def was_released(self, path):
+        """True when path (a file, or a directory of them) was deleted as a released intermediate"""
+        path = str(path)
+        if output_present(path):
+            return False
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock:
+            return any(p == path or p.startswith(prefix) for p in self.manifest['released'])
+
+    def reset(self):
+        """Forget every step but keep the file hashes"""
+        with self._lock:
+            self.manifest['steps'] = {}
+
+    def invalidate(self, name):
+        """Forget a step so that it runs again"""
+        with self._lock:
+            self.manifest['steps'].pop(name, None)
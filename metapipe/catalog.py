@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+#####################################################################
+#            SQLITE CATALOGUE OF SAMPLES, ASSEMBLIES, MAGS         #
+#####################################################################
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    sample TEXT PRIMARY KEY,
+    reads1 TEXT,
+    reads2 TEXT
+);
+CREATE TABLE IF NOT EXISTS assemblies (
+    sample TEXT PRIMARY KEY,
+    scaffolds TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bins (
+    bin TEXT PRIMARY KEY,
+    sample TEXT NOT NULL,
+    mag TEXT NOT NULL,
+    fasta TEXT NOT NULL,
+    filtered TEXT,
+    genus TEXT
+);
+CREATE INDEX IF NOT EXISTS bins_sample ON bins (sample);
+CREATE TABLE IF NOT EXISTS status (
+    sample TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    PRIMARY KEY (sample, stage)
+);
+"""
+
+
+def mag_name(bin_name):
+    """MAG directory name used by the annotation scripts: S1.001 -> S1_001"""
+    return bin_name.replace('.', '_', 1).split('.')[0]
+
+
+class Catalogue:
+    """Samples, assemblies, bins and stage status of a project in one SQLite file
+
+    The pipeline is the only writer; stage scripts read their work lists
+    through the command line below instead of globbing results/.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        if readonly:
+            self.db = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self.db.executescript("DROP TABLE IF EXISTS samples; DROP TABLE IF EXISTS assemblies; "
+                                      "DROP TABLE IF EXISTS bins; DROP TABLE IF EXISTS status;")
+                self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.db.executescript(SCHEMA)
+        self.db.row_factory = sqlite3.Row
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            self.db.close()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self.db.execute(sql, params)]
+
+    def add_samples(self, reads):
+        """Record {sample: (mate 1, mate 2)} read files"""
+        with self._lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?)",
+                                [(sample, str(r1), str(r2)) for sample, (r1, r2) in reads.items()])
+
+    def samples(self):
+        """Sample names in order"""
+        return [row['sample'] for row in self._query("SELECT sample FROM samples ORDER BY sample")]
+
+    def record_assembly(self, sample, scaffolds):
+        """Record a sample's scaffolds, or forget them when the file is missing"""
+        with self._lock, self.db:
+            if os.path.exists(scaffolds):
+                self.db.execute("INSERT OR REPLACE INTO assemblies VALUES (?, ?, ?)",
+                                (sample, str(scaffolds), os.path.getsize(scaffolds)))
+            else:
+                self.db.execute("DELETE FROM assemblies WHERE sample = ?", (sample,))
+
+    def assemblies(self):
+        """{sample: scaffolds} of the non-empty assemblies"""
+        rows = self._query("SELECT sample, scaffolds FROM assemblies WHERE size > 0 ORDER BY sample")
+        return {row['sample']: Path(row['scaffolds']) for row in rows}
+
+    def scan_bins(self, sample, maxbin_dir, genera=None):
+        """Replace the bins of a sample with those in its MaxBin directory
+
+        The directory is listed once: <sample>.NNN.fasta are the bins and
+        <sample>_NNN_filtered.fasta.gz their length-filtered MAGs. genera
+        maps bin names to PhyloPhlAn genera (None when unnamed).
+        """
+        maxbin_dir = Path(maxbin_dir)
+        names = set(os.listdir(maxbin_dir)) if maxbin_dir.is_dir() else set()
+        genera = genera or {}
+        rows = []
+        for name in sorted(names):
+            if not (name.startswith(f"{sample}.") and name.endswith('.fasta')):
+                continue
+            bin_name = name[:-len('.fasta')]
+            mag = mag_name(bin_name)
+            filtered = f"{mag}_filtered.fasta.gz"
+            rows.append((bin_name, sample, mag, str(maxbin_dir / name),
+                         str(maxbin_dir / filtered) if filtered in names else None, genera.get(bin_name)))
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM bins WHERE sample = ?", (sample,))
+            self.db.executemany("INSERT OR REPLACE INTO bins VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def record_taxonomy(self, sample, genera):
+        """Set the genus of each bin of a sample from {bin: genus}"""
+        with self._lock, self.db:
+            self.db.execute("UPDATE bins SET genus = NULL WHERE sample = ?", (sample,))
+            self.db.executemany("UPDATE bins SET genus = ? WHERE bin = ? AND sample = ?",
+                                [(genus, bin_name, sample) for bin_name, genus in genera.items()])
+
+    def has_bins(self, sample):
+        """Whether the bins of a sample were ever scanned"""
+        return bool(self._query("SELECT 1 FROM bins WHERE sample = ? LIMIT 1", (sample,)))
+
+    def bins(self, sample, filtered=False):
+        """Bins of a sample in name order, optionally only those with a filtered MAG"""
+        sql = "SELECT * FROM bins WHERE sample = ?"
+        if filtered:
+            sql += " AND filtered IS NOT NULL"
+        return self._query(sql + " ORDER BY bin", (sample,))
+
+    def set_status(self, sample, stage, status):
+        """Record the outcome of a stage for a sample"""
+        with self._lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO status VALUES (?, ?, ?, ?)",
+                            (sample, stage, status, datetime.now().isoformat(timespec='seconds')))
+
+    def status(self, sample=None):
+        """{(sample, stage): status}"""
+        if sample is None:
+            rows = self._query("SELECT sample, stage, status FROM status")
+        else:
+            rows = self._query("SELECT sample, stage, status FROM status WHERE sample = ?", (sample,))
+        return {(row['sample'], row['stage']): row['status'] for row in rows}
+
+
+def main():
+    """Command line entry point used by the stage scripts"""
+    parser = argparse.ArgumentParser(description="Query the pipeline catalogue")
+    parser.add_argument("catalogue", help="Catalogue database (results/catalogue.sqlite)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("samples", help="Sample names, one per line")
+    subparsers.add_parser("assemblies", help="Assembled samples, one per line")
+    bins_parser = subparsers.add_parser("bins", help="Bins of a sample: bin, MAG and genus, tab separated")
+    bins_parser.add_argument("sample")
+    bins_parser.add_argument("--filtered", action="store_true", help="Only bins with a length-filtered MAG")
+    args = parser.parse_args()
+
+    catalogue = Catalogue(args.catalogue, readonly=True)
+    if args.command == "samples":
+        lines = catalogue.samples()
+    elif args.command == "assemblies":
+        lines = list(catalogue.assemblies())
+    else:
+        lines = [f"{row['bin']}\t{row['mag']}\t{row['genus'] or ''}"
+                 for row in catalogue.bins(args.sample, args.filtered)]
+    sys.stdout.writelines(line + '\n' for line in lines)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#####################################################################
+#                  PARALLEL CHECKSUM VERIFICATION                  #
+#####################################################################
+
+import csv
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import xxhash
+except ImportError:  # optional, only needed for the xxh* algorithms
+    xxhash = None
+
+HASH_BUFFER = 8 * 1024 * 1024
+DEFAULT_CACHE = Path.home() / ".cache" / "metapipeline" / "checksums.json"
+ALGORITHMS = ['md5', 'sha256', 'xxh64', 'xxh3_64']
+
+
+def new_digest(algorithm):
+    """Hash object for a hashlib or xxhash algorithm name"""
+    if algorithm.startswith('xxh'):
+        if xxhash is None:
+            raise RuntimeError(f"{algorithm} requires the xxhash module (pip install xxhash)")
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+
+def hash_file(path, algorithm='sha256', buffer_size=HASH_BUFFER):
+    """Hash a file with large buffered reads (hashlib releases the GIL)"""
+    digest = new_digest(algorithm)
+    with open(path, 'rb', buffering=0) as handle:
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+        while True:
+            n = handle.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def parse_manifest(manifest_file):
+    """Index a checksum manifest ('<hash>  <file>' per line) by file name"""
+    index = {}
+    with open(manifest_file) as f:
+        for line in f:
+            fields = line.strip().split(None, 1)
+            if len(fields) != 2:
+                continue
+            checksum, name = fields
+            # md5sum marks binary mode with a leading '*'
+            name = name.lstrip('*').strip()
+            index[os.path.basename(name)] = checksum.lower()
+    return index
+
+
+def sample_name(path, extension):
+    """File name without its extension, as the original shell script reported it"""
+    name = os.path.basename(path)
+    suffix = f".{extension}"
+    return name[:-len(suffix)] if name.endswith(suffix) else name
+
+
+class ChecksumCache:
+    """Checksums remembered by (path, size, mtime) across runs"""
+
+    def __init__(self, path=DEFAULT_CACHE):
+        self.path = Path(path).expanduser()
+        self._lock = threading.Lock()
+        self.entries = {}
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, path, algorithm):
+        """Stored checksum while the file is unchanged, else None"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            entry = self.entries.get(path)
+        if not entry or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+            return None
+        return entry['digests'].get(algorithm)
+
+    def put(self, path, algorithm, checksum, st=None):
+        """Remember a checksum for the current version of a file"""
+        path = os.path.abspath(path)
+        st = st or os.stat(path)
+        with self._lock:
+            entry = self.entries.get(path)
+            if not entry or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+                entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'digests': {}}
+                self.entries[path] = entry
+            entry['digests'][algorithm] = checksum
+
+    def checksum(self, path, algorithm):
+        """Cached checksum, hashing the file only when it is new or changed"""
+        checksum = self.get(path, algorithm)
+        if checksum is None:
+            st = os.stat(path)
+            checksum = hash_file(path, algorithm)
+            self.put(path, algorithm, checksum, st)
+        return checksum
+
+    def save(self):
+        """Write the cache atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = json.dumps(self.entries)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+def verify_reads(reads_dir, manifest_file, extension, output, algorithm='md5', threads=4, cache=None):
+    """Check every file in reads_dir against the manifest and write <output>.csv"""
+    index = parse_manifest(manifest_file)
+    cache = cache or ChecksumCache()
+    files = sorted(p for p in Path(reads_dir).iterdir() if p.is_file())
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        checksums = list(pool.map(lambda p: cache.checksum(p, algorithm), files))
+    cache.save()
+
+    label = 'md5sum' if algorithm == 'md5' else algorithm
+    rows = []
+    for path, checksum in zip(files, checksums):
+        expected = index.get(path.name, '')
+        rows.append({
+            'sample': sample_name(path, extension),
+            f'{label}_Original': expected,
+            f'{label}_fileDownload': checksum,
+            'result': 'correct' if expected == checksum else 'incorrect',
+        })
+
+    with open(f"{output}.csv", 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['sample', f'{label}_Original', f'{label}_fileDownload', 'result'])
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
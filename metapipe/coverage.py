@@ -0,0 +1,195 @@
+#####################################################################
+#              SHARED PER-CONTIG COVERAGE FOR BINNING              #
+#####################################################################
+
+import os
+import subprocess
+from pathlib import Path
+
+from metapipe.eggnog_batch import bin_membership, read_fasta
+
+SKIPPED_FLAGS = 0x4 | 0x100 | 0x800  # unmapped, secondary, supplementary
+
+
+def contig_lengths(fasta):
+    """{contig: length} of an assembly, in file order"""
+    return {name: len(sequence) for name, sequence in read_fasta(fasta)}
+
+
+def index_command(scaffolds, index_prefix, threads):
+    """bowtie2-build call for the contigs of one assembly"""
+    return ['bowtie2-build', '--threads', str(threads), '-q', str(scaffolds), str(index_prefix)]
+
+
+def mapping_commands(index_prefix, reads1, reads2, threads, tmp_prefix):
+    """bowtie2 | samtools sort | samtools coverage for one read set
+
+    Alignments are never parsed in Python: samtools sorts them (spilling
+    to tmp_prefix.*) and reports reads and mean depth per contig, counting
+    primary alignments only.
+    """
+    return [
+        ['bowtie2', '-p', str(threads), '-x', str(index_prefix), '-1', str(reads1), '-2', str(reads2), '--no-unal'],
+        ['samtools', 'sort', '-@', str(threads), '-u', '-T', str(tmp_prefix), '-'],
+        ['samtools', 'coverage', '--ff', str(SKIPPED_FLAGS), '-'],
+    ]
+
+
+def depth_from_coverage(lines, lengths):
+    """Mean depth and mapped reads per contig from a 'samtools coverage' table"""
+    depth = dict.fromkeys(lengths, 0.0)
+    reads = dict.fromkeys(lengths, 0)
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        fields = line.rstrip('\n').split('\t')
+        contig = fields[0]
+        if contig in depth:
+            reads[contig] = int(fields[3])
+            depth[contig] = float(fields[6])
+    return depth, reads
+
+
+def map_depth(index_prefix, reads1, reads2, lengths, threads, log_path=None, tmp_prefix=None):
+    """Stream bowtie2 alignments of one read set through samtools into per-contig depths"""
+    tmp_prefix = tmp_prefix or f"{index_prefix}.sort"
+    commands = mapping_commands(index_prefix, reads1, reads2, threads, tmp_prefix)
+    processes = []
+    with open(log_path or os.devnull, 'w') as log:
+        try:
+            source = None
+            for i, cmd in enumerate(commands):
+                last = i == len(commands) - 1
+                processes.append(subprocess.Popen(cmd, stdin=source, stdout=subprocess.PIPE, stderr=log,
+                                                  text=last))
+                if source is not None:
+                    # The next process holds the pipe now
+                    source.close()
+                source = processes[-1].stdout
+            depth, reads = depth_from_coverage(processes[-1].stdout, lengths)
+        finally:
+            for process in processes:
+                if process.stdout is not None:
+                    process.stdout.close()
+            returncodes = [process.wait() for process in processes]
+    for cmd, returncode in zip(commands, returncodes):
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+    return depth, reads
+
+
+class CoverageTable:
+    """Depth and mapped reads of every contig of one assembly, per read set
+
+    Columns are read sets (samples whose reads were mapped); the assembly's
+    own sample comes first. Saved as a TSV with a depth and a reads column
+    per read set, which MaxBin, CheckM and the abundance report all reuse.
+    """
+
+    def __init__(self, lengths):
+        self.lengths = dict(lengths)
+        self.samples = []
+        self.depth = {}
+        self.reads = {}
+
+    def add(self, sample, depth, reads):
+        """Add (or replace) the column of one read set"""
+        if sample not in self.samples:
+            self.samples.append(sample)
+        self.depth[sample] = depth
+        self.reads[sample] = reads
+
+    def save(self, path):
+        """Write the table atomically"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write('\t'.join(['contig', 'length'] + [f"{s}_{c}" for s in self.samples for c in ('depth', 'reads')]))
+            f.write('\n')
+            for contig, length in self.lengths.items():
+                values = [f"{self.depth[s][contig]:.4f}\t{self.reads[s][contig]}" for s in self.samples]
+                f.write('\t'.join([contig, str(length)] + values) + '\n')
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a saved table"""
+        with open(path) as f:
+            header = f.readline().rstrip('\n').split('\t')
+            samples = [column[:-len('_depth')] for column in header[2::2]]
+            table = cls({})
+            for sample in samples:
+                table.add(sample, {}, {})
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                contig = fields[0]
+                table.lengths[contig] = int(fields[1])
+                for i, sample in enumerate(samples):
+                    table.depth[sample][contig] = float(fields[2 + 2 * i])
+                    table.reads[sample][contig] = int(fields[3 + 2 * i])
+        return table
+
+    def write_maxbin_abundance(self, directory):
+        """One MaxBin abundance file per read set and the -abund_list naming them"""
+        directory = Path(directory)
+        files = []
+        for sample in self.samples:
+            path = directory / f"{sample}.abund"
+            with open(path, 'w') as f:
+                for contig in self.lengths:
+                    f.write(f"{contig}\t{self.depth[sample][contig]:.4f}\n")
+            files.append(path)
+        abund_list = directory / "abund_list.txt"
+        with open(abund_list, 'w') as f:
+            f.writelines(f"{path.resolve()}\n" for path in files)
+        return abund_list
+
+    def write_checkm_coverage(self, path, memberships):
+        """Coverage file in the layout of 'checkm coverage', for 'checkm profile'"""
+        with open(path, 'w') as f:
+            f.write("Sequence Id\tBin Id\tSequence length (bp)")
+            f.write("\tBam Id\tCoverage\tMapped reads" * len(self.samples))
+            f.write('\n')
+            for contig, length in self.lengths.items():
+                if contig not in memberships:
+                    continue
+                row = [contig, memberships[contig], str(length)]
+                for sample in self.samples:
+                    row += [sample, f"{self.depth[sample][contig]:.4f}", str(self.reads[sample][contig])]
+                f.write('\t'.join(row) + '\n')
+
+    def mag_abundance(self, memberships):
+        """{MAG: (contigs, bases, {sample: (mean depth, relative abundance %)})}
+
+        The mean depth of a MAG is weighted by contig length; its relative
+        abundance is its share of all covered bases of the assembly in that
+        read set, so unbinned contigs make up the remainder.
+        """
+        totals = {s: sum(self.depth[s][c] * n for c, n in self.lengths.items()) for s in self.samples}
+        mags = {}
+        for contig, mag in memberships.items():
+            if contig in self.lengths:
+                mags.setdefault(mag, []).append(contig)
+        report = {}
+        for mag, contigs in sorted(mags.items()):
+            bases = sum(self.lengths[c] for c in contigs)
+            values = {}
+            for sample in self.samples:
+                covered = sum(self.depth[sample][c] * self.lengths[c] for c in contigs)
+                values[sample] = (covered / bases if bases else 0.0,
+                                  100.0 * covered / totals[sample] if totals[sample] else 0.0)
+            report[mag] = (len(contigs), bases, values)
+        return report
+
+    def write_mag_abundance(self, path, maxbin_dir, fastas=None):
+        """MAG relative-abundance report for the bins in maxbin_dir (or the given bin FASTAs)"""
+        report = self.mag_abundance(bin_membership(maxbin_dir, fastas))
+        with open(path, 'w') as f:
+            f.write('\t'.join(['mag', 'contigs', 'length'] +
+                              [f"{s}_{c}" for s in self.samples for c in ('depth', 'relative_abundance')]) + '\n')
+            for mag, (contigs, bases, values) in report.items():
+                row = [mag, str(contigs), str(bases)]
+                for sample in self.samples:
+                    depth, share = values[sample]
+                    row += [f"{depth:.4f}", f"{share:.4f}"]
+                f.write('\t'.join(row) + '\n')
+        return report
@@ -0,0 +1,130 @@
+#####################################################################
+#                 KRAKEN2 DATABASE RESIDENCY MANAGER               #
+#####################################################################
+
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from metapipe.resources import available_memory
+
+KRAKEN_DB_FILES = ['hash.k2d', 'opts.k2d', 'taxo.k2d']
+WARM_CHUNK = 64 * 1024 * 1024
+RESIDENCY_MODES = ['off', 'prewarm', 'stage']
+
+
+def prewarm(path):
+    """Pull a file into the page cache by reading it once"""
+    with open(path, 'rb', buffering=0) as handle:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(handle.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            os.posix_fadvise(handle.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        buffer = bytearray(WARM_CHUNK)
+        while handle.readinto(buffer):
+            pass
+
+
+class KrakenDBResidency:
+    """Keep one memory-mapped Kraken2 database resident for every sample
+
+    The database is staged (copied to a local/tmpfs directory) or prewarmed
+    in the page cache once, on first use. Concurrent kraken2 processes run
+    with --memory-mapping and share those pages instead of each loading its
+    own copy. close() is called after the last consumer finishes and removes
+    a staged copy.
+    """
+
+    def __init__(self, db_path, mode='prewarm', stage_dir=None, memory_budget=None, logger=None):
+        if mode not in RESIDENCY_MODES:
+            raise ValueError(f"Unknown Kraken2 database residency mode: {mode}")
+        self.db_path = Path(db_path)
+        self.mode = mode
+        self.stage_dir = Path(stage_dir) if stage_dir else None
+        self.memory_budget = memory_budget
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._ready = False
+        self._active = 0
+        self._resident_path = self.db_path
+        self._staged = None
+
+    @property
+    def memory_mapping(self):
+        """Whether kraken2 should be run with --memory-mapping"""
+        return self.mode != 'off'
+
+    def db_size(self):
+        """Bytes kraken2 maps from the database directory"""
+        return sum((self.db_path / name).stat().st_size
+                   for name in KRAKEN_DB_FILES if (self.db_path / name).exists())
+
+    def budget(self):
+        """Memory the database may occupy: the configured budget or 80% of MemAvailable"""
+        if self.memory_budget:
+            return self.memory_budget
+        available = available_memory()
+        return int(available * 0.8) if available else None
+
+    def _prepare(self):
+        """Stage or prewarm the database once"""
+        if self.mode == 'off':
+            return
+        size = self.db_size()
+        budget = self.budget()
+        if budget is not None and size > budget:
+            self.logger.warning(f"Kraken2 database ({size / 1e9:.1f} GB) exceeds the memory budget "
+                                f"({budget / 1e9:.1f} GB); using it in place without prewarming")
+            return
+
+        start_time = time.time()
+        if self.mode == 'stage':
+            target = self.stage_dir / f"{self.db_path.name}-{os.getpid()}"
+            self.stage_dir.mkdir(parents=True, exist_ok=True)
+            free = shutil.disk_usage(self.stage_dir).free
+            if size > free:
+                self.logger.warning(f"Not enough space in {self.stage_dir} to stage the Kraken2 database; "
+                                    f"prewarming it in place instead")
+            else:
+                target.mkdir(parents=True, exist_ok=True)
+                for name in KRAKEN_DB_FILES:
+                    if (self.db_path / name).exists():
+                        shutil.copyfile(self.db_path / name, target / name)
+                self._staged = target
+                self._resident_path = target
+                self.logger.info(f"Kraken2 database staged to {target} in {time.time() - start_time:.1f} seconds")
+                return
+
+        for name in KRAKEN_DB_FILES:
+            if (self.db_path / name).exists():
+                prewarm(self.db_path / name)
+        self.logger.info(f"Kraken2 database prewarmed in the page cache in {time.time() - start_time:.1f} seconds")
+
+    def acquire(self):
+        """Database path for one consumer, preparing it on first use"""
+        with self._lock:
+            if not self._ready:
+                self._prepare()
+                self._ready = True
+            self._active += 1
+            return str(self._resident_path)
+
+    def release(self):
+        """Mark one consumer as finished"""
+        with self._lock:
+            self._active = max(0, self._active - 1)
+
+    def close(self, force=False):
+        """Drop the resident copy once no consumer is left (force: regardless, the run is over)"""
+        with self._lock:
+            if self._active and not force:
+                self.logger.warning(f"Kraken2 database still in use by {self._active} consumer(s), not releasing")
+                return
+            if self._staged is not None:
+                shutil.rmtree(self._staged, ignore_errors=True)
+                self.logger.info(f"Released staged Kraken2 database {self._staged}")
+            self._staged = None
+            self._resident_path = self.db_path
+            self._ready = False
@@ -0,0 +1,136 @@
+#####################################################################
+#               BATCHED, DEDUPLICATED EGGNOG SEARCH                #
+#####################################################################
+
+import gzip
+import hashlib
+import os
+from pathlib import Path
+
+# emapper outputs whose first column is the query gene
+SPLIT_SUFFIXES = ['.emapper.seed_orthologs', '.emapper.hits', '.emapper.annotations']
+UNBINNED = 'unbinned'
+
+
+def read_fasta(path):
+    """Stream (name, sequence) records of a plain or gzip FASTA"""
+    opener = gzip.open if str(path).endswith('.gz') else open
+    name, chunks = None, []
+    with opener(path, 'rt') as f:
+        for line in f:
+            line = line.rstrip()
+            if line.startswith('>'):
+                if name is not None:
+                    yield name, ''.join(chunks)
+                name, chunks = line[1:].split(None, 1)[0], []
+            elif line:
+                chunks.append(line)
+    if name is not None:
+        yield name, ''.join(chunks)
+
+
+def mag_name(fasta):
+    """MAG directory name used by the annotation scripts: S1.001.fasta -> S1_001"""
+    return Path(fasta).name.replace('.', '_', 1).split('.')[0]
+
+
+def bin_membership(maxbin_dir, fastas=None):
+    """{contig: MAG name} from the MaxBin bins of one sample (globbed unless given)"""
+    members = {}
+    if fastas is None:
+        sample = Path(maxbin_dir).parent.name
+        fastas = sorted(Path(maxbin_dir).glob(f"{sample}.*.fasta"))
+    for fasta in fastas:
+        for contig, _ in read_fasta(fasta):
+            members[contig] = mag_name(fasta)
+    return members
+
+
+def build_query(assemblies, query_path, provenance_path):
+    """Write every distinct contig of all samples once, with provenance
+
+    assemblies maps sample -> scaffolds FASTA. Identical sequences (within or
+    across samples) become a single query q<N>; the provenance table maps it
+    back to every (sample, contig) it came from.
+    """
+    seen = {}
+    provenance = []
+    with open(query_path, 'w') as query:
+        for sample, scaffolds in sorted(assemblies.items()):
+            for contig, sequence in read_fasta(scaffolds):
+                key = hashlib.sha1(sequence.upper().encode()).digest()
+                index = seen.get(key)
+                if index is None:
+                    index = seen[key] = len(provenance)
+                    provenance.append([])
+                    query.write(f">q{index}\n")
+                    for i in range(0, len(sequence), 80):
+                        query.write(sequence[i:i + 80] + '\n')
+                provenance[index].append((sample, contig))
+    with open(provenance_path, 'w') as f:
+        for index, origins in enumerate(provenance):
+            for sample, contig in origins:
+                f.write(f"q{index}\t{sample}\t{contig}\n")
+    return provenance
+
+
+def emapper_command(query, output_dir, prefix, eggnog_db, threads, block_size=None, index_chunks=None):
+    """One emapper run over the whole batch, with large DIAMOND blocks"""
+    cmd = ['emapper.py', '-m', 'diamond', '--no_annot', '--no_file_comments', '--report_no_hits', '--override',
+           '--data_dir', str(eggnog_db), '--cpu', str(threads), '--itype', 'metagenome',
+           '--pfam_realign', 'denovo', '-i', str(query), '-o', prefix, '--output_dir', str(output_dir)]
+    if block_size:
+        cmd += ['--block_size', str(block_size)]
+    if index_chunks:
+        cmd += ['--index_chunks', str(index_chunks)]
+    return cmd
+
+
+def split_results(batch_dir, prefix, provenance, memberships, output_root):
+    """Route batch hits back to per-sample and per-MAG emapper files
+
+    Gene q<N>_<k> becomes <contig>_<k> for every contig that shares the
+    sequence of q<N>. Each sample gets <sample>_diamond.emapper.* with all its
+    genes, and each MAG (or 'unbinned') <MAG>_diamond.emapper.* with the
+    genes on its contigs, in the layout of src/7_functionalAnnotation.sh.
+    """
+    written = []
+    for suffix in SPLIT_SUFFIXES:
+        batch_file = Path(batch_dir) / f"{prefix}{suffix}"
+        if not batch_file.exists():
+            continue
+        outputs = {}
+        header = []
+        with open(batch_file) as f:
+            for line in f:
+                if line.startswith('#'):
+                    header.append(line)
+                    continue
+                gene, rest = line.split('\t', 1)
+                query, _, number = gene.rpartition('_')
+                for sample, contig in provenance[int(query[1:])]:
+                    row = f"{contig}_{number}\t{rest}"
+                    outputs.setdefault((sample, None), []).append(row)
+                    mag = memberships.get(sample, {}).get(contig, f"{sample}_{UNBINNED}")
+                    outputs.setdefault((sample, mag), []).append(row)
+
+        for (sample, mag), rows in sorted(outputs.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+            directory = Path(output_root) / sample / mag if mag else Path(output_root) / sample
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"{mag or sample}_diamond{suffix}"
+            with open(path, 'w') as out:
+                out.writelines(header)
+                out.writelines(rows)
+            written.append(str(path))
+    return written
+
+
+def batch_inputs(assemblies_root, samples=None):
+    """{sample: scaffolds FASTA} for the assembled samples"""
+    assemblies = {}
+    for scaffolds in sorted(Path(assemblies_root).glob("*/*-scaffolds.fasta")):
+        sample = scaffolds.parent.name
+        if scaffolds.name == f"{sample}-scaffolds.fasta" and (samples is None or sample in samples) \
+                and os.path.getsize(scaffolds):
+            assemblies[sample] = scaffolds
+    return assemblies
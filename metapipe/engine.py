@@ -0,0 +1,285 @@
+#####################################################################
+#         ASYNCIO PROCESS ENGINE: STREAMED LOGS AND WATCHDOGS      #
+#####################################################################
+
+import asyncio
+import collections
+import logging
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from metapipe.profiling import TreeSampler, usage_metrics
+
+# Longest line kept whole; longer ones are written in pieces
+LINE_LIMIT = 64 * 1024
+# Last lines of a task's output repeated in the pipeline log when it fails
+TAIL_LINES = 20
+
+
+class StalledProcess(subprocess.TimeoutExpired):
+    """A command produced no output, CPU time or I/O for longer than its idle timeout"""
+
+    def __str__(self):
+        return f"Command '{self.cmd}' made no progress for {self.timeout:.0f} seconds"
+
+
+class ProcessCancelled(RuntimeError):
+    """A command was stopped, or refused, because the pipeline is shutting down"""
+
+
+class TaskLog:
+    """Append-only log of one task, rotated to <name>.1 ... <name>.<backups> past max_bytes"""
+
+    def __init__(self, path, max_bytes=64 * 2 ** 20, backups=3):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{i}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+        self.file = open(self.path, 'ab')
+        self.size = 0
+
+    def write(self, data):
+        if self.max_bytes and self.size + len(data) > self.max_bytes and self.size:
+            self.rotate()
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        self.file.close()
+
+
+def signal_group(pid, sig):
+    """Send sig to a process group, ignoring groups that are already gone"""
+    try:
+        os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class ProcessEngine:
+    """Every child process of the pipeline, run from one asyncio event loop
+
+    The loop lives in its own thread: scheduler workers call run(), which
+    blocks only the calling thread, while async callers can await
+    execute() for many commands at once. Each child gets its own process
+    group; its stdout and stderr are streamed line by line into a rotating
+    log per task, so memory stays bounded whatever the tool prints. A
+    watchdog kills the group when the command exceeds its wall-clock
+    timeout or stops making progress (no output, CPU time or I/O) for
+    idle_timeout seconds. SIGINT and SIGTERM kill every group.
+    """
+
+    def __init__(self, log_dir, max_log_bytes=64 * 2 ** 20, log_backups=3, grace=10, interval=1.0, logger=None):
+        self.log_dir = Path(log_dir)
+        self.max_log_bytes = max_log_bytes
+        self.log_backups = log_backups
+        self.grace = grace
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.cancelled = False
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        # Process group ids of the running children
+        self._groups = set()
+
+    def start(self):
+        """Start the event loop thread (done on first use)"""
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self.loop.run_forever, name="process-engine", daemon=True)
+                self._thread.start()
+        return self.loop
+
+    def close(self):
+        """Stop the event loop once the running commands are done"""
+        with self._lock:
+            loop, thread, self.loop, self._thread = self.loop, self._thread, None, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    def log_path(self, name):
+        """Log file of a task, named after its step"""
+        return self.log_dir / f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or 'command'}.log"
+
+    def run(self, cmd, name, env=None, cwd=None, capture_output=False, timeout=None, idle_timeout=None,
+            profile=True):
+        """Run cmd from a synchronous caller; returns (exit code, stdout, metrics or None)"""
+        future = asyncio.run_coroutine_threadsafe(
+            self.execute(cmd, name, env, cwd, capture_output, timeout, idle_timeout, profile), self.start())
+        return future.result()
+
+    async def _pump(self, reader, log, tag, tail, state, captured=None):
+        """Copy one output stream into the task log as its lines arrive"""
+        while True:
+            try:
+                line = await reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError as e:
+                line = e.partial
+            except asyncio.LimitOverrunError as e:
+                # No newline within the limit: pass the buffered part on as is
+                line = await reader.read(max(e.consumed, 1))
+            if not line:
+                return
+            state['last_output'] = time.time()
+            if captured is not None:
+                captured.append(line)
+            else:
+                log.write(line)
+                tail.append(f"{tag}{line.decode(errors='replace').rstrip()}")
+
+    async def _exited(self, pid):
+        """Wait for a child to exit; return its (wait status, rusage)"""
+        loop = asyncio.get_running_loop()
+        try:
+            pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            # No pidfd (Python < 3.9 or kernel < 5.3): wait in a worker thread
+            _, status, usage = await loop.run_in_executor(None, os.wait4, pid, 0)
+            return status, usage
+        readable = loop.create_future()
+        loop.add_reader(pidfd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await readable
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+        _, status, usage = os.wait4(pid, 0)
+        return status, usage
+
+    async def _stop(self, pid, exit_task):
+        """SIGTERM a process group, then SIGKILL it after the grace period"""
+        signal_group(pid, signal.SIGTERM)
+        done, _ = await asyncio.wait({exit_task}, timeout=self.grace)
+        if not done:
+            signal_group(pid, signal.SIGKILL)
+        await exit_task
+        # Anything of the group that outlived its leader
+        signal_group(pid, signal.SIGKILL)
+
+    async def execute(self, cmd, name, env=None, cwd=None, capture_output=False, timeout=None, idle_timeout=None,
+                      profile=True):
+        """Run cmd to completion; returns (exit code, stdout, metrics or None)
+
+        Raises subprocess.TimeoutExpired when the wall-clock timeout ran out,
+        StalledProcess when the command made no progress for idle_timeout
+        seconds and ProcessCancelled once the engine was cancelled.
+        """
+        if self.cancelled:
+            raise ProcessCancelled(f"Not starting {name}: the pipeline is shutting down")
+        loop = asyncio.get_running_loop()
+        log = TaskLog(self.log_path(name), self.max_log_bytes, self.log_backups)
+        log.write(f"### {datetime.now().isoformat(timespec='seconds')} {' '.join(map(str, cmd))}\n".encode())
+        start_time = time.time()
+        try:
+            proc = subprocess.Popen(cmd, env=env, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    start_new_session=True)
+        except BaseException:
+            log.close()
+            raise
+        self._groups.add(proc.pid)
+        state = {'last_output': start_time}
+        tail = collections.deque(maxlen=TAIL_LINES)
+        captured = [] if capture_output else None
+        pumps = []
+        for stream, tag, sink in ((proc.stdout, '', captured), (proc.stderr, '[stderr] ', None)):
+            reader = asyncio.StreamReader(limit=LINE_LIMIT, loop=loop)
+            transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader, loop=loop), stream)
+            pumps.append((transport, loop.create_task(self._pump(reader, log, tag, tail, state, sink))))
+
+        sampler = TreeSampler(proc.pid, self.interval)
+        exit_task = loop.create_task(self._exited(proc.pid))
+        error = None
+        progress, last_progress = None, start_time
+        try:
+            while not exit_task.done():
+                await asyncio.wait({exit_task}, timeout=self.interval)
+                if exit_task.done():
+                    break
+                now = time.time()
+                if profile or idle_timeout:
+                    sampler.sample()
+                    if sampler.progress() != progress:
+                        progress, last_progress = sampler.progress(), now
+                if self.cancelled:
+                    error = ProcessCancelled(f"{name} was stopped: the pipeline is shutting down")
+                elif timeout and now - start_time > timeout:
+                    error = subprocess.TimeoutExpired(cmd, timeout)
+                elif idle_timeout and now - max(last_progress, state['last_output']) > idle_timeout:
+                    error = StalledProcess(cmd, idle_timeout)
+                if error is not None:
+                    self.logger.warning(f"Stopping {name}: {error}")
+                    await self._stop(proc.pid, exit_task)
+                    break
+            status, usage = await exit_task
+        except BaseException:
+            # The caller gave up (loop shutdown): never leave the group behind
+            signal_group(proc.pid, signal.SIGKILL)
+            raise
+        finally:
+            self._groups.discard(proc.pid)
+            # Stray descendants holding the pipes open must not block us
+            for transport, pump in pumps:
+                try:
+                    await asyncio.wait_for(asyncio.shield(pump), timeout=self.grace)
+                except asyncio.TimeoutError:
+                    pump.cancel()
+                transport.close()
+            log.close()
+        wall = time.time() - start_time
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if error is None and self.cancelled and proc.returncode != 0:
+            # Killed by cancel() before the watchdog looked
+            error = ProcessCancelled(f"{name} was stopped: the pipeline is shutting down")
+        if error is not None:
+            raise error
+        if proc.returncode != 0 and tail:
+            self.logger.error(f"{name} exited with code {proc.returncode}; last output "
+                              f"({self.log_path(name)}):\n" + '\n'.join(tail))
+        stdout = b''.join(captured).decode(errors='replace') if captured is not None else None
+        metrics = usage_metrics(wall, proc.returncode, usage, sampler) if profile else None
+        return proc.returncode, stdout, metrics
+
+    def cancel(self, sig=signal.SIGTERM):
+        """Refuse new commands and signal every running process group
+
+        Safe to call from a signal handler; groups still alive after the
+        grace period are killed by their watchdogs.
+        """
+        self.cancelled = True
+        for pid in list(self._groups):
+            signal_group(pid, sig)
+
+    def install_signal_handlers(self):
+        """On SIGINT or SIGTERM, stop every child group before the pipeline exits (main thread only)"""
+        def handler(signum, frame):
+            self.logger.error(f"Received {signal.Signals(signum).name}, stopping {len(self._groups)} running commands")
+            self.cancel(signal.SIGTERM)
+            if signum == signal.SIGINT:
+                raise KeyboardInterrupt
+            raise SystemExit(128 + signum)
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, handler)
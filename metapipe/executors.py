@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+#####################################################################
+#          COMMAND EXECUTORS: LOCAL, SLURM AND A FILE QUEUE        #
+#####################################################################
+
+import argparse
+import logging
+import math
+import os
+import re
+import shlex
+import subprocess
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from metapipe.engine import StalledProcess
+from metapipe.profiling import kill_process_group, run_profiled
+
+BACKENDS = ['local', 'slurm', 'filequeue']
+# sacct states of jobs stopped by their time limit, and squeue states of jobs not started yet
+SLURM_TIMEOUT_STATES = {'TIMEOUT', 'DEADLINE'}
+SLURM_QUEUED_STATES = {'PENDING', 'CONFIGURING', 'REQUEUED', 'RESV_DEL_HOLD', 'REQUEUE_HOLD', 'SUSPENDED'}
+
+
+class Executor:
+    """Run commands with the same retry, timeout and status tracking on every backend
+
+    A backend implements execute(), which makes one attempt and returns
+    (exit code, stdout, metrics or None), raising subprocess.TimeoutExpired
+    when the attempt ran out of time. run() retries failed and timed-out
+    attempts and keeps the state of every command in self.jobs. A timeout
+    given to run() (a stage's own limit) replaces the executor's.
+    """
+
+    # Whether commands run on other hosts (the local memory budget does not apply)
+    remote = False
+
+    def __init__(self, retries=0, retry_delay=30, timeout=None, logger=None, on_metrics=None):
+        self.retries = max(0, int(retries))
+        self.retry_delay = retry_delay
+        self.timeout = timeout or None
+        self.logger = logger or logging.getLogger(__name__)
+        # Called with (cmd, name, env, metrics) when a backend measured a command
+        self.on_metrics = on_metrics
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def update(self, name, **fields):
+        """Record the state of a command"""
+        with self._lock:
+            self.jobs.setdefault(name, {}).update(fields)
+
+    def run(self, cmd, name, env=None, cwd=None, cores=1, memory=0, capture_output=False, timeout=None):
+        """Run cmd to completion, retrying failures; return its stdout when captured
+
+        Raises subprocess.CalledProcessError or subprocess.TimeoutExpired
+        once every attempt failed.
+        """
+        timeout = timeout or self.timeout
+        attempts = self.retries + 1
+        for attempt in range(1, attempts + 1):
+            self.update(name, state='running', attempt=attempt, returncode=None, start=time.time(), end=None)
+            try:
+                returncode, stdout, metrics = self.execute(cmd, name, env, cwd, cores, memory, capture_output,
+                                                           timeout)
+            except subprocess.TimeoutExpired as e:
+                self.update(name, state='stalled' if isinstance(e, StalledProcess) else 'timeout', end=time.time())
+                if attempt == attempts:
+                    raise
+                reason = "made no progress for" if isinstance(e, StalledProcess) else "timed out after"
+                self.logger.warning(f"{name} {reason} {e.timeout:.0f} seconds "
+                                    f"(attempt {attempt}/{attempts}), retrying in {self.retry_delay:.0f} seconds")
+            else:
+                if metrics is not None and self.on_metrics is not None:
+                    self.on_metrics(cmd, name, env, metrics)
+                self.update(name, state='done' if returncode == 0 else 'failed', returncode=returncode, end=time.time())
+                if returncode == 0:
+                    return stdout
+                if attempt == attempts:
+                    raise subprocess.CalledProcessError(returncode, cmd, output=stdout)
+                self.logger.warning(f"{name} exited with code {returncode} "
+                                    f"(attempt {attempt}/{attempts}), retrying in {self.retry_delay:.0f} seconds")
+            time.sleep(self.retry_delay)
+
+    def execute(self, cmd, name, env, cwd, cores, memory, capture_output, timeout):
+        """Make one attempt at running cmd"""
+        raise NotImplementedError
+
+    def status(self):
+        """Copy of the state of every command run so far"""
+        with self._lock:
+            return {name: dict(job) for name, job in self.jobs.items()}
+
+    def close(self):
+        """Release the backend's resources"""
+
+
+class LocalExecutor(Executor):
+    """Commands run as child processes on this host, in the scheduler's worker threads
+
+    With an engine (metapipe.engine.ProcessEngine) their output is streamed
+    into per-task logs and a command making no progress for idle_timeout
+    seconds is stopped; without one they block their thread and inherit the
+    terminal.
+    """
+
+    def __init__(self, profile=True, interval=1.0, engine=None, idle_timeout=None, **kwargs):
+        super().__init__(**kwargs)
+        self.profile = profile
+        self.interval = interval
+        self.engine = engine
+        self.idle_timeout = idle_timeout or None
+
+    def execute(self, cmd, name, env, cwd, cores, memory, capture_output, timeout):
+        if self.engine is not None:
+            return self.engine.run(cmd, name, env=env, cwd=cwd, capture_output=capture_output, timeout=timeout,
+                                   idle_timeout=self.idle_timeout, profile=self.profile)
+        if self.profile:
+            return run_profiled(cmd, env=env, cwd=cwd, capture_output=capture_output,
+                                interval=self.interval, timeout=timeout)
+        proc = subprocess.Popen(cmd, env=env, cwd=cwd, text=True, start_new_session=bool(timeout),
+                                stdout=subprocess.PIPE if capture_output else None)
+        try:
+            stdout, _ = proc.communicate(timeout=timeout)
+        except BaseException:
+            if timeout:
+                kill_process_group(proc)
+            else:
+                proc.kill()
+            proc.communicate()
+            raise
+        return proc.returncode, stdout, None
+
+
+class BatchExecutor(Executor):
+    """Commands submitted as job scripts to a batch queue and polled until they finish
+
+    Each attempt writes <job_dir>/<job>.sh, which changes to the working
+    directory, exports the variables the stage scripts read and runs the
+    command; its output goes to <job>.out and <job>.err. job_dir and the
+    project must be on a file system the execution hosts share.
+    """
+
+    remote = True
+
+    def __init__(self, job_dir, poll_interval=15, **kwargs):
+        super().__init__(**kwargs)
+        self.job_dir = Path(job_dir).expanduser().resolve()
+        self.poll_interval = poll_interval
+
+    def directives(self, job, cores, memory, timeout):
+        """Header lines carrying the resource request of a job"""
+        return []
+
+    def write_script(self, cmd, name, env, cwd, cores, memory, timeout):
+        """Job script running one attempt of cmd; returns (job name, script path)"""
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        job = f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_')}-{uuid.uuid4().hex[:8]}"
+        script = self.job_dir / f"{job}.sh"
+        lines = ['#!/bin/bash'] + self.directives(job, cores, memory, timeout)
+        lines.append(f"cd {shlex.quote(str(Path(cwd or os.getcwd()).resolve()))}")
+        # Only what differs from the submitting environment (METAPIPELINE_*, TMPDIR, ...)
+        for key, value in sorted((env or {}).items()):
+            if os.environ.get(key) != value:
+                lines.append(f"export {key}={shlex.quote(value)}")
+        lines.append(' '.join(shlex.quote(str(arg)) for arg in cmd))
+        tmp_path = f"{script}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.chmod(tmp_path, 0o755)
+        os.replace(tmp_path, script)
+        return job, script
+
+    def execute(self, cmd, name, env, cwd, cores, memory, capture_output, timeout):
+        job, script = self.write_script(cmd, name, env, cwd, cores, memory, timeout)
+        job_id = self.submit(job, script)
+        self.update(name, state='queued', job_id=job_id, script=str(script))
+        self.logger.info(f"Submitted {name} as job {job_id} ({cores} cores"
+                         f"{f', {memory / 1e9:.1f} GB' if memory else ''}), output in {self.job_dir / job}.out")
+        started = None
+        try:
+            while True:
+                state, returncode = self.poll(job_id)
+                if state == 'done':
+                    break
+                if state == 'timeout':
+                    raise subprocess.TimeoutExpired(cmd, timeout or 0)
+                if state == 'running' and started is None:
+                    started = time.time()
+                    self.update(name, state='running')
+                # The time limit counts from the start of the job, not its submission
+                if timeout and started is not None and time.time() - started > timeout:
+                    self.cancel(job_id)
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+                time.sleep(self.poll_interval)
+        except BaseException:
+            self.cancel(job_id)
+            raise
+        stdout_path = self.job_dir / f"{job}.out"
+        stdout = stdout_path.read_text() if capture_output and stdout_path.exists() else None
+        return returncode, stdout, None
+
+    def submit(self, job, script):
+        """Queue a job script and return its job id"""
+        raise NotImplementedError
+
+    def poll(self, job_id):
+        """(state, exit code) of a job: state is queued, running, done or timeout"""
+        raise NotImplementedError
+
+    def cancel(self, job_id):
+        """Remove a job from the queue or stop it"""
+        raise NotImplementedError
+
+
+class SlurmExecutor(BatchExecutor):
+    """Jobs submitted with sbatch, followed with squeue and sacct"""
+
+    def __init__(self, job_dir, partition=None, account=None, extra=None, **kwargs):
+        super().__init__(job_dir, **kwargs)
+        self.partition = partition
+        self.account = account
+        self.extra = shlex.split(extra or '')
+
+    def directives(self, job, cores, memory, timeout):
+        lines = [f"#SBATCH --job-name={job}",
+                 f"#SBATCH --cpus-per-task={cores}",
+                 f"#SBATCH --output={self.job_dir / job}.out",
+                 f"#SBATCH --error={self.job_dir / job}.err"]
+        if memory:
+            lines.append(f"#SBATCH --mem={max(1, math.ceil(memory / 2 ** 20))}M")
+        if timeout:
+            lines.append(f"#SBATCH --time={max(1, math.ceil(timeout / 60))}")
+        if self.partition:
+            lines.append(f"#SBATCH --partition={self.partition}")
+        if self.account:
+            lines.append(f"#SBATCH --account={self.account}")
+        lines += [f"#SBATCH {option}" for option in self.extra]
+        return lines
+
+    def submit(self, job, script):
+        result = subprocess.run(['sbatch', '--parsable', str(script)], capture_output=True, text=True, check=True)
+        # --parsable prints "<job id>" or "<job id>;<cluster>"
+        return result.stdout.strip().split(';')[0]
+
+    def poll(self, job_id):
+        result = subprocess.run(['squeue', '-h', '-j', job_id, '-o', '%T'], capture_output=True, text=True)
+        state = result.stdout.strip()
+        if result.returncode == 0 and state:
+            return ('queued' if state in SLURM_QUEUED_STATES else 'running'), None
+
+        # Gone from the queue: the accounting database has the outcome
+        result = subprocess.run(['sacct', '-n', '-P', '-X', '-j', job_id, '-o', 'State,ExitCode'],
+                                capture_output=True, text=True)
+        line = result.stdout.strip().splitlines()[0] if result.stdout.strip() else ''
+        if not line:
+            # Not recorded yet
+            return 'running', None
+        state, _, exit_code = line.partition('|')
+        state = state.split()[0] if state else ''
+        if state in SLURM_TIMEOUT_STATES:
+            return 'timeout', None
+        # ExitCode is "<exit code>:<signal>"
+        code, _, signal_number = exit_code.partition(':')
+        returncode = int(code or 0)
+        if not returncode and int(signal_number or 0):
+            returncode = 128 + int(signal_number)
+        if state != 'COMPLETED' and returncode == 0:
+            returncode = 1
+        return 'done', returncode
+
+    def cancel(self, job_id):
+        subprocess.run(['scancel', job_id], capture_output=True)
+
+
+class SpoolQueue:
+    """A batch queue kept as files in one directory
+
+    <job>.queued marks a submitted script; a worker claims it by renaming it
+    to <job>.running (only one rename can succeed), runs <job>.sh with bash
+    and writes the exit code to <job>.exit. <job>.cancel asks the worker to
+    stop a running job.
+    """
+
+    def __init__(self, spool_dir, poll_interval=0.5):
+        self.spool_dir = Path(spool_dir)
+        self.poll_interval = poll_interval
+
+    def claim(self):
+        """Name of the oldest queued job, now owned by the caller, or None"""
+        queued = sorted(self.spool_dir.glob("*.queued"), key=lambda p: p.stat().st_mtime_ns if p.exists() else 0)
+        for marker in queued:
+            job = marker.name[:-len('.queued')]
+            try:
+                os.rename(marker, self.spool_dir / f"{job}.running")
+            except FileNotFoundError:
+                continue
+            return job
+        return None
+
+    def run_job(self, job):
+        """Run a claimed job and record its exit code"""
+        cancel = self.spool_dir / f"{job}.cancel"
+        with open(self.spool_dir / f"{job}.out", 'w') as out, open(self.spool_dir / f"{job}.err", 'w') as err:
+            proc = subprocess.Popen(['bash', str(self.spool_dir / f"{job}.sh")], stdout=out, stderr=err,
+                                    start_new_session=True)
+            while True:
+                try:
+                    returncode = proc.wait(timeout=self.poll_interval)
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel.exists():
+                        kill_process_group(proc)
+        tmp_path = self.spool_dir / f"{job}.exit.{os.getpid()}.tmp"
+        tmp_path.write_text(f"{returncode}\n")
+        os.replace(tmp_path, self.spool_dir / f"{job}.exit")
+        (self.spool_dir / f"{job}.running").unlink(missing_ok=True)
+
+    def work(self, stop):
+        """Worker loop: run queued jobs one at a time until stop is set"""
+        while not stop.is_set():
+            job = self.claim()
+            if job is None:
+                stop.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+
+
+class FileQueueExecutor(BatchExecutor):
+    """Stand-in for a batch scheduler: jobs go through a SpoolQueue in job_dir
+
+    Worker threads of this process run the queued jobs; more workers can
+    be started on hosts sharing job_dir with
+    'python -m metapipe.executors worker <job_dir>'. Submission, polling,
+    cancellation, retries and timeouts behave as with SLURM, which makes it
+    the backend to test the batch path with.
+    """
+
+    def __init__(self, job_dir, workers=2, **kwargs):
+        super().__init__(job_dir, **kwargs)
+        self.queue = SpoolQueue(self.job_dir)
+        self.workers = workers
+        self._stop = threading.Event()
+        self._threads = []
+
+    def directives(self, job, cores, memory, timeout):
+        # Recorded for reference; the stand-in does not enforce requests
+        return [f"# cores={cores} memory_bytes={memory or 0}"]
+
+    def submit(self, job, script):
+        if not self._threads and self.workers > 0:
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self.queue.work, args=(self._stop,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        (self.job_dir / f"{job}.queued").touch()
+        return job
+
+    def poll(self, job_id):
+        exit_file = self.job_dir / f"{job_id}.exit"
+        if exit_file.exists():
+            return 'done', int(exit_file.read_text().strip())
+        if (self.job_dir / f"{job_id}.running").exists():
+            return 'running', None
+        return 'queued', None
+
+    def cancel(self, job_id):
+        try:
+            # Still queued: take it back before a worker claims it
+            os.rename(self.job_dir / f"{job_id}.queued", self.job_dir / f"{job_id}.cancelled")
+        except FileNotFoundError:
+            (self.job_dir / f"{job_id}.cancel").touch()
+
+    def close(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+def main():
+    """Command line entry point: file-queue workers for another host"""
+    parser = argparse.ArgumentParser(description="Run jobs of the file-queue executor")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker = subparsers.add_parser("worker", help="Run queued jobs until interrupted")
+    worker.add_argument("job_dir", help="[EXECUTOR] job_dir of the pipeline run")
+    worker.add_argument("-w", "--workers", type=int, default=1, help="Jobs run at the same time")
+    args = parser.parse_args()
+
+    queue = SpoolQueue(args.job_dir)
+    stop = threading.Event()
+    threads = [threading.Thread(target=queue.work, args=(stop,), daemon=True) for _ in range(args.workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+if __name__ == "__main__":
+    main()
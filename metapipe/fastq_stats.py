@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+#####################################################################
+#                  SINGLE-PASS FASTQ STATISTICS                    #
+#####################################################################
+
+import argparse
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+READ_BUFFER = 4 * 1024 * 1024
+SIDECAR_VERSION = 1
+
+
+@contextmanager
+def open_fastq(path, threads=2):
+    """Open a FASTQ for binary reading, decompressing with pigz when available"""
+    path = str(path)
+    if not path.endswith('.gz'):
+        with open(path, 'rb', buffering=READ_BUFFER) as handle:
+            yield handle
+        return
+
+    pigz = shutil.which('pigz')
+    if pigz is None:
+        with gzip.open(path, 'rb') as raw:
+            yield io.BufferedReader(raw, buffer_size=READ_BUFFER)
+        return
+
+    proc = subprocess.Popen([pigz, '-dc', '-p', str(max(1, threads)), path],
+                            stdout=subprocess.PIPE, bufsize=READ_BUFFER)
+    try:
+        yield proc.stdout
+    finally:
+        proc.stdout.close()
+        if proc.wait() not in (0, -13):  # -13: SIGPIPE when we stop reading early
+            raise RuntimeError(f"pigz failed to decompress {path}")
+
+
+def n50(lengths):
+    """N50 from a {length: count} histogram"""
+    total = sum(length * count for length, count in lengths.items())
+    running = 0
+    for length in sorted(lengths, reverse=True):
+        running += length * lengths[length]
+        if running * 2 >= total:
+            return length
+    return 0
+
+
+def fastq_stats(path, threads=2):
+    """Read count, base count, length distribution and N50 of one FASTQ"""
+    with open_fastq(path, threads) as handle:
+        # Only the sequence line of every record is looked at; len() of each
+        # line includes its newline, corrected below
+        line_lengths = Counter(map(len, islice(handle, 1, None, 4)))
+
+    lengths = Counter()
+    for length, count in line_lengths.items():
+        lengths[max(0, length - 1)] += count
+
+    reads = sum(lengths.values())
+    bases = sum(length * count for length, count in lengths.items())
+    return {
+        'reads': reads,
+        'bases': bases,
+        'min_length': min(lengths) if lengths else 0,
+        'max_length': max(lengths) if lengths else 0,
+        'mean_length': round(bases / reads, 2) if reads else 0,
+        'n50': n50(lengths),
+        'length_distribution': {str(k): lengths[k] for k in sorted(lengths)},
+    }
+
+
+class FastqStatsSidecar:
+    """Per-sample JSON of FASTQ statistics, reused while files are unchanged"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.data = {'version': SIDECAR_VERSION, 'files': {}}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+                if data.get('version') == SIDECAR_VERSION:
+                    self.data = data
+            except (OSError, ValueError):
+                pass
+
+    def lookup(self, fastq):
+        """Stored statistics for a file, or None when missing or stale"""
+        fastq = os.path.abspath(fastq)
+        entry = self.data['files'].get(fastq)
+        if not entry:
+            return None
+        st = os.stat(fastq)
+        if entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+            return None
+        return entry['stats']
+
+    def stats(self, files, threads=2):
+        """Statistics for each file, reading only those not already in the sidecar"""
+        files = [os.path.abspath(f) for f in files]
+        results = {f: self.lookup(f) for f in files}
+        stale = [f for f in files if results[f] is None]
+
+        if stale:
+            # zlib/pigz release the GIL, so files are decoded side by side
+            per_file = max(1, threads // len(stale))
+            with ThreadPoolExecutor(max_workers=len(stale)) as pool:
+                computed = pool.map(lambda f: fastq_stats(f, per_file), stale)
+                for fastq, stats in zip(stale, computed):
+                    st = os.stat(fastq)
+                    self.data['files'][fastq] = {
+                        'size': st.st_size,
+                        'mtime_ns': st.st_mtime_ns,
+                        'stats': stats,
+                    }
+                    results[fastq] = stats
+            self.save()
+        return [results[f] for f in files]
+
+    def save(self):
+        """Write the sidecar atomically"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def retention_rate(before, after):
+    """Percentage of reads kept between two statistics records"""
+    if not before or not before['reads']:
+        return None
+    return round(after['reads'] * 100 / before['reads'], 2)
+
+
+def main():
+    """Command line entry point used by the stage scripts"""
+    parser = argparse.ArgumentParser(description="Single-pass FASTQ statistics")
+    parser.add_argument("files", nargs='+', help="FASTQ files (plain or gzip)")
+    parser.add_argument("--sidecar", help="JSON file where statistics are stored and reused")
+    parser.add_argument("-t", "--threads", type=int, default=2, help="Decompression threads")
+    parser.add_argument("--count", action="store_true", help="Only print the read count of each file")
+    args = parser.parse_args()
+
+    if args.sidecar:
+        stats = FastqStatsSidecar(args.sidecar).stats(args.files, args.threads)
+    else:
+        stats = [fastq_stats(f, args.threads) for f in args.files]
+
+    if args.count:
+        for record in stats:
+            print(record['reads'])
+    else:
+        json.dump(dict(zip(args.files, stats)), sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+#####################################################################
+#            COMPACT PER-READ KRAKEN OUTPUT AND TAXID INDEX        #
+#####################################################################
+
+import argparse
+import gzip
+import os
+import shutil
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # numpy ships with config/environment-full.yml
+    np = None
+
+from metapipe.fastq_stats import open_fastq
+from metapipe.kraken_table import parse_report
+
+FORMAT_VERSION = 1
+MATE_SEPARATOR = 0xFFFFFFFF  # '|:|' between the k-mer runs of both mates
+AMBIGUOUS = 0xFFFFFFFE       # 'A' runs: k-mers with ambiguous bases
+CHUNK_READS = 1 << 20        # reads parsed and indexed per chunk
+
+
+def require_numpy():
+    """Fail clearly when the compact format is used without numpy installed"""
+    if np is None:
+        raise RuntimeError("The compact Kraken output requires numpy (conda install numpy)")
+
+
+def parse_taxid(field):
+    """Taxid of a Kraken output line, also with --use-names ('name (taxid N)')"""
+    if field.endswith(')'):
+        field = field[field.rfind('taxid ') + 6:-1]
+    return int(field)
+
+
+def parse_lca(field, taxids, counts):
+    """Append the 'taxid:count' k-mer runs of one read to taxids/counts"""
+    for token in field.split():
+        if token == '|:|':
+            taxids.append(MATE_SEPARATOR)
+            counts.append(0)
+            continue
+        taxid, count = token.rsplit(':', 1)
+        taxids.append(AMBIGUOUS if taxid == 'A' else int(taxid))
+        counts.append(int(count))
+
+
+def column_view(path, dtype, shape=None):
+    """Read-only memory map of a spilled column (empty files cannot be mapped)"""
+    if os.path.getsize(path) == 0:
+        return np.zeros(shape or 0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+def taxid_index(taxids, order, chunk=CHUNK_READS):
+    """Group the read indices by taxid into order, in read order within each group
+
+    A counting sort over chunks of taxids, so memory is bounded by the chunk
+    size and the number of distinct taxids rather than by the read count.
+    """
+    counts = {}
+    for start in range(0, taxids.size, chunk):
+        values, sizes = np.unique(taxids[start:start + chunk], return_counts=True)
+        for taxid, size in zip(values.tolist(), sizes.tolist()):
+            counts[taxid] = counts.get(taxid, 0) + size
+    index_taxids = np.array(sorted(counts), dtype=np.uint32)
+    index_offsets = np.zeros(index_taxids.size + 1, dtype=np.int64)
+    np.cumsum([counts[taxid] for taxid in index_taxids.tolist()], out=index_offsets[1:])
+
+    cursor = index_offsets[:-1].copy()
+    for start in range(0, taxids.size, chunk):
+        groups = np.searchsorted(index_taxids, taxids[start:start + chunk])
+        ranked = np.argsort(groups, kind='stable')
+        sorted_groups = groups[ranked]
+        rank = np.arange(sorted_groups.size) - np.searchsorted(sorted_groups, sorted_groups)
+        order[cursor[sorted_groups] + rank] = start + ranked
+        cursor += np.bincount(groups, minlength=index_taxids.size)
+    return index_taxids, index_offsets
+
+
+def compact_kraken_output(path, output, keep_lca=False):
+    """Convert a text .kraken.out into the columnar .npz format
+
+    Reads keep their input order, so the read index is the record number in
+    the FASTQ files given to kraken2 and read names need not be stored; the
+    first and last names are kept to check that a FASTQ matches. Columns are
+    parsed in chunks of CHUNK_READS reads and spilled to raw files next to the
+    output, then indexed and compressed from memory maps.
+    """
+    require_numpy()
+    spill_dir = f"{output}.{os.getpid()}.columns"
+    os.makedirs(spill_dir, exist_ok=True)
+    chunks = {'classified': array('B'), 'taxids': array('I'), 'lengths': array('I')}
+    if keep_lca:
+        chunks.update(lca_taxids=array('I'), lca_counts=array('I'), lca_offsets=array('q', [0]))
+    spills = {name: open(os.path.join(spill_dir, name), 'wb') for name in chunks}
+    first_read = last_read = ''
+    n = lca_total = 0
+
+    def flush():
+        for name, chunk in chunks.items():
+            chunk.tofile(spills[name])
+            del chunk[:]
+
+    try:
+        opener = gzip.open if str(path).endswith('.gz') else open
+        with opener(path, 'rt') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t', 4)
+                if len(fields) < 4:
+                    continue
+                status, read_id, taxid, length = fields[:4]
+                if not first_read:
+                    first_read = read_id
+                last_read = read_id
+                chunks['classified'].append(status == 'C')
+                chunks['taxids'].append(parse_taxid(taxid))
+                lengths = length.split('|')
+                chunks['lengths'].extend((int(lengths[0]), int(lengths[1]) if len(lengths) > 1 else 0))
+                if keep_lca:
+                    lca_taxids = chunks['lca_taxids']
+                    parse_lca(fields[4] if len(fields) > 4 else '', lca_taxids, chunks['lca_counts'])
+                    chunks['lca_offsets'].append(lca_total + len(lca_taxids))
+                n += 1
+                if n % CHUNK_READS == 0:
+                    if keep_lca:
+                        lca_total += len(chunks['lca_taxids'])
+                    flush()
+        flush()
+        for spill in spills.values():
+            spill.close()
+
+        spilled = lambda name: os.path.join(spill_dir, name)
+        taxids = column_view(spilled('taxids'), np.uint32)
+        read_dtype = np.uint32 if n < 2 ** 32 else np.uint64
+        # Taxid index: reads grouped by taxid, in read order within each group
+        order = np.memmap(spilled('order'), dtype=read_dtype, mode='w+', shape=(n,)) if n \
+            else np.zeros(0, dtype=read_dtype)
+        index_taxids, index_offsets = taxid_index(taxids, order)
+
+        columns = {
+            'format_version': np.array(FORMAT_VERSION),
+            'classified': column_view(spilled('classified'), bool),
+            'taxids': taxids,
+            'lengths': column_view(spilled('lengths'), np.uint32, (n, 2)),
+            'first_read': np.array(first_read),
+            'last_read': np.array(last_read),
+            'index_taxids': index_taxids,
+            'index_offsets': index_offsets,
+            'index_reads': order,
+        }
+        if keep_lca:
+            columns['lca_offsets'] = column_view(spilled('lca_offsets'), np.int64)
+            columns['lca_taxids'] = column_view(spilled('lca_taxids'), np.uint32)
+            columns['lca_counts'] = column_view(spilled('lca_counts'), np.uint32)
+
+        tmp_path = f"{output}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **columns)
+        del columns, taxids, order
+        os.replace(tmp_path, output)
+    finally:
+        for spill in spills.values():
+            spill.close()
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return n
+
+
+class KrakenReads:
+    """Per-read classifications of one sample, read from the compact format
+
+    Columns are decompressed on first use and the index and LCA runs are
+    streamed by range, so extracting one taxid never loads the per-read
+    columns or the k-mer runs.
+    """
+
+    def __init__(self, path):
+        require_numpy()
+        self.archive = np.load(path, allow_pickle=False)
+        self.loaded = {}
+        version = self.column('format_version')
+        if int(version) != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path}: unsupported format version {version}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.loaded.clear()
+        self.archive.close()
+
+    def column(self, name):
+        """One whole column, decompressed the first time it is asked for"""
+        if name not in self.loaded:
+            self.loaded[name] = self.archive[name]
+        return self.loaded[name]
+
+    def column_ranges(self, name, ranges):
+        """[start, end) slices of a 1-D column, streamed without loading the rest
+
+        Ranges are read in order, so ascending ranges cost a single forward
+        pass over the compressed member.
+        """
+        with self.archive.zip.open(f"{name}.npy") as member:
+            version = np.lib.format.read_magic(member)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) \
+                else np.lib.format.read_array_header_2_0
+            _, _, dtype = read_header(member)
+            data_start = member.tell()
+            parts = []
+            for start, end in ranges:
+                member.seek(data_start + int(start) * dtype.itemsize)
+                parts.append(np.frombuffer(member.read((int(end) - int(start)) * dtype.itemsize), dtype=dtype))
+            return parts
+
+    def __len__(self):
+        return int(self.column('index_offsets')[-1])
+
+    def reads_for(self, taxids):
+        """Sorted indices of the reads assigned to any of taxids, from the index"""
+        index_taxids = self.column('index_taxids')
+        offsets = self.column('index_offsets')
+        positions = np.searchsorted(index_taxids, np.asarray(sorted(taxids), dtype=index_taxids.dtype))
+        ranges = [(offsets[p], offsets[p + 1])
+                  for p, taxid in zip(positions.tolist(), sorted(taxids))
+                  if p < index_taxids.size and index_taxids[p] == taxid]
+        parts = self.column_ranges('index_reads', ranges)
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def lca_runs(self, read):
+        """k-mer (taxid, count) runs of one read, when they were kept"""
+        if 'lca_offsets' not in self.archive.files:
+            raise ValueError("k-mer LCA runs were not kept for this file")
+        start, end = self.column_ranges('lca_offsets', [(read, read + 2)])[0].tolist()
+        taxids, = self.column_ranges('lca_taxids', [(start, end)])
+        counts, = self.column_ranges('lca_counts', [(start, end)])
+        return list(zip(taxids.tolist(), counts.tolist()))
+
+
+def descendants(report, taxid):
+    """taxid and every taxon below it in a Kraken report"""
+    children = {}
+    for child, parent, *_ in parse_report(report):
+        children.setdefault(parent, []).append(child)
+    found, stack = set(), [taxid]
+    while stack:
+        current = stack.pop()
+        if current not in found:
+            found.add(current)
+            stack.extend(children.get(current, []))
+    return found
+
+
+def read_name(name):
+    """Read name without a /1 or /2 mate suffix"""
+    return name[:-2] if name.endswith(('/1', '/2')) else name
+
+
+def extract_records(fastq, output, reads, first_read=None, threads=2):
+    """Write the FASTQ records whose ordinal is in the sorted reads array"""
+    wanted = iter(reads.tolist())
+    target = next(wanted, None)
+    written = 0
+    with open_fastq(fastq, threads) as handle, gzip.open(output, 'wb', compresslevel=4) as out:
+        for ordinal, header in enumerate(handle):
+            body = [next(handle), next(handle), next(handle)]
+            if ordinal == 0 and first_read and \
+                    read_name(header[1:].split(None, 1)[0].decode()) != read_name(first_read):
+                raise ValueError(f"{fastq} does not match the Kraken output (first read {first_read})")
+            if target is None:
+                break
+            if ordinal == target:
+                out.write(header)
+                out.writelines(body)
+                written += 1
+                target = next(wanted, None)
+    return written
+
+
+def extract(compact, taxid, fastqs, prefix, report=None, threads=2):
+    """Extract the reads classified as taxid (and its descendants with a report)"""
+    taxids = descendants(report, taxid) if report else {taxid}
+    with KrakenReads(compact) as kraken_reads:
+        reads = kraken_reads.reads_for(taxids)
+        first_read = str(kraken_reads.column('first_read'))
+    outputs = []
+    for mate, fastq in enumerate(fastqs, 1):
+        output = f"{prefix}_R{mate}.fastq.gz" if len(fastqs) > 1 else f"{prefix}.fastq.gz"
+        extract_records(fastq, output, reads, first_read, threads)
+        outputs.append(output)
+    return len(reads), outputs
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Compact per-read Kraken output and taxid extraction")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert_parser = subparsers.add_parser('convert', help="Convert a .kraken.out into the compact format")
+    convert_parser.add_argument("kraken_out", help="Text Kraken2 output (plain or gzip)")
+    convert_parser.add_argument("-o", "--output", help="Output file (default: <input>.npz)")
+    convert_parser.add_argument("--lca", action="store_true", help="Keep the per-read k-mer LCA runs")
+    convert_parser.add_argument("--remove", action="store_true", help="Delete the text file after converting")
+
+    extract_parser = subparsers.add_parser('extract', help="Extract the reads of one taxid")
+    extract_parser.add_argument("compact", help="Compact Kraken output (.kraken.npz)")
+    extract_parser.add_argument("--taxid", type=int, required=True, help="Taxid to extract")
+    extract_parser.add_argument("--report", help="Kraken report; include every taxon below --taxid")
+    extract_parser.add_argument("-1", "--reads1", required=True, help="FASTQ classified by Kraken2 (mate 1)")
+    extract_parser.add_argument("-2", "--reads2", help="Mate 2 FASTQ for paired runs")
+    extract_parser.add_argument("-o", "--output", required=True, help="Output prefix")
+    extract_parser.add_argument("-t", "--threads", type=int, default=2, help="Decompression threads")
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        output = args.output or f"{os.path.splitext(args.kraken_out.removesuffix('.gz'))[0]}.npz"
+        n = compact_kraken_output(args.kraken_out, output, args.lca)
+        if args.remove:
+            os.remove(args.kraken_out)
+        print(f"{n} reads written to {output}")
+    else:
+        fastqs = [args.reads1] + ([args.reads2] if args.reads2 else [])
+        n, outputs = extract(args.compact, args.taxid, fastqs, args.output, args.report, args.threads)
+        print(f"{n} reads extracted to {', '.join(outputs)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+#####################################################################
+#                  KRAKEN REPORT ABUNDANCE MATRIX                  #
+#####################################################################
+
+import argparse
+import json
+import os
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:  # numpy ships with config/environment-full.yml
+    np = None
+
+RANKS = ['D', 'P', 'C', 'O', 'F', 'G', 'S']
+RANK_PREFIX = {'D': 'k__', 'P': 'p__', 'C': 'c__', 'O': 'o__', 'F': 'f__', 'G': 'g__', 'S': 's__'}
+
+
+def require_numpy():
+    """Fail clearly when the matrix is used without numpy installed"""
+    if np is None:
+        raise RuntimeError("The Kraken abundance matrix requires numpy (conda install numpy)")
+
+
+def sample_id(path):
+    """Sample name of a report, as kraken-biom derives it (file name without its last extension)"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def parse_report(path):
+    """Stream a Kraken report as (taxid, parent taxid, rank, name, clade reads, taxon reads)
+
+    Standard 6-column reports and reports with minimizer data (8 columns)
+    are both accepted. Parents are recovered from the name indentation.
+    """
+    stack = []
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 6:
+                _, clade, direct, rank, taxid, name = fields
+            elif len(fields) == 8:
+                _, clade, direct, _, _, rank, taxid, name = fields
+            else:
+                continue
+            depth = (len(name) - len(name.lstrip(' '))) // 2
+            while stack and stack[-1][0] >= depth:
+                stack.pop()
+            taxid = int(taxid)
+            parent = stack[-1][1] if stack else 0
+            stack.append((depth, taxid))
+            yield taxid, parent, rank.strip(), name.strip(), int(clade), int(direct)
+
+
+class KrakenMatrix:
+    """Sparse taxon x sample read counts with the taxonomy of every taxon
+
+    Each sample is a column of (taxon row, clade reads, taxon reads) entries,
+    stored column after column (CSC) in a compressed .npz. Adding a sample
+    parses only its own report; the other columns are kept as loaded.
+    """
+
+    def __init__(self):
+        require_numpy()
+        self.taxids = []
+        self.parents = []
+        self.ranks = []
+        self.names = []
+        self.row_index = {}
+        self.samples = []
+        self.sources = []
+        self.columns = []
+
+    @classmethod
+    def load(cls, path):
+        """Open a saved matrix"""
+        matrix = cls()
+        with np.load(path, allow_pickle=False) as data:
+            matrix.taxids = data['taxids'].tolist()
+            matrix.parents = data['parents'].tolist()
+            matrix.ranks = data['ranks'].tolist()
+            matrix.names = data['names'].tolist()
+            matrix.samples = data['samples'].tolist()
+            matrix.sources = [{'path': p, 'size': int(s), 'mtime_ns': int(m)} for p, s, m in
+                              zip(data['source_paths'].tolist(), data['source_sizes'], data['source_mtimes'])]
+            indptr, rows, clade, direct = data['indptr'], data['rows'], data['clade'], data['direct']
+            matrix.columns = [(rows[indptr[i]:indptr[i + 1]], clade[indptr[i]:indptr[i + 1]],
+                               direct[indptr[i]:indptr[i + 1]]) for i in range(len(matrix.samples))]
+        matrix.row_index = {taxid: row for row, taxid in enumerate(matrix.taxids)}
+        return matrix
+
+    @classmethod
+    def open(cls, path):
+        """Load a matrix, or start an empty one when the file does not exist yet"""
+        return cls.load(path) if os.path.exists(path) else cls()
+
+    def save(self, path):
+        """Write the matrix as a compressed .npz, atomically"""
+        sizes = [len(rows) for rows, _, _ in self.columns]
+        indptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=indptr[1:])
+
+        def stacked(i, dtype):
+            parts = [column[i] for column in self.columns]
+            return np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                taxids=np.array(self.taxids, dtype=np.uint32),
+                parents=np.array(self.parents, dtype=np.uint32),
+                ranks=np.array(self.ranks, dtype=str),
+                names=np.array(self.names, dtype=str),
+                samples=np.array(self.samples, dtype=str),
+                source_paths=np.array([s['path'] for s in self.sources], dtype=str),
+                source_sizes=np.array([s['size'] for s in self.sources], dtype=np.int64),
+                source_mtimes=np.array([s['mtime_ns'] for s in self.sources], dtype=np.int64),
+                indptr=indptr,
+                rows=stacked(0, np.uint32),
+                clade=stacked(1, np.int64),
+                direct=stacked(2, np.int64),
+            )
+        os.replace(tmp_path, path)
+
+    def _row(self, taxid, parent, rank, name):
+        """Row of a taxon, added to the taxonomy index on first sight"""
+        row = self.row_index.get(taxid)
+        if row is None:
+            row = len(self.taxids)
+            self.row_index[taxid] = row
+            self.taxids.append(taxid)
+            self.parents.append(parent)
+            self.ranks.append(rank)
+            self.names.append(name)
+        return row
+
+    def add_report(self, path, sample=None):
+        """Parse one report into a sample column, replacing an older column of that sample"""
+        sample = sample or sample_id(path)
+        rows, clade, direct = [], [], []
+        for taxid, parent, rank, name, clade_reads, taxon_reads in parse_report(path):
+            if clade_reads == 0:
+                continue
+            rows.append(self._row(taxid, parent, rank, name))
+            clade.append(clade_reads)
+            direct.append(taxon_reads)
+
+        st = os.stat(path)
+        source = {'path': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        column = (np.array(rows, dtype=np.uint32), np.array(clade, dtype=np.int64), np.array(direct, dtype=np.int64))
+        if sample in self.samples:
+            i = self.samples.index(sample)
+            self.columns[i], self.sources[i] = column, source
+        else:
+            self.samples.append(sample)
+            self.columns.append(column)
+            self.sources.append(source)
+        return sample
+
+    def remove(self, sample):
+        """Drop a sample column"""
+        i = self.samples.index(sample)
+        del self.samples[i], self.columns[i], self.sources[i]
+
+    def is_current(self, sample, path):
+        """Whether a sample's column was built from this version of the report"""
+        if sample not in self.samples:
+            return False
+        source = self.sources[self.samples.index(sample)]
+        st = os.stat(path)
+        return (source['path'], source['size'], source['mtime_ns']) == \
+            (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+    def update(self, paths, prune=False):
+        """Add new or changed reports; with prune, drop samples whose report is not listed"""
+        wanted = {sample_id(p): p for p in paths}
+        added = [self.add_report(path, sample) for sample, path in sorted(wanted.items())
+                 if not self.is_current(sample, path)]
+        removed = [s for s in self.samples if s not in wanted] if prune else []
+        for sample in removed:
+            self.remove(sample)
+        return added, removed
+
+    def lineage(self, row):
+        """kraken-biom style taxonomy of a taxon: k__ ... s__ down to its rank"""
+        names = {}
+        while row is not None:
+            rank = self.ranks[row]
+            if rank in RANK_PREFIX and rank not in names:
+                name = self.names[row]
+                # kraken-biom keeps only the epithet at species level
+                names[rank] = name.split(' ', 1)[1] if rank == 'S' and ' ' in name else name
+            # Top-level taxa (root, unclassified) have parent 0
+            row = self.row_index.get(self.parents[row]) if self.parents[row] else None
+        depth = max((RANKS.index(r) for r in names), default=-1)
+        return [f"{RANK_PREFIX[r]}{names.get(r, '')}" for r in RANKS[:depth + 1]]
+
+    def biom(self, max_rank='O', min_rank='S'):
+        """BIOM 1.0 JSON table with the same counts as kraken-biom
+
+        Taxa ranked between max_rank and min_rank are kept: min_rank taxa
+        get their clade reads (lower ranks are summed into them), the others
+        the reads assigned directly to them.
+        """
+        low, high = RANKS.index(max_rank), RANKS.index(min_rank)
+        kept = {r for r in RANKS[low:high + 1]}
+        ranks = np.array(self.ranks, dtype=str) if self.ranks else np.zeros(0, dtype=str)
+        eligible = np.isin(ranks, list(kept))
+        is_min = ranks == min_rank
+
+        entries = {}
+        for col, (rows, clade, direct) in enumerate(self.columns):
+            rows = rows.astype(np.int64)
+            keep = eligible[rows]
+            values = np.where(is_min[rows], clade, direct)[keep]
+            for row, value in zip(rows[keep].tolist(), values.tolist()):
+                if value:
+                    entries.setdefault(row, []).append((col, value))
+
+        taxa = sorted(entries)
+        data = [[i, col, value] for i, row in enumerate(taxa) for col, value in entries[row]]
+        return {
+            'id': None,
+            'format': 'Biological Observation Matrix 1.0.0',
+            'format_url': 'http://biom-format.org',
+            'type': 'Taxon table',
+            'generated_by': 'metapipeline',
+            'date': datetime.now().isoformat(),
+            'matrix_type': 'sparse',
+            'matrix_element_type': 'int',
+            'shape': [len(taxa), len(self.samples)],
+            'rows': [{'id': str(self.taxids[row]), 'metadata': {'taxonomy': self.lineage(row)}} for row in taxa],
+            'columns': [{'id': sample, 'metadata': None} for sample in self.samples],
+            'data': data,
+        }
+
+    def write_biom(self, path, max_rank='O', min_rank='S'):
+        """Export the BIOM JSON table"""
+        with open(path, 'w') as f:
+            json.dump(self.biom(max_rank, min_rank), f)
+
+
+def build_table(reports, matrix_path, biom_path=None, prune=False, max_rank='O', min_rank='S'):
+    """Update a saved matrix with reports and optionally export it as BIOM JSON"""
+    matrix = KrakenMatrix.open(matrix_path)
+    added, removed = matrix.update(reports, prune)
+    if added or removed or not os.path.exists(matrix_path):
+        matrix.save(matrix_path)
+    if biom_path:
+        matrix.write_biom(biom_path, max_rank, min_rank)
+    return matrix, added, removed
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Merge Kraken reports into a sparse abundance matrix")
+    parser.add_argument("reports", nargs='+', help="Kraken report files")
+    parser.add_argument("-m", "--matrix", required=True, help="Matrix file (.npz), created or updated")
+    parser.add_argument("-o", "--biom", help="Also export a BIOM JSON table")
+    parser.add_argument("--prune", action="store_true", help="Drop samples whose report is not given")
+    parser.add_argument("--max", default='O', choices=RANKS, help="Highest rank kept in the BIOM table")
+    parser.add_argument("--min", default='S', choices=RANKS, help="Lowest rank kept in the BIOM table")
+    args = parser.parse_args()
+
+    matrix, added, removed = build_table(args.reports, args.matrix, args.biom, args.prune, args.max, args.min)
+    print(f"{len(matrix.samples)} samples, {len(matrix.taxids)} taxa "
+          f"({len(added)} added or updated, {len(removed)} removed)")
+
+
+if __name__ == "__main__":
+    main()
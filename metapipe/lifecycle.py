@@ -0,0 +1,184 @@
+#####################################################################
+#              INTERMEDIATE FILE LIFECYCLE AND CODECS              #
+#####################################################################
+
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+
+
+def path_size(path):
+    """Bytes held by a file or a directory tree"""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, files in os.walk(path) for name in files)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def gzip_command(level, threads=1, parallel=True):
+    """Compressor for a gzip level: pigz on several threads when available, else gzip"""
+    pigz = shutil.which('pigz') if parallel and threads > 1 else None
+    if pigz:
+        return [pigz, '-p', str(threads), f'-{level}']
+    return ['gzip', f'-{level}']
+
+
+class CompressionPolicy:
+    """Fast codecs for transient files, stronger ones only for archived outputs"""
+
+    def __init__(self, transient_level=1, archive_level=6, parallel=True):
+        self.transient_level = int(transient_level)
+        self.archive_level = int(archive_level)
+        self.parallel = parallel
+
+    def transient(self, threads=1):
+        """Command compressing a file that is deleted once consumed"""
+        return gzip_command(self.transient_level, threads, self.parallel)
+
+    def archive(self, threads=1):
+        """Command compressing a file kept after the run"""
+        return gzip_command(self.archive_level, threads, self.parallel)
+
+    def env(self, threads=1):
+        """Variables the stage scripts read to pick their codecs"""
+        return {
+            'METAPIPELINE_GZIP': ' '.join(self.transient(threads)),
+            'METAPIPELINE_TRANSIENT_LEVEL': str(self.transient_level),
+            'METAPIPELINE_ARCHIVE_LEVEL': str(self.archive_level),
+        }
+
+
+class Artifact:
+    """Intermediate files written by one task and read by others"""
+
+    def __init__(self, name, paths, producer, consumers):
+        self.name = name
+        self.paths = [Path(p) for p in paths]
+        self.producer = producer
+        self.consumers = set(consumers)
+        self.produced = False
+        self.released = False
+
+
+class LifecycleManager:
+    """Delete each intermediate as soon as its last consumer succeeds
+
+    Artifacts are reference counted by consumer task: the producer's
+    success arms an artifact, each consumer's success drops one reference,
+    and at zero the files are deleted (an artifact without consumers goes
+    as soon as it is produced). A failed or skipped consumer keeps its
+    inputs for the rerun. With keep=True nothing is deleted.
+    """
+
+    def __init__(self, keep=False, logger=None, on_release=None):
+        self.keep = keep
+        self.logger = logger or logging.getLogger(__name__)
+        # Called with each path before it is deleted (the step cache remembers it)
+        self.on_release = on_release
+        self.artifacts = []
+        self.freed_bytes = 0
+        self._lock = threading.Lock()
+
+    def register(self, artifact):
+        """Track an artifact"""
+        with self._lock:
+            self.artifacts.append(artifact)
+        return artifact
+
+    def task_succeeded(self, task_name):
+        """Update reference counts after a task succeeded and release what is no longer needed"""
+        with self._lock:
+            ready = []
+            for artifact in self.artifacts:
+                if artifact.released:
+                    continue
+                if artifact.producer == task_name:
+                    artifact.produced = True
+                artifact.consumers.discard(task_name)
+                if artifact.produced and not artifact.consumers:
+                    artifact.released = True
+                    ready.append(artifact)
+        for artifact in ready:
+            self.release(artifact)
+
+    def release(self, artifact):
+        """Delete the files of an artifact, unless intermediates are kept"""
+        if self.keep:
+            return
+        freed = 0
+        for path in artifact.paths:
+            if not path.exists():
+                continue
+            size = path_size(path)
+            if self.on_release is not None:
+                members = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+                for member in members:
+                    self.on_release(member)
+            try:
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+            except OSError as e:
+                self.logger.warning(f"Could not delete intermediate {path}: {e}")
+                continue
+            freed += size
+        if freed:
+            with self._lock:
+                self.freed_bytes += freed
+            self.logger.info(f"Released intermediate {artifact.name}: {freed / 1e9:.2f} GB freed")
+
+    def revive(self, cache, stale):
+        """Make cached producers run again when a consumer needs what they released
+
+        A released intermediate keeps its producer cached, which only holds
+        while its consumers stay cached too. stale(step) tells whether a step
+        will run; the producer of every released artifact with a stale
+        consumer is invalidated, up the chain (a rerun producer may need
+        released inputs of its own). Returns the invalidated producers.
+        """
+        revived = []
+        changed = True
+        while changed:
+            changed = False
+            for artifact in self.artifacts:
+                if artifact.producer in revived or not artifact.consumers:
+                    continue
+                if not any(cache.was_released(path) for path in artifact.paths):
+                    continue
+                if stale(artifact.producer) or not any(stale(consumer) for consumer in artifact.consumers):
+                    continue
+                cache.invalidate(artifact.producer)
+                revived.append(artifact.producer)
+                self.logger.info(f"Rerunning {artifact.producer}: {artifact.name} was released and a consumer "
+                                 f"is out of date")
+                changed = True
+        return revived
+
+    def pending(self):
+        """Artifacts still held, with the consumers they wait for"""
+        with self._lock:
+            return {a.name: sorted(a.consumers) for a in self.artifacts if not a.released}
+
+
+class ScratchSpace:
+    """Per-task scratch directories under a (fast) temp dir"""
+
+    def __init__(self, temp_dir, run_id):
+        self.root = Path(temp_dir).expanduser() / f"metapipeline_{run_id}"
+
+    def path(self, task_name):
+        """Scratch directory of one task, created on demand"""
+        path = self.root / task_name.replace(':', '_').replace('/', '_')
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def clean(self, task_name):
+        """Remove a task's scratch directory"""
+        shutil.rmtree(self.root / task_name.replace(':', '_').replace('/', '_'), ignore_errors=True)
+
+    def close(self):
+        """Remove the run's scratch root"""
+        shutil.rmtree(self.root, ignore_errors=True)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+#####################################################################
+#          DIGITAL NORMALIZATION WITH A COUNT-MIN SKETCH           #
+#####################################################################
+
+import argparse
+import gzip
+import json
+import os
+from itertools import islice
+
+try:
+    import numpy as np
+except ImportError:  # numpy ships with config/environment-full.yml
+    np = None
+
+from metapipe.fastq_stats import open_fastq
+from metapipe.read_qc import base_lookup, to_matrix
+
+BATCH_PAIRS = 20000
+SKETCH_ROWS = 4
+DEFAULT_KMER = 20
+DEFAULT_COVERAGE = 20
+DEFAULT_MEMORY_GB = 4
+# Odd 64-bit multipliers of the multiply-shift hash, one per sketch row
+HASH_MULTIPLIERS = [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+                    0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x94D049BB133111EB, 0xBF58476D1CE4E5B9]
+
+
+def require_numpy():
+    """Fail clearly when normalization is selected without numpy installed"""
+    if np is None:
+        raise RuntimeError("Read normalization requires numpy (conda install numpy)")
+
+
+class CountMinSketch:
+    """Approximate k-mer counts in a fixed amount of memory
+
+    rows x width 32-bit counters; a k-mer's count is the minimum over its
+    cell in every row, which can only overestimate the true count.
+    """
+
+    def __init__(self, memory_bytes, rows=SKETCH_ROWS):
+        require_numpy()
+        if not 1 <= rows <= len(HASH_MULTIPLIERS):
+            raise ValueError(f"Sketch rows must be between 1 and {len(HASH_MULTIPLIERS)}")
+        # Width is a power of two so a cell index is the top bits of the hash
+        self.bits = max(10, int(np.log2(max(1, memory_bytes // (4 * rows)))))
+        self.width = 1 << self.bits
+        self.table = np.zeros((rows, self.width), dtype=np.uint32)
+        self.multipliers = np.array(HASH_MULTIPLIERS[:rows], dtype=np.uint64)
+        self.shift = np.uint64(64 - self.bits)
+
+    @property
+    def nbytes(self):
+        """Memory held by the counters"""
+        return self.table.nbytes
+
+    def cells(self, kmers):
+        """Cell index of each k-mer in every row, shape (rows, n)"""
+        with np.errstate(over='ignore'):
+            return ((kmers[None, :] * self.multipliers[:, None]) >> self.shift).astype(np.int64)
+
+    def count(self, cells):
+        """Estimated count of each k-mer, from its cells"""
+        return np.min(self.table[np.arange(len(self.table))[:, None], cells], axis=0)
+
+    def add(self, cells):
+        """Count every k-mer once more, from its cells"""
+        for row, row_cells in enumerate(cells):
+            np.add.at(self.table[row], row_cells, 1)
+
+    def occupancy(self):
+        """Fraction of non-zero cells in the first row (the collision pressure)"""
+        return float(np.count_nonzero(self.table[0])) / self.width
+
+
+def canonical_kmers(codes, bad_cumulative, k):
+    """Canonical 2-bit codes of every k-mer and whether it is free of N/padding"""
+    width = codes.shape[1] - k + 1
+    if width <= 0:
+        return None, None
+    forward = np.zeros((codes.shape[0], width), dtype=np.uint64)
+    reverse = np.zeros((codes.shape[0], width), dtype=np.uint64)
+    for i in range(k):
+        window = codes[:, i:i + width].astype(np.uint64)
+        forward <<= np.uint64(2)
+        forward |= window
+        # The complement of base i is base k-1-i of the reverse complement
+        reverse |= (np.uint64(3) - window) << np.uint64(2 * i)
+    ok = bad_cumulative[:, k:] == bad_cumulative[:, :width]
+    return np.minimum(forward, reverse), ok
+
+
+class Normalizer:
+    """Streaming digital normalization of paired reads
+
+    A pair is kept while the median estimated count of its k-mers is below
+    the target coverage, and its k-mers are then counted; pairs from
+    regions already covered that deeply are dropped. Both mates are always
+    kept or dropped together.
+    """
+
+    def __init__(self, k=DEFAULT_KMER, coverage=DEFAULT_COVERAGE, memory_bytes=DEFAULT_MEMORY_GB * 1024 ** 3):
+        require_numpy()
+        if not 1 <= k <= 32:
+            raise ValueError("k-mer size must be between 1 and 32")
+        self.k = k
+        self.coverage = coverage
+        self.sketch = CountMinSketch(memory_bytes)
+        self.lookup = base_lookup()
+        self.pairs_in = 0
+        self.pairs_kept = 0
+        self.bases_in = 0
+        self.bases_kept = 0
+        self.short_pairs = 0
+
+    def _kmers(self, seq_lines):
+        """Canonical k-mers of a batch of reads and their validity mask"""
+        seqs, lengths = to_matrix(seq_lines, ord('N'))
+        n, width = seqs.shape
+        valid = np.arange(width)[None, :] < lengths[:, None]
+        codes = self.lookup[seqs]
+        bad = (codes > 3) | ~valid
+        bad_cumulative = np.zeros((n, width + 1), dtype=np.int32)
+        np.cumsum(bad, axis=1, out=bad_cumulative[:, 1:])
+        kmers, ok = canonical_kmers(codes & 3, bad_cumulative, self.k)
+        if kmers is None:
+            return np.zeros((n, 0), dtype=np.uint64), np.zeros((n, 0), dtype=bool), lengths
+        return kmers, ok, lengths
+
+    def keep_batch(self, seq1, seq2):
+        """Boolean mask of the pairs to keep, updating the sketch with them"""
+        kmers1, ok1, lengths1 = self._kmers(seq1)
+        kmers2, ok2, lengths2 = self._kmers(seq2)
+        kmers = np.concatenate([kmers1, kmers2], axis=1)
+        ok = np.concatenate([ok1, ok2], axis=1)
+
+        # Valid k-mers are flattened pair after pair; offsets delimit each pair
+        cells = self.sketch.cells(kmers[ok])
+        offsets = np.zeros(len(seq1) + 1, dtype=np.int64)
+        np.cumsum(ok.sum(axis=1), out=offsets[1:])
+
+        counts = np.full(kmers.shape, np.nan)
+        counts[ok] = self.sketch.count(cells)
+        usable = ok.any(axis=1)
+        medians = np.zeros(len(seq1))
+        if usable.any():
+            medians[usable] = np.nanmedian(counts[usable], axis=1)
+        self.short_pairs += int((~usable).sum())
+
+        # Counts only grow, so pairs already at the target are dropped in
+        # bulk; the others are decided in order against the live counts,
+        # as if the reads were streamed one pair at a time. Pairs without a
+        # single valid k-mer carry no coverage information and are dropped.
+        keep = np.zeros(len(seq1), dtype=bool)
+        for i in np.flatnonzero(usable & (medians < self.coverage)).tolist():
+            pair_cells = cells[:, offsets[i]:offsets[i + 1]]
+            if np.median(self.sketch.count(pair_cells)) < self.coverage:
+                self.sketch.add(pair_cells)
+                keep[i] = True
+
+        batch_bases = lengths1 + lengths2
+        self.pairs_in += len(seq1)
+        self.pairs_kept += int(keep.sum())
+        self.bases_in += int(batch_bases.sum())
+        self.bases_kept += int(batch_bases[keep].sum())
+        return keep
+
+    def stats(self):
+        """Kept/discarded counts and sketch figures"""
+        return {
+            'pairs_in': self.pairs_in,
+            'pairs_kept': self.pairs_kept,
+            'pairs_discarded': self.pairs_in - self.pairs_kept,
+            'pairs_without_kmers': self.short_pairs,
+            'bases_in': self.bases_in,
+            'bases_kept': self.bases_kept,
+            'kept_percent': round(100.0 * self.pairs_kept / self.pairs_in, 2) if self.pairs_in else 0.0,
+            'kmer_size': self.k,
+            'target_coverage': self.coverage,
+            'sketch_bytes': self.sketch.nbytes,
+            'sketch_occupancy': round(self.sketch.occupancy(), 4),
+        }
+
+
+def normalize_pairs(reads1, reads2, output1, output2, k=DEFAULT_KMER, coverage=DEFAULT_COVERAGE,
+                    memory_bytes=DEFAULT_MEMORY_GB * 1024 ** 3, threads=2, batch_pairs=BATCH_PAIRS, compress_level=4):
+    """Normalize a pair of FASTQ files into paired-consistent gzip FASTQ files"""
+    normalizer = Normalizer(k, coverage, memory_bytes)
+    tmp1, tmp2 = f"{output1}.{os.getpid()}.tmp", f"{output2}.{os.getpid()}.tmp"
+    with open_fastq(reads1, threads) as in1, open_fastq(reads2, threads) as in2, \
+            gzip.open(tmp1, 'wb', compresslevel=compress_level) as out1, \
+            gzip.open(tmp2, 'wb', compresslevel=compress_level) as out2:
+        while True:
+            lines1 = list(islice(in1, 4 * batch_pairs))
+            lines2 = list(islice(in2, 4 * batch_pairs))
+            if len(lines1) != len(lines2):
+                raise ValueError(f"{reads1} and {reads2} do not have the same number of reads")
+            if not lines1:
+                break
+            keep = normalizer.keep_batch(lines1[1::4], lines2[1::4])
+            for i in np.flatnonzero(keep).tolist():
+                out1.writelines(lines1[4 * i:4 * i + 4])
+                out2.writelines(lines2[4 * i:4 * i + 4])
+    os.replace(tmp1, output1)
+    os.replace(tmp2, output2)
+    return normalizer.stats()
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Digital normalization of paired FASTQ files")
+    parser.add_argument("reads1", help="Mate 1 FASTQ (plain or gzip)")
+    parser.add_argument("reads2", help="Mate 2 FASTQ (plain or gzip)")
+    parser.add_argument("-o", "--output", required=True, help="Output prefix (<prefix>_R1.fastq.gz, ...)")
+    parser.add_argument("-k", "--kmer", type=int, default=DEFAULT_KMER, help="k-mer size")
+    parser.add_argument("-C", "--coverage", type=int, default=DEFAULT_COVERAGE, help="Target median k-mer coverage")
+    parser.add_argument("-M", "--memory-gb", type=float, default=DEFAULT_MEMORY_GB, help="Count-min sketch size")
+    parser.add_argument("-t", "--threads", type=int, default=2, help="Decompression threads")
+    parser.add_argument("-z", "--compress-level", type=int, default=4, help="gzip level of the output")
+    args = parser.parse_args()
+
+    stats = normalize_pairs(args.reads1, args.reads2, f"{args.output}_R1.fastq.gz", f"{args.output}_R2.fastq.gz",
+                            args.kmer, args.coverage, int(args.memory_gb * 1024 ** 3), args.threads,
+                            compress_level=args.compress_level)
+    with open(f"{args.output}.normalization.json", 'w') as f:
+        json.dump(stats, f, indent=1)
+    print(f"{stats['pairs_kept']} of {stats['pairs_in']} pairs kept ({stats['kept_percent']}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#####################################################################
+#                  PER-STEP RESOURCE PROFILING                     #
+#####################################################################
+
+import json
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+BLOCK_SIZE = 512  # ru_inblock/ru_oublock unit
+
+# Prometheus gauges written for every step: metric suffix, event field, help text
+PROMETHEUS_METRICS = [
+    ('wall_seconds', 'wall_seconds', 'Wall-clock time of the last run of the step'),
+    ('user_cpu_seconds', 'user_seconds', 'User CPU time of the step and its children'),
+    ('system_cpu_seconds', 'system_seconds', 'System CPU time of the step and its children'),
+    ('cpu_utilisation', 'cpu_utilisation', 'Average number of busy cores (CPU time / wall time)'),
+    ('max_rss_bytes', 'max_rss_bytes', 'Peak resident set size of the largest process'),
+    ('peak_tree_rss_bytes', 'peak_tree_rss_bytes', 'Peak resident set size of the whole process tree (sampled)'),
+    ('read_bytes', 'read_bytes', 'Bytes read from storage'),
+    ('written_bytes', 'written_bytes', 'Bytes written to storage'),
+    ('read_chars', 'read_chars', 'Bytes passed to read() calls, page cache included (sampled)'),
+    ('write_chars', 'write_chars', 'Bytes passed to write() calls (sampled)'),
+    ('involuntary_switches', 'involuntary_switches', 'Involuntary context switches (CPU contention)'),
+    ('exit_code', 'exit_code', 'Exit code of the last run of the step'),
+]
+
+
+def process_parents():
+    """{pid: parent pid} for every process visible in /proc"""
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces: fields start after the last ')'
+        parents[int(entry)] = int(stat[stat.rfind(')') + 2:].split()[1])
+    return parents
+
+
+def process_tree(root):
+    """root and all of its live descendants"""
+    children = {}
+    for pid, ppid in process_parents().items():
+        children.setdefault(ppid, []).append(pid)
+    tree, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def read_proc_io(pid):
+    """Counters of /proc/<pid>/io, or an empty dict when unreadable"""
+    counters = {}
+    try:
+        with open(f'/proc/{pid}/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters
+
+
+def read_cpu_ticks(pid):
+    """CPU clock ticks of a process and its reaped children (utime, stime, cutime, cstime)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return 0
+    return sum(int(value) for value in stat[stat.rfind(')') + 2:].split()[11:15])
+
+
+def read_rss(pid):
+    """Current and peak (VmHWM) resident set size of a process in bytes"""
+    rss = hwm = 0
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    hwm = int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return rss, hwm
+
+
+class TreeSampler(threading.Thread):
+    """Poll /proc for the memory and I/O of a command's whole process tree"""
+
+    def __init__(self, pid, interval=1.0):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_process_rss = 0
+        self.read_chars = 0
+        self.write_chars = 0
+        self.cpu_ticks = 0
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        """Take one sample of the tree"""
+        tree = process_tree(self.pid)
+        rss = [read_rss(pid) for pid in tree]
+        self.peak_rss = max(self.peak_rss, sum(current for current, _ in rss))
+        self.peak_process_rss = max([self.peak_process_rss] + [peak for _, peak in rss])
+        # Reaped children are folded into their parent's counters, so the sum
+        # over live processes only grows; keep the largest value seen
+        io = [read_proc_io(pid) for pid in tree]
+        self.read_chars = max(self.read_chars, sum(c.get('rchar', 0) for c in io))
+        self.write_chars = max(self.write_chars, sum(c.get('wchar', 0) for c in io))
+        self.cpu_ticks = max(self.cpu_ticks, sum(read_cpu_ticks(pid) for pid in tree))
+
+    def progress(self):
+        """Counters that only grow while the tree does work: CPU ticks and logical I/O"""
+        return self.cpu_ticks, self.read_chars, self.write_chars
+
+    def run(self):
+        self.sample()
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        """Stop sampling and wait for the thread"""
+        self._stop_event.set()
+        self.join()
+
+
+def kill_process_group(proc):
+    """Kill a process started with start_new_session=True and everything it spawned"""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_profiled(cmd, env=None, cwd=None, capture_output=False, interval=1.0, timeout=None):
+    """Run a command and return (exit code, stdout, resource metrics)
+
+    CPU time, peak RSS and block I/O come from wait4() and cover every
+    descendant the command waited for; per-process and tree RSS and logical
+    I/O are sampled from /proc every `interval` seconds. With a timeout the
+    command runs in its own process group, which is killed when time runs
+    out (subprocess.TimeoutExpired is raised).
+    """
+    start_time = time.time()
+    proc = subprocess.Popen(cmd, env=env, cwd=cwd, text=True, start_new_session=bool(timeout),
+                            stdout=subprocess.PIPE if capture_output else None)
+    sampler = TreeSampler(proc.pid, interval)
+    sampler.start()
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, kill_process_group, [proc])
+        timer.daemon = True
+        timer.start()
+    try:
+        stdout = proc.stdout.read() if capture_output else None
+        _, status, usage = os.wait4(proc.pid, 0)
+    except BaseException:
+        if timeout:
+            kill_process_group(proc)
+        else:
+            proc.kill()
+        proc.wait()
+        sampler.stop()
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+    wall = time.time() - start_time
+    sampler.stop()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if capture_output:
+        proc.stdout.close()
+    if timer is not None and wall >= timeout and proc.returncode == -signal.SIGKILL:
+        raise subprocess.TimeoutExpired(cmd, timeout, output=stdout)
+    return proc.returncode, stdout, usage_metrics(wall, proc.returncode, usage, sampler)
+
+
+def usage_metrics(wall, returncode, usage, sampler):
+    """Metrics of a finished command from its wait4() rusage and the /proc samples of its tree"""
+    cpu = usage.ru_utime + usage.ru_stime
+    # ru_maxrss carries over the interpreter's own high-water mark through
+    # fork/exec; only trust it above that floor, else use the sampled VmHWM
+    max_rss = sampler.peak_process_rss
+    if usage.ru_maxrss > resource.getrusage(resource.RUSAGE_SELF).ru_maxrss:
+        max_rss = max(max_rss, usage.ru_maxrss * 1024)
+    metrics = {
+        'wall_seconds': round(wall, 3),
+        'user_seconds': round(usage.ru_utime, 3),
+        'system_seconds': round(usage.ru_stime, 3),
+        'cpu_utilisation': round(cpu / wall, 3) if wall > 0 else 0.0,
+        'max_rss_bytes': max_rss,
+        'peak_tree_rss_bytes': sampler.peak_rss,
+        'read_bytes': usage.ru_inblock * BLOCK_SIZE,
+        'written_bytes': usage.ru_oublock * BLOCK_SIZE,
+        'read_chars': sampler.read_chars,
+        'write_chars': sampler.write_chars,
+        'major_faults': usage.ru_majflt,
+        'voluntary_switches': usage.ru_nvcsw,
+        'involuntary_switches': usage.ru_nivcsw,
+        'exit_code': returncode,
+    }
+    return metrics
+
+
+def prometheus_label(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRecorder:
+    """Append step events to a JSONL log and mirror them to a Prometheus textfile"""
+
+    def __init__(self, events_path, textfile=None, run_id=None):
+        self.events_path = Path(events_path)
+        self.textfile = Path(textfile) if textfile else None
+        self.run_id = run_id
+        self._lock = threading.Lock()
+        self.latest = {}
+
+    def record(self, step, sample, command, metrics):
+        """Log one finished command"""
+        event = {
+            'run_id': self.run_id,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'step': step,
+            'sample': sample,
+            'command': command,
+        }
+        event.update(metrics)
+        line = json.dumps(event)
+        with self._lock:
+            self.events_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.events_path, 'a') as f:
+                f.write(line + '\n')
+            self.latest[(step, sample or '')] = event
+            if self.textfile is not None:
+                self.write_textfile()
+        return event
+
+    def write_textfile(self):
+        """Rewrite the textfile-collector file with the latest value of every step"""
+        lines = []
+        for suffix, field, help_text in PROMETHEUS_METRICS:
+            name = f"metapipeline_step_{suffix}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for (step, sample), event in sorted(self.latest.items()):
+                lines.append(f'{name}{{step="{prometheus_label(step)}",sample="{prometheus_label(sample)}"}} '
+                             f'{event[field]}')
+        self.textfile.parent.mkdir(parents=True, exist_ok=True)
+        # node_exporter may read at any time: write aside, then rename
+        tmp_path = self.textfile.with_name(f"{self.textfile.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.textfile)
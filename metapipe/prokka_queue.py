@@ -0,0 +1,169 @@
+#####################################################################
+#                 PACKED PER-MAG PROKKA WORK QUEUE                 #
+#####################################################################
+
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+# Where src/5_taxonomicAssignmentMAGs_Update.sh writes the PhyloPhlAn table,
+# and the older location read by src/6_geneAnnotation.sh
+GENUS_TABLES = [
+    "taxonomy/MAGS/phylophlan/{sample}/{sample}_metagenomic.tsv",
+    "taxonomy/phylophlan/{sample}/{sample}_metagenomic.tsv",
+]
+STATUS_FILE = "prokka_status.json"
+GENUS_PATTERN = re.compile(r'g__([^|:\t]*)')
+
+
+def load_genus_map(tsv):
+    """{bin name: genus} from a phylophlan_assign_sgbs table, read once
+
+    Bins without a genus, or whose closest genus is an unnamed PhyloPhlAn
+    group (GGB...), map to None and are annotated without --genus.
+    """
+    genera = {}
+    if tsv is None or not os.path.exists(tsv):
+        return genera
+    with open(tsv) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            name, _, rest = line.rstrip('\n').partition('\t')
+            match = GENUS_PATTERN.search(rest)
+            genus = match.group(1) if match else ''
+            genera[name] = None if not genus or 'GGB' in genus else genus
+    return genera
+
+
+def genus_table(results, sample):
+    """PhyloPhlAn table of a sample, or None when taxMags did not write one"""
+    for pattern in GENUS_TABLES:
+        path = Path(results) / pattern.format(sample=sample)
+        if path.exists():
+            return path
+    return None
+
+
+def mag_jobs(results, sample, bins=None):
+    """One job per length-filtered MAG of a sample, largest first
+
+    bins are the sample's catalogue rows (with their genus); without them
+    the MaxBin directory is globbed and the PhyloPhlAn table read.
+    """
+    results = Path(results)
+    jobs = []
+    if bins is not None:
+        for row in bins:
+            if row['filtered']:
+                jobs.append({
+                    'sample': sample,
+                    'mag': row['mag'],
+                    'fasta': Path(row['filtered']),
+                    'outdir': results / "geneAnnotation" / sample / row['mag'],
+                    'genus': row['genus'],
+                })
+    else:
+        genera = load_genus_map(genus_table(results, sample))
+        for fasta in sorted((results / "assemblies" / sample / "maxbin").glob(f"{sample}.*.fasta")):
+            mag_bin = fasta.name[:-len('.fasta')]                  # S1.001
+            mag = fasta.name.replace('.', '_', 1).split('.')[0]    # S1_001
+            filtered = fasta.parent / f"{mag}_filtered.fasta.gz"
+            if not filtered.exists():
+                continue
+            jobs.append({
+                'sample': sample,
+                'mag': mag,
+                'fasta': filtered,
+                'outdir': results / "geneAnnotation" / sample / mag,
+                'genus': genera.get(mag_bin),
+            })
+    # Longest jobs start first so the last ones to finish are the small bins
+    jobs.sort(key=lambda job: os.path.getsize(job['fasta']), reverse=True)
+    return jobs
+
+
+def prokka_command(fasta, outdir, genus, cpus):
+    """Prokka invocation of src/6_geneAnnotation.sh for one MAG"""
+    cmd = ['prokka', '--outdir', str(outdir), '--kingdom', 'Bacteria']
+    if genus:
+        cmd += ['--usegenus', '--genus', genus]
+    cmd += ['--metagenome', '--centre', 'X', '--compliant', '--cpus', str(cpus), '--quiet', '--force', str(fasta)]
+    return cmd
+
+
+def input_signature(job):
+    """What a finished annotation depends on"""
+    st = os.stat(job['fasta'])
+    return {'fasta': str(job['fasta']), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'genus': job['genus']}
+
+
+def is_annotated(job):
+    """Whether the MAG's status records a completed run on the current input"""
+    try:
+        with open(Path(job['outdir']) / STATUS_FILE) as f:
+            return json.load(f).get('input') == input_signature(job)
+    except (OSError, ValueError):
+        return False
+
+
+def mark_annotated(job):
+    """Record a completed annotation next to its Prokka output"""
+    path = Path(job['outdir']) / STATUS_FILE
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'input': input_signature(job), 'completed': datetime.now().isoformat()}, f)
+    os.replace(tmp_path, path)
+
+
+def pack(total_cores, jobs, cores_per_job):
+    """(concurrent jobs, cores each) filling total_cores with small Prokka runs"""
+    total_cores = max(1, int(total_cores))
+    cores_per_job = max(1, min(int(cores_per_job), total_cores))
+    workers = max(1, min(jobs, total_cores // cores_per_job))
+    # With fewer MAGs than slots the spare cores go to the runs that exist
+    return workers, max(cores_per_job, total_cores // workers)
+
+
+def annotate_mags(jobs, total_cores, cores_per_job, run, logger=None):
+    """Run Prokka on every MAG not annotated yet, several at a time
+
+    run(cmd, job, cores) executes one command on cores cores and raises on
+    failure. Each MAG is
+    marked done as soon as its own run finishes, so an interrupted or
+    partly failed stage only redoes the missing bins. Returns
+    (annotated, skipped, failed) MAG names.
+    """
+    pending = [job for job in jobs if not is_annotated(job)]
+    skipped = [job['mag'] for job in jobs if job not in pending]
+    annotated, failed = [], []
+    if not pending:
+        return annotated, skipped, failed
+
+    workers, cpus = pack(total_cores, len(pending), cores_per_job)
+    if logger:
+        logger.info(f"Annotating {len(pending)} MAGs ({len(skipped)} already done): "
+                    f"{workers} Prokka runs at a time with {cpus} cores each")
+
+    def annotate(job):
+        Path(job['outdir']).parent.mkdir(parents=True, exist_ok=True)
+        run(prokka_command(job['fasta'], job['outdir'], job['genus'], cpus), job, cpus)
+        mark_annotated(job)
+        return job['mag']
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(annotate, job): job for job in pending}
+        for future in as_completed(futures):
+            mag = futures[future]['mag']
+            try:
+                future.result()
+            except Exception as e:
+                if logger:
+                    logger.error(f"Prokka failed for {mag} - {e}")
+                failed.append(mag)
+            else:
+                annotated.append(mag)
+    return annotated, skipped, failed
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+#####################################################################
+#                    VECTORIZED READ QC ENGINE                     #
+#####################################################################
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+try:
+    import numpy as np
+except ImportError:  # numpy ships with config/environment-full.yml
+    np = None
+
+from metapipe.fastq_stats import open_fastq
+
+BATCH_READS = 50000
+MAX_QUALITY = 64
+KMER_SIZE = 7
+KMER_READS = 1000000
+ADAPTER_KMER = 12
+ADAPTERS = {
+    'illumina_universal': 'AGATCGGAAGAG',
+    'illumina_small_rna_3p': 'TGGAATTCTCGG',
+    'nextera_transposase': 'CTGTCTCTTATA',
+}
+BASES = 'ACGTN'
+
+
+def require_numpy():
+    """Fail clearly when the QC engine is selected without numpy installed"""
+    if np is None:
+        raise RuntimeError("The numpy QC engine requires numpy (conda install numpy)")
+
+
+def base_lookup():
+    """Byte -> code table: A C G T = 0..3, anything else (N) = 4"""
+    table = np.full(256, 4, dtype=np.uint8)
+    for code, base in enumerate('ACGT'):
+        table[ord(base)] = code
+        table[ord(base.lower())] = code
+    return table
+
+
+def encode_kmer(sequence):
+    """2-bit integer code of a k-mer"""
+    code = 0
+    for base in sequence:
+        code = (code << 2) | 'ACGT'.index(base)
+    return code
+
+
+def decode_kmer(code, k):
+    """k-mer string of a 2-bit integer code"""
+    return ''.join('ACGT'[(code >> (2 * (k - 1 - i))) & 3] for i in range(k))
+
+
+def to_matrix(lines, pad):
+    """Pack newline-terminated lines into a (reads x max_length) uint8 matrix"""
+    sizes = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    lengths = sizes - 1
+    flat = np.frombuffer(b''.join(lines), dtype=np.uint8)
+    if sizes.size and sizes.min() == sizes.max():
+        # Fixed-length reads (untrimmed data): a plain reshape, no scatter
+        return flat.reshape(len(lines), int(sizes[0]))[:, :-1], lengths
+
+    rows = np.repeat(np.arange(len(lines), dtype=np.int32), sizes)
+    cols = np.arange(flat.size, dtype=np.int64) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    keep = cols < np.repeat(lengths, sizes)
+
+    matrix = np.full((len(lines), int(lengths.max(initial=0))), pad, dtype=np.uint8)
+    matrix[rows[keep], cols[keep]] = flat[keep]
+    return matrix, lengths
+
+
+class ReadQC:
+    """Streaming accumulator of FastQC-style metrics for one FASTQ file"""
+
+    def __init__(self, phred_offset=33, kmer_size=KMER_SIZE, kmer_reads=KMER_READS):
+        require_numpy()
+        self.phred_offset = phred_offset
+        self.kmer_size = kmer_size
+        self.kmer_reads = kmer_reads
+        self.lookup = base_lookup()
+        self.reads = 0
+        self.bases = 0
+        self.length_hist = np.zeros(1, dtype=np.int64)
+        self.quality_hist = np.zeros((0, MAX_QUALITY), dtype=np.int64)
+        self.composition = np.zeros((0, len(BASES)), dtype=np.int64)
+        self.gc_hist = np.zeros(101, dtype=np.int64)
+        self.kmer_counts = np.zeros(4 ** kmer_size, dtype=np.int64)
+        self.kmer_reads_seen = 0
+        self.adapter_codes = {name: encode_kmer(seq[:ADAPTER_KMER]) for name, seq in ADAPTERS.items()}
+        self.adapter_hist = {name: np.zeros(0, dtype=np.int64) for name in ADAPTERS}
+
+    def _grow(self, length):
+        """Extend the per-position accumulators to a new maximum read length"""
+        if length > self.quality_hist.shape[0]:
+            extra = length - self.quality_hist.shape[0]
+            self.quality_hist = np.vstack([self.quality_hist, np.zeros((extra, MAX_QUALITY), dtype=np.int64)])
+            self.composition = np.vstack([self.composition, np.zeros((extra, len(BASES)), dtype=np.int64)])
+            for name in self.adapter_hist:
+                self.adapter_hist[name] = np.concatenate([self.adapter_hist[name], np.zeros(extra, dtype=np.int64)])
+        if length + 1 > self.length_hist.size:
+            self.length_hist = np.concatenate([self.length_hist, np.zeros(length + 1 - self.length_hist.size, dtype=np.int64)])
+
+    def _kmer_codes(self, codes, bad_cumulative, k):
+        """Rolling 2-bit codes of every k-mer and whether it is free of N"""
+        width = codes.shape[1] - k + 1
+        if width <= 0:
+            return None, None
+        kmers = np.zeros((codes.shape[0], width), dtype=np.uint32)
+        for i in range(k):
+            kmers <<= 2
+            kmers |= codes[:, i:i + width]
+        # A k-mer is usable when no N or padding falls inside its window
+        ok = bad_cumulative[:, k:] == bad_cumulative[:, :width]
+        return kmers, ok
+
+    def add_batch(self, seq_lines, qual_lines):
+        """Accumulate metrics for one batch of records"""
+        seqs, lengths = to_matrix(seq_lines, ord('N'))
+        quals, _ = to_matrix(qual_lines, self.phred_offset)
+        n, width = seqs.shape
+        if n == 0:
+            return
+        self._grow(width)
+
+        valid = np.arange(width)[None, :] < lengths[:, None]
+        cols = np.broadcast_to(np.arange(width), (n, width))[valid]
+        self.reads += n
+        self.bases += int(lengths.sum())
+        self.length_hist[:lengths.max() + 1] += np.bincount(lengths, minlength=lengths.max() + 1)
+
+        # Per-position quality histogram (position x Phred score)
+        scores = np.clip(quals.astype(np.int64) - self.phred_offset, 0, MAX_QUALITY - 1)[valid]
+        self.quality_hist[:width] += np.bincount(cols * MAX_QUALITY + scores,
+                                                 minlength=width * MAX_QUALITY).reshape(width, MAX_QUALITY)
+
+        # Per-position base composition
+        codes = self.lookup[seqs]
+        self.composition[:width] += np.bincount(cols * len(BASES) + codes[valid],
+                                                minlength=width * len(BASES)).reshape(width, len(BASES))
+
+        # Per-read GC content
+        gc = ((codes == 1) | (codes == 2)) & valid
+        gc_percent = np.round(gc.sum(axis=1) * 100 / np.maximum(lengths, 1)).astype(np.int64)
+        self.gc_hist += np.bincount(gc_percent, minlength=101)
+
+        # Running count of N/padding positions, used to mask k-mers
+        bad = (codes > 3) | ~valid
+        bad_cumulative = np.zeros((n, width + 1), dtype=np.int32)
+        np.cumsum(bad, axis=1, out=bad_cumulative[:, 1:])
+        codes &= 3
+
+        # k-mer counts on the first kmer_reads reads
+        if self.kmer_reads_seen < self.kmer_reads:
+            kmers, ok = self._kmer_codes(codes, bad_cumulative, self.kmer_size)
+            if kmers is not None:
+                self.kmer_counts += np.bincount(kmers[ok], minlength=self.kmer_counts.size)
+            self.kmer_reads_seen += n
+
+        # Adapter content: first position of each adapter's 12-mer in each read
+        kmers, ok = self._kmer_codes(codes, bad_cumulative, ADAPTER_KMER)
+        if kmers is not None:
+            for name, code in self.adapter_codes.items():
+                hit = (kmers == code) & ok
+                found = hit.any(axis=1)
+                first = hit.argmax(axis=1)[found]
+                self.adapter_hist[name][:kmers.shape[1]] += np.bincount(first, minlength=kmers.shape[1])
+
+    def quality_quantiles(self):
+        """Mean and FastQC quantiles of the Phred score at every position"""
+        totals = self.quality_hist.sum(axis=1)
+        cumulative = self.quality_hist.cumsum(axis=1)
+        scores = np.arange(MAX_QUALITY)
+        report = []
+        for pos in range(self.quality_hist.shape[0]):
+            total = totals[pos]
+            if total == 0:
+                continue
+            row = {'position': pos + 1,
+                   'mean': round(float((self.quality_hist[pos] * scores).sum() / total), 2)}
+            for label, fraction in (('p10', 0.1), ('q1', 0.25), ('median', 0.5), ('q3', 0.75), ('p90', 0.9)):
+                row[label] = int(np.searchsorted(cumulative[pos], fraction * total))
+            report.append(row)
+        return report
+
+    def overrepresented_kmers(self, top=20, min_ratio=5.0):
+        """k-mers seen far more often than a uniform expectation"""
+        total = self.kmer_counts.sum()
+        if total == 0:
+            return []
+        expected = total / self.kmer_counts.size
+        best = np.argsort(self.kmer_counts)[::-1][:top]
+        return [{'kmer': decode_kmer(int(code), self.kmer_size),
+                 'count': int(self.kmer_counts[code]),
+                 'obs_exp': round(float(self.kmer_counts[code] / expected), 2)}
+                for code in best if self.kmer_counts[code] / expected >= min_ratio]
+
+    def report(self):
+        """Machine-readable QC report"""
+        composition = self.composition.sum(axis=1)
+        percent = {base: [round(float(v), 2) for v in self.composition[:, i] * 100 / np.maximum(composition, 1)]
+                   for i, base in enumerate(BASES)}
+        gc_total = self.gc_hist.sum()
+        lengths = np.nonzero(self.length_hist)[0]
+        return {
+            'reads': int(self.reads),
+            'bases': int(self.bases),
+            'length': {
+                'min': int(lengths.min()) if lengths.size else 0,
+                'max': int(lengths.max()) if lengths.size else 0,
+                'mean': round(self.bases / self.reads, 2) if self.reads else 0,
+            },
+            'per_position_quality': self.quality_quantiles(),
+            'per_position_composition': percent,
+            'gc_distribution': self.gc_hist.tolist(),
+            'mean_gc': round(float((self.gc_hist * np.arange(101)).sum() / gc_total), 2) if gc_total else 0,
+            'overrepresented_kmers': self.overrepresented_kmers(),
+            'adapter_content': {
+                name: [round(float(v), 4) for v in np.cumsum(hist) * 100 / max(self.reads, 1)]
+                for name, hist in self.adapter_hist.items()
+            },
+        }
+
+
+def qc_file(path, threads=2, batch_reads=BATCH_READS):
+    """Stream a FASTQ in batches and return its QC report"""
+    qc = ReadQC()
+    with open_fastq(path, threads) as handle:
+        while True:
+            lines = list(islice(handle, 4 * batch_reads))
+            if not lines:
+                break
+            qc.add_batch(lines[1::4], lines[3::4])
+    report = qc.report()
+    report['file'] = str(path)
+    return report
+
+
+def qc_files(paths, output_dir, threads=2):
+    """QC several FASTQ files side by side and write one JSON report per file"""
+    require_numpy()
+    os.makedirs(output_dir, exist_ok=True)
+    paths = [str(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=max(1, len(paths))) as pool:
+        reports = list(pool.map(lambda p: qc_file(p, max(1, threads // len(paths))), paths))
+
+    written = []
+    for path, report in zip(paths, reports):
+        name = os.path.basename(path).split('.')[0]
+        out = os.path.join(output_dir, f"{name}.qc.json")
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=1)
+        written.append(out)
+    return written
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Vectorized FASTQ quality report")
+    parser.add_argument("files", nargs='+', help="FASTQ files (plain or gzip)")
+    parser.add_argument("-o", "--output", required=True, help="Output directory for the JSON reports")
+    parser.add_argument("-t", "--threads", type=int, default=2, help="Decompression threads")
+    args = parser.parse_args()
+
+    for report in qc_files(args.files, args.output, args.threads):
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
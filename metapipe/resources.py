@@ -0,0 +1,91 @@
+#####################################################################
+#                    MEMORY ESTIMATES PER STAGE                    #
+#####################################################################
+
+import json
+import os
+import threading
+from pathlib import Path
+
+GB = 1024 ** 3
+DEFAULT_HISTORY = Path.home() / ".cache" / "metapipeline" / "memory_history.json"
+HISTORY_SIZE = 20
+SAFETY_MARGIN = 1.2
+
+# Memory per task before any run was observed: (base bytes, bytes per input byte)
+STAGE_MEMORY = {
+    'qc': (2 * GB, 0),                  # Trimmomatic/FastQC JVMs
+    'rmHost': (4 * GB, 0),              # Bowtie2 human index
+    'taxAssignment': (2 * GB, 0),       # plus the database when it is not shared
+    'normalize': (5 * GB, 0),           # count-min sketch (normalization_memory_gb) and read batches
+    'assembly': (16 * GB, 4),           # metaSPAdes
+    'binning': (40 * GB, 0),            # CheckM lineage_wf (pplacer)
+    'taxMags': (8 * GB, 0),
+    'geneAnnotation': (2 * GB, 0),
+    'funcAnnotation': (16 * GB, 0),     # emapper/DIAMOND blocks
+}
+
+
+def available_memory():
+    """MemAvailable from /proc/meminfo in bytes, or None when unknown"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def input_size(paths):
+    """Total size in bytes of the existing files among paths"""
+    return sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+
+
+class MemoryModel:
+    """Estimate a task's peak memory from its input size and past runs"""
+
+    def __init__(self, history_path=DEFAULT_HISTORY, overrides=None):
+        self.path = Path(history_path).expanduser()
+        self.overrides = overrides or {}
+        self._lock = threading.Lock()
+        self.history = {}
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    self.history = json.load(f)
+            except (OSError, ValueError):
+                self.history = {}
+
+    def estimate(self, stage, input_bytes):
+        """Bytes to reserve for one task of a stage"""
+        if self.overrides.get(stage):
+            return self.overrides[stage]
+        with self._lock:
+            observed = list(self.history.get(stage, []))
+        if observed:
+            # Scale past peaks up (never down) to the new input size
+            return int(SAFETY_MARGIN * max(peak * max(1.0, input_bytes / max(size, 1))
+                                           for size, peak in observed))
+        base, per_byte = STAGE_MEMORY.get(stage, (1 * GB, 0))
+        return int(base + per_byte * input_bytes)
+
+    def observe(self, stage, input_bytes, peak_bytes):
+        """Remember the peak memory of a finished task"""
+        if not peak_bytes:
+            return
+        with self._lock:
+            observed = self.history.setdefault(stage, [])
+            observed.append([int(input_bytes), int(peak_bytes)])
+            del observed[:-HISTORY_SIZE]
+
+    def save(self):
+        """Write the history atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = json.dumps(self.history)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
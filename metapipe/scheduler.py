@@ -0,0 +1,245 @@
+#####################################################################
+#                     SAMPLE-LEVEL DAG SCHEDULER                   #
+#####################################################################
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metapipe.resources import available_memory
+
+# Task states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+_local = threading.local()
+
+
+def current_task():
+    """Task being run by the calling worker thread, or None"""
+    return getattr(_local, 'task', None)
+
+
+def run_in_task(task, func, *args, **kwargs):
+    """Call func on behalf of task from another thread, e.g. a task's own helper pool"""
+    previous = current_task()
+    _local.task = task
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.task = previous
+
+
+class Task:
+    """A unit of work, usually one (sample, stage) pair"""
+
+    def __init__(self, name, func, sample=None, stage=None, deps=None, cores=1, require_all=True, always=False,
+                 memory=0, after=None):
+        self.name = name
+        self.func = func
+        self.sample = sample
+        self.stage = stage
+        self.deps = list(deps or [])
+        # Ordering-only dependencies: waited for, whatever their outcome
+        self.after = list(after or [])
+        self.cores = max(1, int(cores))
+        # Aggregate tasks (require_all=False) run once every dependency has
+        # finished and at least one of them succeeded
+        self.require_all = require_all
+        # Cleanup tasks (always=True) run once every dependency has finished,
+        # whatever the outcome
+        self.always = always
+        # Bytes to reserve while the task runs; a callable is evaluated once
+        # the task is ready, so it can look at the outputs of its dependencies
+        self.memory = memory
+        # Upper bound handed to tools that accept a memory limit, set on dispatch
+        self.memory_cap = None
+        self.peak_memory = 0
+        self.state = PENDING
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def elapsed(self):
+        """Wall-clock seconds spent running the task"""
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+
+class DAGScheduler:
+    """Run tasks as soon as their dependencies finish, within a global core budget"""
+
+    def __init__(self, max_cores, max_workers=None, logger=None, max_memory=None):
+        self.max_cores = max(1, int(max_cores))
+        self.max_workers = max(1, int(max_workers or self.max_cores))
+        self.max_memory = max_memory
+        self.logger = logger or logging.getLogger(__name__)
+        self.tasks = {}
+        self._order = []
+        self._cond = threading.Condition()
+        self._cores_in_use = 0
+        self._memory_in_use = 0
+        self._running = 0
+
+    def add_task(self, task):
+        """Register a task; tasks added first are preferred when several are ready"""
+        if task.name in self.tasks:
+            raise ValueError(f"Duplicate task name: {task.name}")
+        self.tasks[task.name] = task
+        self._order.append(task.name)
+        return task
+
+    def validate(self):
+        """Check that every dependency exists and that the graph has no cycles"""
+        for task in self.tasks.values():
+            for dep in task.deps + task.after:
+                if dep not in self.tasks:
+                    raise ValueError(f"Task {task.name} depends on unknown task {dep}")
+
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle detected at task {name}")
+            visiting.add(name)
+            for dep in self.tasks[name].deps + self.tasks[name].after:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self._order:
+            visit(name)
+
+    def _verdict(self, task):
+        """Return 'run', 'skip' or None (still waiting) for a pending task"""
+        states = [self.tasks[dep].state for dep in task.deps]
+        if any(self.tasks[dep].state in (PENDING, RUNNING) for dep in task.deps + task.after):
+            return None
+        if task.always:
+            return 'run'
+        if task.require_all:
+            return 'run' if all(state == DONE for state in states) else 'skip'
+        return 'run' if not states or DONE in states else 'skip'
+
+    def _admit(self, task):
+        """Check the core and memory budgets and worker slots for a ready task"""
+        if self._running >= self.max_workers:
+            return False
+        cores = min(task.cores, self.max_cores)
+        if self._cores_in_use + cores > self.max_cores:
+            return False
+        if self.max_memory is None or not task.memory or not self._running:
+            # An idle scheduler always admits, even a task over the budget
+            return True
+        if self._memory_in_use + task.memory > self.max_memory:
+            return False
+        # Memory used outside the scheduler counts too
+        available = available_memory()
+        return available is None or task.memory <= available
+
+    def _execute(self, task, cores):
+        """Worker body: run the task and release its cores and memory"""
+        _local.task = task
+        task.start_time = time.time()
+        try:
+            task.func()
+            state = DONE
+        except Exception as e:
+            task.error = e
+            state = FAILED
+            self.logger.error(f"Task failed: {task.name} - {e}")
+        task.end_time = time.time()
+        _local.task = None
+
+        with self._cond:
+            task.state = state
+            self._cores_in_use -= cores
+            self._memory_in_use -= task.memory
+            self._running -= 1
+            self._cond.notify_all()
+
+    def _dispatch(self, pool):
+        """Skip unreachable tasks and start every admissible ready task"""
+        progressed = True
+        while progressed:
+            progressed = False
+            for name in self._order:
+                task = self.tasks[name]
+                if task.state != PENDING:
+                    continue
+                verdict = self._verdict(task)
+                if verdict == 'skip':
+                    task.state = SKIPPED
+                    self.logger.warning(f"Skipping {task.name}: an upstream task did not succeed")
+                    progressed = True
+                elif verdict == 'run':
+                    if callable(task.memory):
+                        task.memory = int(task.memory())
+                        if self.max_memory is not None and task.memory > self.max_memory:
+                            self.logger.warning(f"{task.name} needs an estimated {task.memory / 1e9:.1f} GB, more "
+                                                f"than the {self.max_memory / 1e9:.1f} GB budget; it will run alone")
+                    if not self._admit(task):
+                        continue
+                    cores = min(task.cores, self.max_cores)
+                    task.state = RUNNING
+                    if self.max_memory is not None:
+                        # Tools get the task's own reservation (at most the
+                        # budget), so tasks admitted next to it cannot be
+                        # overcommitted; a task without an estimate reserves
+                        # nothing and is bounded by what is unreserved
+                        task.memory_cap = min(task.memory, self.max_memory) if task.memory \
+                            else max(0, self.max_memory - self._memory_in_use)
+                    self._cores_in_use += cores
+                    self._memory_in_use += task.memory
+                    self._running += 1
+                    memory = f", {task.memory / 1e9:.1f} GB" if task.memory else ""
+                    self.logger.info(f"Dispatching {task.name} ({cores} cores{memory}, "
+                                     f"{self._cores_in_use}/{self.max_cores} in use)")
+                    pool.submit(self._execute, task, cores)
+
+    def run(self):
+        """Run the whole graph and return a summary of task states"""
+        self.validate()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            with self._cond:
+                while True:
+                    self._dispatch(pool)
+                    if not any(t.state in (PENDING, RUNNING) for t in self.tasks.values()):
+                        break
+                    self._cond.wait()
+        return self.summary()
+
+    def summary(self):
+        """Group task names by state and list the samples with failures"""
+        summary = {state: [] for state in (DONE, FAILED, SKIPPED, PENDING, RUNNING)}
+        for name in self._order:
+            summary[self.tasks[name].state].append(name)
+        summary['failed_samples'] = sorted({
+            t.sample for t in self.tasks.values()
+            if t.state == FAILED and t.sample is not None
+        })
+        return summary
+
+    def timeline(self):
+        """Start, end and cores of every task that ran, for utilisation reports
+
+        Times are epoch seconds; the run spans the first start to the last
+        end, and the core-seconds not covered by a task are scheduler idle time.
+        """
+        ran = [self.tasks[name] for name in self._order if self.tasks[name].start_time is not None]
+        return {
+            'max_cores': self.max_cores,
+            'start': min((t.start_time for t in ran), default=None),
+            'end': max((t.end_time for t in ran if t.end_time is not None), default=None),
+            'tasks': [{'name': t.name, 'stage': t.stage, 'sample': t.sample,
+                       'cores': min(t.cores, self.max_cores), 'start': t.start_time, 'end': t.end_time,
+                       'state': t.state} for t in ran],
+        }
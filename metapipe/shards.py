@@ -0,0 +1,242 @@
+#####################################################################
+#           FASTQ SHARDING AND MERGING OF SHARD OUTPUTS            #
+#####################################################################
+
+import os
+import re
+import shutil
+import subprocess
+from itertools import islice
+
+from metapipe.fastq_stats import open_fastq
+from metapipe.kraken_table import parse_report
+
+COPY_LINES = 400000  # FASTQ lines handed to the compressor at a time
+BOWTIE2_LINE = re.compile(r'^( *)(\d+) (\([\d.]+%\) )?(.*)$')
+FLAGSTAT_LINE = re.compile(r'^(\d+) \+ (\d+) (.*?)(?: \((?:[\d.]+%|N/A) : (?:[\d.]+%|N/A)\))?$')
+# Denominator of each percentage samtools flagstat prints
+FLAGSTAT_PERCENT = {
+    'mapped': 'in total',
+    'primary mapped': 'primary',
+    'properly paired': 'paired in sequencing',
+    'singletons': 'paired in sequencing',
+}
+
+
+def shard_names(count):
+    """Directory names of the shards of a sample: 000, 001, ..."""
+    return [f"{i:03d}" for i in range(count)]
+
+
+def shard_ranges(total, count):
+    """Contiguous [start, end) record ranges of near-equal size"""
+    return [(i * total // count, (i + 1) * total // count) for i in range(count)]
+
+
+def copy_records(handle, output, records, compress):
+    """Copy the next records of a FASTQ stream into output through compress"""
+    tmp_path = f"{output}.{os.getpid()}.tmp"
+    wanted = 4 * records
+    copied = 0
+    with open(tmp_path, 'wb') as out:
+        process = subprocess.Popen(compress, stdin=subprocess.PIPE, stdout=out)
+        try:
+            while copied < wanted:
+                lines = list(islice(handle, min(COPY_LINES, wanted - copied)))
+                if not lines:
+                    break
+                process.stdin.writelines(lines)
+                copied += len(lines)
+        finally:
+            process.stdin.close()
+            returncode = process.wait()
+    if returncode != 0:
+        os.unlink(tmp_path)
+        raise subprocess.CalledProcessError(returncode, compress)
+    if copied != wanted:
+        os.unlink(tmp_path)
+        raise ValueError(f"Input ended after {copied // 4} of {records} records while writing {output}")
+    os.replace(tmp_path, output)
+
+
+def split_pairs(reads1, reads2, outputs, total, compress, threads=2):
+    """Split paired FASTQ files into contiguous, record-aligned shards
+
+    outputs holds one (mate 1, mate 2) pair of paths per shard and total is
+    the number of read pairs. Shard i gets the i-th contiguous range of
+    records, so concatenating the per-shard outputs of a tool that keeps
+    read order gives the output of the unsharded run. Both inputs are read
+    once; only the shards are recompressed, with compress (e.g. gzip -1).
+    """
+    ranges = shard_ranges(total, len(outputs))
+    with open_fastq(reads1, threads) as in1, open_fastq(reads2, threads) as in2:
+        for (start, end), (out1, out2) in zip(ranges, outputs):
+            copy_records(in1, out1, end - start, compress)
+            copy_records(in2, out2, end - start, compress)
+        if in1.readline() or in2.readline():
+            raise ValueError(f"{reads1} or {reads2} holds more than {total} reads")
+    return ranges
+
+
+def concat_files(parts, output):
+    """Concatenate files byte for byte; gzip members stay valid when concatenated"""
+    tmp_path = f"{output}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as out:
+        for part in parts:
+            with open(part, 'rb') as f:
+                shutil.copyfileobj(f, out, 16 * 1024 * 1024)
+    os.replace(tmp_path, output)
+
+
+def merge_kraken_reports(reports, output):
+    """Sum Kraken reports of the shards of one sample into a single report
+
+    Clade and taxon read counts add up; percentages are recomputed over all
+    reads. Taxa are written in Kraken's order (unclassified, then depth
+    first with siblings by decreasing clade count); siblings with equal
+    counts are ordered by taxid.
+    """
+    clade, direct, parents, info = {}, {}, {}, {}
+    for report in reports:
+        with open(report) as f:
+            if any(len(line.split('\t')) == 8 for line in islice(f, 1)):
+                raise ValueError(f"{report}: reports with minimizer data cannot be summed")
+        for taxid, parent, rank, name, clade_reads, taxon_reads in parse_report(report):
+            clade[taxid] = clade.get(taxid, 0) + clade_reads
+            direct[taxid] = direct.get(taxid, 0) + taxon_reads
+            parents.setdefault(taxid, parent)
+            info.setdefault(taxid, (rank, name))
+
+    children = {}
+    for taxid, parent in parents.items():
+        if taxid != 0:
+            children.setdefault(parent, []).append(taxid)
+    total = clade.get(0, 0) + sum(clade[t] for t in children.get(0, []))
+
+    lines = []
+
+    def write(taxid, depth):
+        rank, name = info[taxid]
+        percent = 100.0 * clade[taxid] / total if total else 0.0
+        lines.append(f"{percent:6.2f}\t{clade[taxid]}\t{direct[taxid]}\t{rank}\t{taxid}\t{'  ' * depth}{name}\n")
+
+    def visit(taxid, depth):
+        if not clade[taxid]:
+            return
+        write(taxid, depth)
+        for child in sorted(children.get(taxid, []), key=lambda t: (-clade[t], t)):
+            visit(child, depth + 1)
+
+    # Unclassified (taxid 0) comes first; the roots hang below it in the parent map
+    if clade.get(0):
+        write(0, 0)
+    for taxid in sorted(children.get(0, []), key=lambda t: (-clade[t], t)):
+        visit(taxid, 0)
+
+    tmp_path = f"{output}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.writelines(lines)
+    os.replace(tmp_path, output)
+    return total
+
+
+def parse_flagstat(path):
+    """[(description, passed, failed)] in the order samtools flagstat prints them"""
+    rows = []
+    with open(path) as f:
+        for line in f:
+            match = FLAGSTAT_LINE.match(line.rstrip('\n'))
+            if match:
+                rows.append((match.group(3), int(match.group(1)), int(match.group(2))))
+    return rows
+
+
+def merge_flagstat(paths, output):
+    """Sum samtools flagstat outputs and recompute their percentages"""
+    merged = None
+    for path in paths:
+        rows = parse_flagstat(path)
+        if merged is None:
+            merged = [[description, passed, failed] for description, passed, failed in rows]
+            continue
+        if [row[0] for row in merged] != [row[0] for row in rows]:
+            raise ValueError(f"{path} does not have the same flagstat lines as {paths[0]}")
+        for row, (_, passed, failed) in zip(merged, rows):
+            row[1] += passed
+            row[2] += failed
+
+    # 'in total' is followed by '(QC-passed reads + QC-failed reads)'
+    totals = {description.split(' (')[0]: (passed, failed) for description, passed, failed in merged or []}
+
+    def percent(count, total):
+        return f"{100.0 * count / total:.2f}%" if total else "N/A"
+
+    with open(output, 'w') as f:
+        for description, passed, failed in merged or []:
+            line = f"{passed} + {failed} {description}"
+            if description in FLAGSTAT_PERCENT:
+                total_passed, total_failed = totals.get(FLAGSTAT_PERCENT[description], (0, 0))
+                line += f" ({percent(passed, total_passed)} : {percent(failed, total_failed)})"
+            f.write(line + '\n')
+
+
+def parse_bowtie2_summary(path):
+    """[(indent, count, has a percentage, text)] of the alignment summary in a Bowtie2 log"""
+    rows = []
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            match = BOWTIE2_LINE.match(line)
+            if match:
+                rows.append((len(match.group(1)), int(match.group(2)), bool(match.group(3)), match.group(4)))
+            elif line.strip() == '----':
+                rows.append((len(line) - len(line.lstrip()), None, False, '----'))
+    return rows
+
+
+def merge_bowtie2_logs(paths, output):
+    """Sum the alignment summaries of Bowtie2 logs into one summary
+
+    Counts are added line by line; each percentage is recomputed against the
+    nearest less indented count above it, as Bowtie2 prints them, and the
+    overall alignment rate from the unaligned mates and reads.
+    """
+    merged = None
+    for path in paths:
+        rows = parse_bowtie2_summary(path)
+        if merged is None:
+            merged = [list(row) for row in rows]
+            continue
+        if [(row[0], row[3]) for row in merged] != [(row[0], row[3]) for row in rows]:
+            raise ValueError(f"{path} does not have the same alignment summary as {paths[0]}")
+        for row, (_, count, _, _) in zip(merged, rows):
+            if count is not None:
+                row[1] += count
+
+    lines = []
+    parents = []
+    for indent, count, has_percent, text in merged or []:
+        if count is None:
+            lines.append(f"{' ' * indent}----")
+            continue
+        while parents and parents[-1][0] >= indent:
+            parents.pop()
+        if has_percent and parents:
+            total = parents[-1][1]
+            share = 100.0 * count / total if total else 0.0
+            lines.append(f"{' ' * indent}{count} ({share:.2f}%) {text}")
+        else:
+            lines.append(f"{' ' * indent}{count} {text}")
+        parents.append((indent, count))
+
+    counts = {}
+    for _, count, _, text in merged or []:
+        if count is not None:
+            counts[text] = counts.get(text, 0) + count
+    mates = 2 * counts.get('were paired; of these:', 0) + counts.get('were unpaired; of these:', 0)
+    if mates:
+        rate = 100.0 * (mates - counts.get('aligned 0 times', 0)) / mates
+        lines.append(f"{rate:.2f}% overall alignment rate")
+
+    with open(output, 'w') as f:
+        f.writelines(line + '\n' for line in lines)
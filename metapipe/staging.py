@@ -0,0 +1,177 @@
+#####################################################################
+#                   ZERO-COPY PROJECT STAGING                      #
+#####################################################################
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from metapipe.checksums import HASH_BUFFER, new_digest
+
+STAGING_MODES = ['auto', 'reflink', 'hardlink', 'symlink', 'copy']
+FICLONE = 0x40049409  # ioctl(dest, FICLONE, src) on Linux (btrfs, XFS, ...)
+# Errors meaning "this filesystem can't link/clone here", answered by copying
+ZERO_COPY_ERRORS = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                    errno.EPERM, errno.EMLINK, errno.ENOSYS)
+
+# Layout created by src/setup3.sh
+PROJECT_DIRS = [
+    "results/fastqc/beforeTrimQC",
+    "results/fastqc/trimQC",
+    "results/taxonomy/reads/kraken",
+    "results/taxonomy/contigs/kraken",
+    "results/taxonomy/MAGS/phylophlan",
+    "results/assemblies",
+    "results/trimmed-reads",
+    "results/untrimmed-reads",
+    "results/host_removed",
+    "results/geneAnnotation",
+    "results/functionalAnnotation/eggNOG",
+    "results/functionalAnnotation/kofam",
+]
+SAMPLE_DIRS = [
+    "results/taxonomy/reads/kraken",
+    "results/taxonomy/contigs/kraken",
+    "results/taxonomy/MAGS/phylophlan",
+    "results/assemblies",
+    "results/fastqc/beforeTrimQC",
+    "results/fastqc/trimQC",
+    "results/trimmed-reads",
+    "results/untrimmed-reads",
+    "results/host_removed",
+    "results/functionalAnnotation/eggNOG",
+    "results/functionalAnnotation/kofam",
+]
+
+
+def mate_pattern(pattern):
+    """Reverse-read pattern of a forward one: its last 1 becomes 2 (_R1 -> _R2, _1 -> _2)"""
+    i = pattern.rfind('1')
+    if i < 0:
+        raise ValueError(f"Cannot derive the reverse-read pattern of {pattern}; give it explicitly")
+    return f"{pattern[:i]}2{pattern[i + 1:]}"
+
+
+def select_reads(reads_dir, pattern, extension, prefix=None, reverse_pattern=None):
+    """Samples with a read <sample><pattern>.extension and their files to stage
+
+    Only the two mates <sample><pattern>.<ext> and <sample><reverse_pattern>.<ext>
+    belong to a sample, so S1 never picks up the reads of S10.
+    """
+    reverse_pattern = reverse_pattern or mate_pattern(pattern)
+    suffix = f"{pattern}.{extension}"
+    samples = {}
+    for read in sorted(Path(reads_dir).glob(f"*{suffix}")):
+        base = read.name[:-len(suffix)]
+        if not base or (prefix and not base.startswith(prefix)):
+            continue
+        mates = [read, Path(reads_dir) / f"{base}{reverse_pattern}.{extension}"]
+        samples[base] = sorted({p for p in mates if p.is_file()})
+    return samples
+
+
+def reflink(src, dest):
+    """Copy-on-write clone of src; raises OSError when the filesystem can't"""
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+        try:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdest.close()
+            os.unlink(dest)
+            raise
+
+
+def copy_with_checksum(src, dest, algorithm='md5', buffer_size=HASH_BUFFER):
+    """Copy a file and hash it from the same read"""
+    digest = new_digest(algorithm)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(src, 'rb', buffering=0) as fsrc, open(dest, 'wb', buffering=0) as fdest:
+        while True:
+            n = fsrc.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+            fdest.write(view[:n])
+    shutil.copystat(src, dest)
+    return digest.hexdigest()
+
+
+class Stager:
+    """Place delivery files in raw-reads/ without duplicating data where possible"""
+
+    def __init__(self, mode='auto', algorithm='md5', cache=None, logger=None):
+        if mode not in STAGING_MODES:
+            raise ValueError(f"Unknown staging mode: {mode}")
+        self.mode = mode
+        self.algorithm = algorithm
+        self.cache = cache
+        self.logger = logger or logging.getLogger(__name__)
+
+    def stage_file(self, src, dest):
+        """Stage one file and return the method that was used"""
+        src, dest = Path(src).absolute(), Path(dest)
+        if dest.exists():
+            src_st, dest_st = src.stat(), dest.stat()
+            same_file = (src_st.st_dev, src_st.st_ino) == (dest_st.st_dev, dest_st.st_ino)
+            if same_file or (src_st.st_size, src_st.st_mtime_ns) == (dest_st.st_size, dest_st.st_mtime_ns):
+                return 'existing'
+        if dest.exists() or dest.is_symlink():
+            dest.unlink()
+
+        attempts = ['reflink', 'hardlink'] if self.mode == 'auto' else [self.mode]
+        for method in attempts:
+            try:
+                if method == 'symlink':
+                    dest.symlink_to(src)
+                elif method == 'hardlink':
+                    os.link(src, dest)
+                elif method == 'reflink':
+                    reflink(src, dest)
+                else:
+                    self._copy(src, dest)
+                return method
+            except OSError as e:
+                if method == 'copy' or e.errno not in ZERO_COPY_ERRORS:
+                    raise
+                if self.mode != 'auto':
+                    self.logger.warning(f"{method} not possible for {src.name} ({e.strerror}), copying")
+        self._copy(src, dest)
+        return 'copy'
+
+    def _copy(self, src, dest):
+        """Physical copy, hashed in the same read"""
+        checksum = copy_with_checksum(src, dest, self.algorithm)
+        if self.cache is not None:
+            # Source and copy share the checksum: md5 needs no second pass
+            self.cache.put(src, self.algorithm, checksum)
+            self.cache.put(dest, self.algorithm, checksum)
+
+    def stage(self, files, dest_dir, threads=4):
+        """Stage files concurrently into dest_dir, returning {file name: method}"""
+        dest_dir = Path(dest_dir)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        # One source per destination: staging a file twice at once races on it
+        unique = {}
+        for f in files:
+            unique.setdefault(Path(f).name, f)
+        files = list(unique.values())
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+            methods = list(pool.map(lambda f: self.stage_file(f, dest_dir / Path(f).name), files))
+        if self.cache is not None:
+            self.cache.save()
+        return {Path(f).name: method for f, method in zip(files, methods)}
+
+
+def create_project_dirs(working_dir, samples):
+    """Create the results/ layout for a project and its samples"""
+    working_dir = Path(working_dir)
+    for directory in PROJECT_DIRS:
+        (working_dir / directory).mkdir(parents=True, exist_ok=True)
+    for sample in samples:
+        for directory in SAMPLE_DIRS:
+            (working_dir / directory / sample).mkdir(parents=True, exist_ok=True)
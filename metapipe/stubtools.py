@@ -0,0 +1,650 @@
+#!/usr/bin/env python3
+
+#####################################################################
+#         STAND-IN BIOINFORMATICS TOOLS FOR THE BENCHMARKS         #
+#####################################################################
+
+# One executable for every tool the pipeline calls, dispatched on the name
+# it is run as (a symlink per tool in the benchmark's bin/ directory). Each
+# stand-in reads and writes files in the layout of the real tool, using the
+# origin encoded in synthetic read names (<genome>.<taxid>.<genus>.<n>), and
+# burns CPU, holds memory and writes scratch data as set by its profile.
+
+import gzip
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+VERSION = "stub"
+# Load per tool: startup seconds, CPU seconds and scratch MB per GB of input,
+# resident memory in MB (fixed and per GB of input)
+DEFAULT_PROFILE = {
+    'fastqc': {'startup_seconds': 0.5, 'cpu_seconds_per_gb': 20},
+    'trimmomatic': {'startup_seconds': 0.5, 'cpu_seconds_per_gb': 30, 'memory_mb': 64},
+    'bowtie2': {'startup_seconds': 0.2, 'cpu_seconds_per_gb': 120, 'memory_mb': 64},
+    'bowtie2-build': {'cpu_seconds_per_gb': 200},
+    'samtools': {'cpu_seconds_per_gb': 10},
+    'kraken2': {'startup_seconds': 0.5, 'cpu_seconds_per_gb': 20, 'memory_mb': 256},
+    'kraken-biom': {},
+    'metaspades.py': {'startup_seconds': 1, 'cpu_seconds_per_gb': 400, 'memory_mb': 128,
+                      'memory_mb_per_gb': 2000, 'io_mb_per_gb': 2000},
+    'run_MaxBin.pl': {'startup_seconds': 0.5, 'cpu_seconds_per_gb': 200},
+    'checkm': {'startup_seconds': 1, 'cpu_seconds_per_gb': 500, 'memory_mb': 256},
+    'seqkit': {},
+    'phylophlan_assign_sgbs': {'startup_seconds': 1, 'cpu_seconds_per_gb': 200, 'memory_mb': 128},
+    'prokka': {'startup_seconds': 1, 'cpu_seconds_per_gb': 1000},
+    'emapper.py': {'startup_seconds': 1, 'cpu_seconds_per_gb': 2000, 'memory_mb': 256},
+}
+TOOLS = sorted(DEFAULT_PROFILE) + ['spades.py']
+UNCLASSIFIED_PERCENT = 10
+CONTIG_LENGTH = 5000
+GENE_LENGTH = 1000
+
+
+def tool_profile(tool):
+    """Load settings of a tool, overridden by the JSON file in METAPIPELINE_STUB_PROFILE"""
+    profile = {'startup_seconds': 0, 'cpu_seconds_per_gb': 0, 'memory_mb': 0, 'memory_mb_per_gb': 0,
+               'io_mb_per_gb': 0}
+    profile.update(DEFAULT_PROFILE.get(tool, {}))
+    path = os.environ.get('METAPIPELINE_STUB_PROFILE')
+    if path:
+        with open(path) as f:
+            profile.update(json.load(f).get(tool, {}))
+    return profile
+
+
+def spin(seconds):
+    """Burn CPU time on one core"""
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+
+
+def simulate_load(tool, input_bytes, threads=1):
+    """Startup delay, CPU on up to threads cores, resident memory and scratch I/O of a run"""
+    profile = tool_profile(tool)
+    gb = input_bytes / 1e9
+    time.sleep(profile['startup_seconds'])
+    cpu_seconds = profile['cpu_seconds_per_gb'] * gb
+    workers = []
+    if cpu_seconds > 0:
+        threads = max(1, min(int(threads), os.cpu_count() or 1))
+        for _ in range(threads):
+            worker = multiprocessing.Process(target=spin, args=(cpu_seconds / threads,))
+            worker.start()
+            workers.append(worker)
+    # Filled (not just reserved) so the pages are resident
+    memory = b'\x01' * int((profile['memory_mb'] + profile['memory_mb_per_gb'] * gb) * 2 ** 20)
+    scratch = int(profile['io_mb_per_gb'] * gb * 2 ** 20)
+    if scratch:
+        block = os.urandom(2 ** 20)
+        with tempfile.TemporaryFile(dir=os.environ.get('TMPDIR')) as f:
+            for _ in range(0, scratch, len(block)):
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+    for worker in workers:
+        worker.join()
+    del memory
+
+
+def option(args, *names, default=None):
+    """Value following the first of names in args"""
+    for name in names:
+        if name in args:
+            return args[args.index(name) + 1]
+    return default
+
+
+def sizes(paths):
+    """Total bytes of the existing files among paths"""
+    return sum(os.path.getsize(p) for p in paths if p and os.path.isfile(p))
+
+
+def open_text(path, mode='rt', level=1):
+    """Text handle on a plain or gzip file, '-' for stdin/stdout"""
+    if path == '-':
+        return sys.stdin if 'r' in mode else sys.stdout
+    if 'r' in mode:
+        with open(path, 'rb') as f:
+            magic = f.read(2)
+        return gzip.open(path, mode) if magic == b'\x1f\x8b' else open(path, mode)
+    return gzip.open(path, mode, compresslevel=level) if str(path).endswith('.gz') else open(path, mode)
+
+
+def fastq_records(path):
+    """(name, sequence, quality) of each FASTQ record"""
+    with open_text(path) as f:
+        while True:
+            header = f.readline()
+            if not header:
+                return
+            sequence = f.readline().rstrip('\n')
+            f.readline()
+            quality = f.readline().rstrip('\n')
+            yield header[1:].split()[0], sequence, quality
+
+
+def fasta_records(path):
+    """(name, sequence) of each FASTA record"""
+    name, chunks = None, []
+    with open_text(path) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith('>'):
+                if name is not None:
+                    yield name, ''.join(chunks)
+                name, chunks = line[1:].split()[0], []
+            elif line:
+                chunks.append(line)
+    if name is not None:
+        yield name, ''.join(chunks)
+
+
+def origin(name):
+    """(genome, taxid, genus) of a synthetic read or contig name"""
+    fields = name.rsplit('_', 1)[-1].split('.') if name.startswith('NODE_') else name.split('.')
+    if len(fields) < 3:
+        return 'unknown', 0, 'Unknown'
+    return fields[0], int(fields[1]) if fields[1].isdigit() else 0, fields[2]
+
+
+def is_host(name):
+    """Whether a read comes from the host genome"""
+    return name.startswith('host.')
+
+
+def sam_records(path):
+    """Fields of each SAM record, skipping the header"""
+    with open_text(path) as f:
+        for line in f:
+            if not line.startswith('@'):
+                yield line.rstrip('\n').split('\t')
+
+
+def flag_filter(args):
+    """Predicate for samtools -f/-F/-G options"""
+    required = int(option(args, '-f', default=0))
+    excluded = int(option(args, '-F', default=0))
+    excluded_all = int(option(args, '-G', default=0))
+    return lambda flag: (flag & required == required and not flag & excluded
+                         and not (excluded_all and flag & excluded_all == excluded_all))
+
+
+def version(tool):
+    """What a tool prints for --version"""
+    return {'samtools': f"samtools 1.17 ({VERSION})", 'trimmomatic': "0.39",
+            'spades.py': f"SPAdes genome assembler v3.15.5 ({VERSION})",
+            'metaspades.py': f"SPAdes genome assembler v3.15.5 ({VERSION})"}.get(tool, f"{tool} version 1.0 ({VERSION})")
+
+
+def fastqc(args):
+    """FastQC: a report per input file"""
+    outdir = Path(option(args, '-o', '--outdir', default='.'))
+    inputs = [a for a in args if a.endswith(('.gz', '.fastq', '.fq'))]
+    simulate_load('fastqc', sizes(inputs), option(args, '-t', '--threads', default=1))
+    for path in inputs:
+        stem = Path(path).name.split('.')[0]
+        reads = sum(1 for _ in fastq_records(path))
+        (outdir / f"{stem}_fastqc.html").write_text(f"<html>{reads} sequences</html>\n")
+        (outdir / f"{stem}_fastqc.zip").write_bytes(b'')
+
+
+def trimmomatic(args):
+    """Trimmomatic PE: HEADCROP and MINLEN, pairs with both mates kept go to the paired outputs"""
+    files = [a for a in args[1:] if not a.startswith('-') and ':' not in a and not a.isdigit()]
+    in1, in2, out1p, out1u, out2p, out2u = files[:6]
+    steps = dict(a.split(':', 1) for a in args if ':' in a and a.split(':', 1)[0].isupper())
+    crop = int(steps.get('HEADCROP', 0))
+    min_length = int(steps.get('MINLEN', 1))
+    simulate_load('trimmomatic', sizes([in1, in2]), option(args, '-threads', default=1))
+    pairs = both = 0
+    with open_text(out1p, 'wt') as p1, open_text(out1u, 'wt') as u1, \
+            open_text(out2p, 'wt') as p2, open_text(out2u, 'wt') as u2:
+        for (n1, s1, q1), (n2, s2, q2) in zip(fastq_records(in1), fastq_records(in2)):
+            pairs += 1
+            s1, q1, s2, q2 = s1[crop:], q1[crop:], s2[crop:], q2[crop:]
+            keep1, keep2 = len(s1) >= min_length, len(s2) >= min_length
+            if keep1 and keep2:
+                both += 1
+                p1.write(f"@{n1}\n{s1}\n+\n{q1}\n")
+                p2.write(f"@{n2}\n{s2}\n+\n{q2}\n")
+            elif keep1:
+                u1.write(f"@{n1}\n{s1}\n+\n{q1}\n")
+            elif keep2:
+                u2.write(f"@{n2}\n{s2}\n+\n{q2}\n")
+    print(f"Input Read Pairs: {pairs} Both Surviving: {both} ({100.0 * both / max(pairs, 1):.2f}%)")
+    print("TrimmomaticPE: Completed successfully")
+
+
+def bowtie2_build(args):
+    """bowtie2-build: the 'index' lists the contigs of the reference"""
+    reference, prefix = [a for a in args if not a.startswith('-') and not a.isdigit()][-2:]
+    simulate_load('bowtie2-build', sizes([reference]), option(args, '--threads', default=1))
+    with open(f"{prefix}.stub.tsv", 'w') as f:
+        for name, sequence in fasta_records(reference):
+            f.write(f"{name}\t{len(sequence)}\t{origin(name)[0]}\n")
+    Path(f"{prefix}.1.bt2").write_bytes(b'')
+
+
+def bowtie2(args):
+    """Bowtie2 paired-end alignment
+
+    Against a host index, host reads align and the others do not; against
+    contigs indexed by bowtie2-build, reads align to a contig of the genome
+    they came from.
+    """
+    index = option(args, '-x')
+    reads1, reads2 = option(args, '-1'), option(args, '-2')
+    simulate_load('bowtie2', sizes([reads1, reads2]), option(args, '-p', '--threads', default=1))
+    contigs = {}
+    if index and os.path.exists(f"{index}.stub.tsv"):
+        with open(f"{index}.stub.tsv") as f:
+            for line in f:
+                name, length, genome = line.rstrip('\n').split('\t')
+                contigs.setdefault(genome, []).append((name, int(length)))
+    no_unaligned, no_header = '--no-unal' in args, '--no-hd' in args
+    output = option(args, '-S')
+    out = open(output, 'w') if output else sys.stdout
+    pairs = aligned = 0
+    try:
+        if not no_header:
+            references = [c for genome in contigs.values() for c in genome] or [('reference', 1000000)]
+            out.write("@HD\tVN:1.0\tSO:unsorted\n")
+            out.writelines(f"@SQ\tSN:{name}\tLN:{length}\n" for name, length in references)
+        for (n1, s1, q1), (n2, s2, q2) in zip(fastq_records(reads1), fastq_records(reads2)):
+            pairs += 1
+            if contigs:
+                targets = contigs.get(origin(n1)[0])
+                if targets:
+                    name, length = targets[zlib.crc32(n1.encode()) % len(targets)]
+                    position = 1 + zlib.crc32(n2.encode()) % max(1, length - len(s1))
+                    reference = (name, position)
+                else:
+                    reference = None
+            else:
+                reference = ('reference', 1 + zlib.crc32(n1.encode()) % 999000) if is_host(n1) else None
+            if reference:
+                aligned += 1
+                name, position = reference
+                out.write(f"{n1}\t99\t{name}\t{position}\t42\t{len(s1)}M\t=\t{position}\t0\t{s1}\t{q1}\n"
+                          f"{n2}\t147\t{name}\t{position}\t42\t{len(s2)}M\t=\t{position}\t0\t{s2}\t{q2}\n")
+            elif not no_unaligned:
+                out.write(f"{n1}\t77\t*\t0\t0\t*\t*\t0\t0\t{s1}\t{q1}\n{n2}\t141\t*\t0\t0\t*\t*\t0\t0\t{s2}\t{q2}\n")
+    finally:
+        if output:
+            out.close()
+        else:
+            out.flush()
+    unaligned = pairs - aligned
+
+    def percent(count, total):
+        return f"{100.0 * count / total:.2f}%" if total else "0.00%"
+
+    sys.stderr.write(
+        f"{pairs} reads; of these:\n"
+        f"  {pairs} ({percent(pairs, pairs)}) were paired; of these:\n"
+        f"    {unaligned} ({percent(unaligned, pairs)}) aligned concordantly 0 times\n"
+        f"    {aligned} ({percent(aligned, pairs)}) aligned concordantly exactly 1 time\n"
+        f"    0 ({percent(0, pairs)}) aligned concordantly >1 times\n"
+        f"    ----\n"
+        f"    {unaligned} pairs aligned concordantly 0 times; of these:\n"
+        f"      0 ({percent(0, unaligned)}) aligned discordantly 1 time\n"
+        f"    ----\n"
+        f"    {unaligned} pairs aligned 0 times concordantly or discordantly; of these:\n"
+        f"      {2 * unaligned} mates make up the pairs; of these:\n"
+        f"        {2 * unaligned} ({percent(2 * unaligned, 2 * unaligned)}) aligned 0 times\n"
+        f"        0 ({percent(0, 2 * unaligned)}) aligned exactly 1 time\n"
+        f"        0 ({percent(0, 2 * unaligned)}) aligned >1 times\n"
+        f"{100.0 * aligned / pairs if pairs else 0.0:.2f}% overall alignment rate\n")
+
+
+def samtools(args):
+    """samtools view, sort, cat, fastq and flagstat on SAM text (the stand-in 'BAM' is SAM too)"""
+    command, args = args[0], args[1:]
+    positional = [a for i, a in enumerate(args) if (a == '-' or not a.startswith('-'))
+                  and (i == 0 or args[i - 1] not in ('-f', '-F', '-G', '-@', '-o', '-T', '-1', '-2', '-0', '-s',
+                                                     '-c', '--threads', '--ff'))]
+    source = positional[-1] if positional else '-'
+    threads = option(args, '-@', '--threads', default=1)
+    if source != '-':
+        simulate_load('samtools', sizes([source]), threads)
+    if command == 'flagstat':
+        total = mapped = 0
+        for fields in sam_records(source):
+            total += 1
+            mapped += not int(fields[1]) & 4
+
+        def percent(count):
+            return f"{100.0 * count / total:.2f}%" if total else "N/A"
+
+        print(f"{total} + 0 in total (QC-passed reads + QC-failed reads)\n{total} + 0 primary\n0 + 0 secondary\n"
+              f"0 + 0 supplementary\n0 + 0 duplicates\n0 + 0 primary duplicates\n"
+              f"{mapped} + 0 mapped ({percent(mapped)} : N/A)\n{mapped} + 0 primary mapped ({percent(mapped)} : N/A)\n"
+              f"{total} + 0 paired in sequencing\n{total // 2} + 0 read1\n{total // 2} + 0 read2\n"
+              f"{mapped} + 0 properly paired ({percent(mapped)} : N/A)\n{mapped} + 0 with itself and mate mapped\n"
+              f"0 + 0 singletons ({percent(0)} : N/A)\n0 + 0 with mate mapped to a different chr\n"
+              f"0 + 0 with mate mapped to a different chr (mapQ>=5)")
+    elif command == 'fastq':
+        keep = flag_filter(args)
+        level = int(option(args, '-c', default=1))
+        # Like samtools, mates are named <read>/1 and <read>/2 unless -n
+        mate = (lambda flag: '') if '-n' in args else (lambda flag: '/1' if flag & 64 else '/2')
+        with open_text(option(args, '-1'), 'wt', level) as out1, open_text(option(args, '-2'), 'wt', level) as out2:
+            for fields in sam_records(source):
+                flag = int(fields[1])
+                if keep(flag):
+                    (out1 if flag & 64 else out2).write(f"@{fields[0]}{mate(flag)}\n{fields[9]}\n+\n{fields[10]}\n")
+    elif command == 'coverage':
+        # Reads and mean depth per @SQ contig, with full-length M alignments
+        excluded = int(option(args, '--ff', default=0x4 | 0x100 | 0x200 | 0x400))
+        lengths, reads, bases = {}, {}, {}
+        with open_text(source) as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if line.startswith('@SQ'):
+                    tags = dict(field.split(':', 1) for field in fields[1:])
+                    lengths[tags['SN']] = int(tags['LN'])
+                elif not line.startswith('@') and not int(fields[1]) & excluded and fields[2] in lengths:
+                    reads[fields[2]] = reads.get(fields[2], 0) + 1
+                    bases[fields[2]] = bases.get(fields[2], 0) + len(fields[9])
+        print("#rname\tstartpos\tendpos\tnumreads\tcovbases\tcoverage\tmeandepth\tmeanbaseq\tmeanmapq")
+        for name, length in lengths.items():
+            covered = min(length, bases.get(name, 0))
+            print(f"{name}\t1\t{length}\t{reads.get(name, 0)}\t{covered}\t{100.0 * covered / length:.4g}\t"
+                  f"{bases.get(name, 0) / length:.4g}\t30\t42")
+    elif command in ('view', 'sort'):
+        keep = flag_filter(args) if command == 'view' else (lambda flag: True)
+        header, records = [], []
+        with open_text(source) as f:
+            for line in f:
+                if line.startswith('@'):
+                    # sort and BAM output keep the header, SAM from view only with -h
+                    if command == 'sort' or '-h' in args or '-b' in args:
+                        header.append(line)
+                else:
+                    fields = line.rstrip('\n').split('\t')
+                    if keep(int(fields[1])):
+                        records.append(fields)
+        if command == 'sort':
+            records.sort(key=lambda fields: fields[0] if '-n' in args else (fields[2], int(fields[3])))
+        output = option(args, '-o')
+        with (open(output, 'w') if output else sys.stdout) as out:
+            out.writelines(header)
+            out.writelines('\t'.join(fields) + '\n' for fields in records)
+    elif command == 'cat':
+        # Records of every input in order, under the header of the first
+        output = option(args, '-o')
+        with (open(output, 'w') if output else sys.stdout) as out:
+            for i, path in enumerate(positional):
+                with open_text(path) as f:
+                    out.writelines(line for line in f if i == 0 or not line.startswith('@'))
+    else:
+        raise SystemExit(f"samtools {command}: not supported by the stand-in")
+
+
+def kraken_report(counts, path):
+    """Kraken report over root > domain > genus > species from {(taxid, genus): reads}"""
+    total = sum(counts.values())
+    genera = {}
+    for (taxid, genus), reads in counts.items():
+        if taxid:
+            genera.setdefault(genus, {})[taxid] = reads
+    lines = []
+    unclassified = counts.get((0, None), 0)
+    if unclassified:
+        lines.append(f"{100.0 * unclassified / total:6.2f}\t{unclassified}\t{unclassified}\tU\t0\tunclassified\n")
+    classified = total - unclassified
+    if classified:
+        lines.append(f"{100.0 * classified / total:6.2f}\t{classified}\t0\tR\t1\troot\n")
+        for domain, domain_id in (('Bacteria', 2), ('Eukaryota', 2759)):
+            members = {g: s for g, s in genera.items() if (g == 'Homo') == (domain == 'Eukaryota')}
+            reads = sum(sum(s.values()) for s in members.values())
+            if not reads:
+                continue
+            lines.append(f"{100.0 * reads / total:6.2f}\t{reads}\t0\tD\t{domain_id}\t  {domain}\n")
+            for genus, species in sorted(members.items(), key=lambda item: (-sum(item[1].values()), item[0])):
+                genus_reads = sum(species.values())
+                genus_id = 100000000 + zlib.crc32(genus.encode()) % 100000000
+                lines.append(f"{100.0 * genus_reads / total:6.2f}\t{genus_reads}\t0\tG\t{genus_id}\t    {genus}\n")
+                for taxid, reads in sorted(species.items(), key=lambda item: (-item[1], item[0])):
+                    lines.append(f"{100.0 * reads / total:6.2f}\t{reads}\t{reads}\tS\t{taxid}\t      {genus} sp. {taxid}\n")
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+
+def kraken2(args):
+    """Kraken2: reads and contigs are classified by the genome in their name, a few left unclassified"""
+    output, report = option(args, '--output'), option(args, '--report')
+    if '--paired' in args:
+        start = args.index('--paired') + 1
+        inputs = args[start:start + 2]
+        # Pairs are reported under the mate name without its /1 suffix
+        records = ((re.sub(r'/1$', '', r1[0]), f"{len(r1[1])}|{len(r2[1])}")
+                   for r1, r2 in zip(fastq_records(inputs[0]), fastq_records(inputs[1])))
+    else:
+        inputs = [args[-1]]
+        records = ((name, str(len(sequence))) for name, sequence in fasta_records(inputs[0]))
+    simulate_load('kraken2', sizes(inputs), option(args, '--threads', default=1))
+    counts = {}
+    with open(output, 'w') as out:
+        for name, length in records:
+            _, taxid, genus = origin(name)
+            if zlib.crc32(name.encode()) % 100 < UNCLASSIFIED_PERCENT:
+                taxid, genus = 0, None
+            counts[(taxid, genus)] = counts.get((taxid, genus), 0) + 1
+            out.write(f"{'C' if taxid else 'U'}\t{name}\t{taxid}\t{length}\t{taxid}:1\n")
+    kraken_report(counts, report)
+
+
+def kraken_biom(args):
+    """kraken-biom: a minimal BIOM (JSON) table of the species counts"""
+    reports = [a for a in args if a.endswith('.report')]
+    output = option(args, '-o', '--output_fp', default='table.biom')
+    rows, columns, data = {}, [], []
+    for j, report in enumerate(reports):
+        columns.append({'id': Path(report).name.split('.')[0], 'metadata': None})
+        with open(report) as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) >= 6 and fields[3] == 'S':
+                    i = rows.setdefault(fields[4], len(rows))
+                    data.append([i, j, int(fields[2])])
+    table = {'id': None, 'format': 'Biological Observation Matrix 1.0.0', 'type': 'OTU table',
+             'matrix_type': 'sparse', 'matrix_element_type': 'int', 'shape': [len(rows), len(columns)],
+             'rows': [{'id': taxid, 'metadata': None} for taxid in rows], 'columns': columns, 'data': data}
+    with open(output, 'w') as f:
+        json.dump(table, f)
+
+
+def metaspades(args):
+    """metaSPAdes: contigs are runs of reads of one genome, about CONTIG_LENGTH long"""
+    reads1, reads2 = option(args, '-1'), option(args, '-2')
+    outdir = Path(option(args, '-o'))
+    outdir.mkdir(parents=True, exist_ok=True)
+    simulate_load('metaspades.py', sizes([reads1, reads2]), option(args, '-t', '--threads', default=1))
+    pending, contigs = {}, []
+    for name, sequence, _ in fastq_records(reads1):
+        genome = '.'.join(str(field) for field in origin(name))
+        pending.setdefault(genome, []).append(sequence)
+        if sum(len(s) for s in pending[genome]) >= CONTIG_LENGTH:
+            contigs.append((genome, ''.join(pending.pop(genome))))
+    contigs += [(genome, ''.join(parts)) for genome, parts in pending.items()]
+    contigs.sort(key=lambda contig: -len(contig[1]))
+    with open(outdir / "scaffolds.fasta", 'w') as f:
+        for i, (genome, sequence) in enumerate(contigs, 1):
+            f.write(f">NODE_{i}_length_{len(sequence)}_cov_10.0_{genome}\n")
+            f.writelines(sequence[k:k + 60] + '\n' for k in range(0, len(sequence), 60))
+    print(f"{len(contigs)} scaffolds written to {outdir / 'scaffolds.fasta'}")
+
+
+def maxbin(args):
+    """MaxBin: one bin per genome with at least two contigs, the rest unclassified"""
+    contigs_path, prefix = option(args, '-contig'), option(args, '-out')
+    simulate_load('run_MaxBin.pl', sizes([contigs_path]), option(args, '-thread', default=1))
+    groups = {}
+    for name, sequence in fasta_records(contigs_path):
+        groups.setdefault(origin(name)[0], []).append((name, sequence))
+    bins = sorted((members for members in groups.values() if len(members) >= 2),
+                  key=lambda members: -sum(len(s) for _, s in members))
+    for i, members in enumerate(bins, 1):
+        with open(f"{prefix}.{i:03d}.fasta", 'w') as f:
+            f.writelines(f">{name}\n{sequence}\n" for name, sequence in members)
+    with open(f"{prefix}.noclass", 'w') as f:
+        for members in groups.values():
+            if len(members) < 2:
+                f.writelines(f">{name}\n{sequence}\n" for name, sequence in members)
+    with open(f"{prefix}.summary", 'w') as f:
+        f.write("Bin name\tAbundance\tCompleteness\tGenome size\tGC content\n")
+        f.writelines(f"{Path(prefix).name}.{i:03d}.fasta\t10.0\t90.0%\t{sum(len(s) for _, s in members)}\t50.0\n"
+                     for i, members in enumerate(bins, 1))
+    print(f"{len(bins)} bins written")
+
+
+def checkm(args):
+    """CheckM lineage_wf and profile"""
+    command = args[0]
+    if command == 'lineage_wf':
+        extension = option(args, '-x', default='fna')
+        bins_dir, outdir = [a for a in args[1:] if not a.startswith('-') and a != extension
+                            and not a.isdigit()][-2:]
+        bins = sorted(Path(bins_dir).glob(f"*.{extension}"))
+        simulate_load('checkm', sizes(bins), option(args, '-t', default=1))
+        storage = Path(outdir) / "storage"
+        storage.mkdir(parents=True, exist_ok=True)
+        with open(storage / "bin_stats_ext.tsv", 'w') as f:
+            f.writelines(f"{b.stem}\t{{'Completeness': 90.0, 'Contamination': 1.0}}\n" for b in bins)
+        print("Bin Id\tCompleteness\tContamination")
+        for b in bins:
+            print(f"{b.stem}\t90.00\t1.00")
+    elif command == 'profile':
+        output = option(args, '-f')
+        coverage = args[-1]
+        simulate_load('checkm', sizes([coverage]))
+        with open(output, 'w') as f:
+            f.write("Bin Id\tBin size (Mbp)\tmapped reads\n")
+    else:
+        raise SystemExit(f"checkm {command}: not supported by the stand-in")
+
+
+def seqkit(args):
+    """seqkit seq -m: sequences of at least the minimum length, to stdout"""
+    minimum = int(option(args, '-m', '--min-len', default=0))
+    source = args[-1]
+    simulate_load('seqkit', sizes([source]), option(args, '-j', '--threads', default=1))
+    for name, sequence in fasta_records(source):
+        if len(sequence) >= minimum:
+            sys.stdout.write(f">{name}\n{sequence}\n")
+
+
+def phylophlan(args):
+    """phylophlan_assign_sgbs: each bin is assigned the genus of most of its bases"""
+    bins_dir, prefix = option(args, '-i'), option(args, '-o')
+    extension = option(args, '-e', default='.fna')
+    bins = sorted(Path(bins_dir).glob(f"*{extension}"))
+    simulate_load('phylophlan_assign_sgbs', sizes(bins), option(args, '--nproc', default=1))
+    with open(f"{prefix}.tsv", 'w') as f:
+        f.write("#input_bin\t[u|k]_[S|G|F]GBid:taxa_level:taxonomy:avg_dist\n")
+        for path in bins:
+            bases = {}
+            for name, sequence in fasta_records(path):
+                _, taxid, genus = origin(name)
+                bases[(taxid, genus)] = bases.get((taxid, genus), 0) + len(sequence)
+            taxid, genus = max(bases, key=bases.get) if bases else (0, 'Unknown')
+            f.write(f"{path.name[:-len(extension)]}\tk_SGB{taxid}:Species:k__Bacteria|g__{genus}|"
+                    f"s__{genus}_sp_{taxid}|t__SGB{taxid}:0.05\n")
+
+
+def prokka(args):
+    """Prokka: one predicted gene per GENE_LENGTH bases of each contig"""
+    outdir = Path(option(args, '--outdir'))
+    fasta = args[-1]
+    simulate_load('prokka', sizes([fasta]), option(args, '--cpus', default=1))
+    outdir.mkdir(parents=True, exist_ok=True)
+    prefix = option(args, '--prefix', default='PROKKA')
+    genes = []
+    for name, sequence in fasta_records(fasta):
+        genes += [(name, start, min(start + GENE_LENGTH, len(sequence)), sequence[start:start + GENE_LENGTH])
+                  for start in range(0, len(sequence) - GENE_LENGTH // 2, GENE_LENGTH)]
+    with open(outdir / f"{prefix}.gff", 'w') as gff, open(outdir / f"{prefix}.ffn", 'w') as ffn:
+        gff.write("##gff-version 3\n")
+        for i, (contig, start, end, sequence) in enumerate(genes, 1):
+            gff.write(f"{contig}\tstub\tCDS\t{start + 1}\t{end}\t.\t+\t0\tID={prefix}_{i:05d}\n")
+            ffn.write(f">{prefix}_{i:05d}\n{sequence}\n")
+    (outdir / f"{prefix}.txt").write_text(f"contigs: {len(set(g[0] for g in genes))}\nCDS: {len(genes)}\n")
+
+
+def emapper(args):
+    """emapper.py: one seed ortholog per GENE_LENGTH bases of each query contig"""
+    query, prefix = option(args, '-i'), option(args, '-o')
+    outdir = Path(option(args, '--output_dir', default='.'))
+    simulate_load('emapper.py', sizes([query]), option(args, '--cpu', default=1))
+    outdir.mkdir(parents=True, exist_ok=True)
+    with open(outdir / f"{prefix}.emapper.seed_orthologs", 'w') as seeds, \
+            open(outdir / f"{prefix}.emapper.hits", 'w') as hits:
+        seeds.write("#qseqid\tsseqid\tevalue\tbitscore\n")
+        hits.write("#qseqid\tsseqid\tevalue\tbitscore\n")
+        for name, sequence in fasta_records(query):
+            for k in range(1, max(1, len(sequence) // GENE_LENGTH) + 1):
+                ortholog = f"COG{zlib.crc32(sequence[(k - 1) * GENE_LENGTH:k * GENE_LENGTH].encode()) % 5000:04d}"
+                seeds.write(f"{name}_{k}\t{ortholog}\t1e-30\t200.0\n")
+                hits.write(f"{name}_{k}\t{ortholog}\t1e-30\t200.0\n")
+
+
+COMMANDS = {
+    'fastqc': fastqc,
+    'trimmomatic': trimmomatic,
+    'bowtie2-build': bowtie2_build,
+    'bowtie2': bowtie2,
+    'samtools': samtools,
+    'kraken2': kraken2,
+    'kraken-biom': kraken_biom,
+    'metaspades.py': metaspades,
+    'spades.py': metaspades,
+    'run_MaxBin.pl': maxbin,
+    'checkm': checkm,
+    'seqkit': seqkit,
+    'phylophlan_assign_sgbs': phylophlan,
+    'prokka': prokka,
+    'emapper.py': emapper,
+}
+
+
+def install(bin_dir):
+    """Link every stand-in into bin_dir under the name of the tool it replaces"""
+    bin_dir = Path(bin_dir)
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    target = Path(__file__).resolve()
+    for tool in COMMANDS:
+        link = bin_dir / tool
+        if link.is_symlink() or link.exists():
+            link.unlink()
+        link.symlink_to(target)
+    return bin_dir
+
+
+def main():
+    """Run as the tool named by argv[0], or as 'stubtools.py install <bin_dir>' / 'stubtools.py <tool> ...'"""
+    tool, args = Path(sys.argv[0]).name, sys.argv[1:]
+    if tool not in COMMANDS:
+        if args[:1] == ['install'] and len(args) == 2:
+            print(f"Stand-in tools linked into {install(args[1])}")
+            return
+        if not args or args[0] not in COMMANDS:
+            raise SystemExit(f"usage: {Path(sys.argv[0]).name} install <bin_dir> | <tool> [args...]; "
+                             f"tools: {', '.join(sorted(COMMANDS))}")
+        tool, args = args[0], args[1:]
+    if any(a in ('--version', '-version', '-v') for a in args[:1]):
+        print(version(tool))
+        return
+    COMMANDS[tool](args)
+
+
+if __name__ == "__main__":
+    main()
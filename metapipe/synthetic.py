@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+#####################################################################
+#          SYNTHETIC PAIRED-END METAGENOMES FOR BENCHMARKS         #
+#####################################################################
+
+import argparse
+import gzip
+import json
+import math
+import os
+import random
+from pathlib import Path
+
+# Genera of the default mock community, with NCBI-like species taxids
+DEFAULT_GENERA = [
+    ('Bacteroides', 817), ('Escherichia', 562), ('Faecalibacterium', 853), ('Prevotella', 28131),
+    ('Bifidobacterium', 1680), ('Akkermansia', 239935), ('Roseburia', 166486), ('Lactobacillus', 1613),
+]
+HOST = ('Homo', 9606)
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+
+
+class Genome:
+    """A random reference sequence standing for one organism
+
+    Reads carry their origin in their name (<id>.<taxid>.<genus>.<n>), so
+    the stand-in tools can 'map' and 'classify' them deterministically.
+    """
+
+    def __init__(self, genome_id, taxid, genus, length, rng):
+        self.id = genome_id
+        self.taxid = taxid
+        self.genus = genus
+        self.sequence = ''.join(rng.choices('ACGT', k=length))
+
+    def describe(self):
+        """Metadata recorded in community.json"""
+        return {'id': self.id, 'taxid': self.taxid, 'genus': self.genus, 'length': len(self.sequence)}
+
+
+def mock_community(genomes=8, genome_length=200000, seed=1):
+    """Reference genomes of a mock community plus a host genome"""
+    rng = random.Random(seed)
+    members = []
+    for i in range(genomes):
+        genus, taxid = DEFAULT_GENERA[i % len(DEFAULT_GENERA)]
+        # Repeated genera get distinct (made up) strain taxids
+        taxid += 10000000 * (i // len(DEFAULT_GENERA))
+        members.append(Genome(f"g{i + 1:02d}", taxid, genus, genome_length, rng))
+    host = Genome('host', HOST[1], HOST[0], genome_length, rng)
+    return members, host
+
+
+def abundances(members, sigma=1.0, seed=1):
+    """Log-normal relative abundance of each community member"""
+    rng = random.Random(seed)
+    weights = [rng.lognormvariate(0.0, sigma) for _ in members]
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+def error_profile(read_length, start_rate=0.001, end_rate=0.01):
+    """Substitution probability per read position, rising linearly like Illumina"""
+    if read_length == 1:
+        return [start_rate]
+    step = (end_rate - start_rate) / (read_length - 1)
+    return [start_rate + i * step for i in range(read_length)]
+
+
+def quality_string(profile):
+    """Phred+33 qualities matching an error profile"""
+    return ''.join(chr(33 + max(2, min(41, int(round(-10 * math.log10(max(p, 1e-5))))))) for p in profile)
+
+
+def poisson(rng, mean):
+    """Poisson draw for the small means of per-read error counts"""
+    limit, k, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        k += 1
+        product *= rng.random()
+    return k
+
+
+class ReadSimulator:
+    """Paired reads from random fragments of the community genomes"""
+
+    def __init__(self, members, host, weights, host_fraction=0.1, read_length=150, insert_mean=350,
+                 insert_sd=50, error_start=0.001, error_end=0.01, seed=1):
+        self.rng = random.Random(seed)
+        self.genomes = [host] + list(members)
+        self.weights = [host_fraction] + [(1.0 - host_fraction) * w for w in weights]
+        self.read_length = read_length
+        self.insert_mean = insert_mean
+        self.insert_sd = insert_sd
+        self.profile = error_profile(read_length, error_start, error_end)
+        self.cumulative = []
+        total = 0.0
+        for p in self.profile:
+            total += p
+            self.cumulative.append(total)
+        self.errors_mean = total
+        self.quality = quality_string(self.profile)
+
+    def mutate(self, read):
+        """Apply substitutions drawn from the error profile"""
+        errors = poisson(self.rng, self.errors_mean)
+        if not errors:
+            return read
+        bases = list(read)
+        for position in self.rng.choices(range(len(bases)), cum_weights=self.cumulative, k=errors):
+            bases[position] = self.rng.choice([b for b in 'ACGT' if b != bases[position]])
+        return ''.join(bases)
+
+    def pair(self, n):
+        """Name and both mates of the n-th read pair"""
+        genome = self.rng.choices(self.genomes, weights=self.weights)[0]
+        length = len(genome.sequence)
+        insert = max(self.read_length, min(length, int(self.rng.gauss(self.insert_mean, self.insert_sd))))
+        start = self.rng.randrange(0, length - insert + 1)
+        fragment = genome.sequence[start:start + insert]
+        mate1 = fragment[:self.read_length]
+        mate2 = fragment[-self.read_length:].translate(COMPLEMENT)[::-1]
+        name = f"{genome.id}.{genome.taxid}.{genome.genus}.{n}"
+        return name, self.mutate(mate1), self.mutate(mate2)
+
+    def write(self, output1, output2, pairs, compress_level=1):
+        """Write pairs to two gzip FASTQ files atomically"""
+        tmp1, tmp2 = f"{output1}.{os.getpid()}.tmp", f"{output2}.{os.getpid()}.tmp"
+        with gzip.open(tmp1, 'wt', compresslevel=compress_level) as out1, \
+                gzip.open(tmp2, 'wt', compresslevel=compress_level) as out2:
+            for n in range(pairs):
+                name, mate1, mate2 = self.pair(n)
+                out1.write(f"@{name} 1:N:0:1\n{mate1}\n+\n{self.quality}\n")
+                out2.write(f"@{name} 2:N:0:1\n{mate2}\n+\n{self.quality}\n")
+        os.replace(tmp1, output1)
+        os.replace(tmp2, output2)
+
+
+def write_samples(output_dir, samples=1, pairs=100000, read_length=150, genomes=8, genome_length=200000,
+                  host_fraction=0.1, error_start=0.001, error_end=0.01, insert_mean=350, seed=1, prefix='S',
+                  pattern_f='_R1', pattern_r='_R2', extension='fastq.gz'):
+    """Write paired FASTQ files for several samples of one mock community
+
+    Every sample draws from the same genomes with its own log-normal
+    abundances; the same arguments always give the same files.
+    community.json describes the genomes and the abundances of each sample.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    members, host = mock_community(genomes, genome_length, seed)
+    manifest = {
+        'genomes': [genome.describe() for genome in members],
+        'host': host.describe(),
+        'host_fraction': host_fraction,
+        'pairs': pairs,
+        'read_length': read_length,
+        'error_profile': [error_start, error_end],
+        'seed': seed,
+        'samples': {},
+    }
+    for i in range(samples):
+        sample = f"{prefix}{i + 1}"
+        weights = abundances(members, seed=seed * 1000 + i)
+        simulator = ReadSimulator(members, host, weights, host_fraction, read_length, insert_mean,
+                                  insert_mean // 7, error_start, error_end, seed=seed * 1000 + i)
+        simulator.write(output_dir / f"{sample}{pattern_f}.{extension}",
+                        output_dir / f"{sample}{pattern_r}.{extension}", pairs)
+        manifest['samples'][sample] = {genome.id: round(w, 6) for genome, w in zip(members, weights)}
+    with open(output_dir / "community.json", 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Write synthetic paired-end metagenomes")
+    parser.add_argument("output_dir", help="Directory for <prefix><n>_R1/_R2 FASTQ files")
+    parser.add_argument("-s", "--samples", type=int, default=1, help="Number of samples")
+    parser.add_argument("-n", "--pairs", type=int, default=100000, help="Read pairs per sample")
+    parser.add_argument("-l", "--read-length", type=int, default=150, help="Read length")
+    parser.add_argument("-g", "--genomes", type=int, default=8, help="Genomes in the mock community")
+    parser.add_argument("--genome-length", type=int, default=200000, help="Length of each genome")
+    parser.add_argument("--host-fraction", type=float, default=0.1, help="Fraction of host read pairs")
+    parser.add_argument("--error-start", type=float, default=0.001, help="Substitution rate at the first base")
+    parser.add_argument("--error-end", type=float, default=0.01, help="Substitution rate at the last base")
+    parser.add_argument("--insert", type=int, default=350, help="Mean fragment length")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--prefix", default='S', help="Sample name prefix")
+    args = parser.parse_args()
+
+    write_samples(args.output_dir, args.samples, args.pairs, args.read_length, args.genomes, args.genome_length,
+                  args.host_fraction, args.error_start, args.error_end, args.insert, args.seed, args.prefix)
+    print(f"{args.samples} samples of {args.pairs} read pairs written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
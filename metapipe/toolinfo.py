@@ -0,0 +1,128 @@
+#####################################################################
+#             TOOL DISCOVERY AND CACHED VERSION PROBES             #
+#####################################################################
+
+import json
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+DEFAULT_CACHE = Path.home() / ".cache" / "metapipeline" / "tool_versions.json"
+REQUIRED_TOOLS = ['fastqc', 'trimmomatic', 'bowtie2', 'samtools', 'kraken2', 'spades.py', 'checkm']
+# Version command per tool name, as recorded in the environment manifest
+VERSION_COMMANDS = {
+    'fastqc': ['fastqc', '--version'],
+    'trimmomatic': ['trimmomatic', '-version'],
+    'bowtie2': ['bowtie2', '--version'],
+    'samtools': ['samtools', '--version'],
+    'kraken2': ['kraken2', '--version'],
+    'spades': ['spades.py', '--version'],
+}
+PROBE_TIMEOUT = 120
+UNAVAILABLE = "Version not available"
+
+
+def locate(executables):
+    """Absolute path of each executable on PATH, None when missing"""
+    return {name: shutil.which(name) for name in executables}
+
+
+class ToolVersionCache:
+    """Version strings remembered by (binary path, size, mtime) across runs
+
+    Entries are keyed by the path the tool was found at, not the file it
+    resolves to: a wrapper or launcher linked in under several tool names
+    answers differently to each name.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE):
+        self.path = Path(path).expanduser()
+        self._lock = threading.Lock()
+        self.entries = {}
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, binary, args):
+        """Stored output of a version command while the binary is unchanged, else None"""
+        st = os.stat(os.path.realpath(binary))
+        with self._lock:
+            entry = self.entries.get(os.path.abspath(binary))
+        if not entry or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+            return None
+        return entry['versions'].get(' '.join(args))
+
+    def put(self, binary, args, version, st=None):
+        """Remember the output of a version command for the current binary"""
+        key = os.path.abspath(binary)
+        st = st or os.stat(os.path.realpath(binary))
+        with self._lock:
+            entry = self.entries.get(key)
+            if not entry or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+                entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'versions': {}}
+                self.entries[key] = entry
+            entry['versions'][' '.join(args)] = version
+
+    def save(self):
+        """Write the cache atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = json.dumps(self.entries)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+def probe_version(binary, args, timeout=PROBE_TIMEOUT):
+    """(output of a version command or None, whether it exited cleanly)"""
+    try:
+        result = subprocess.run([binary] + list(args), capture_output=True, text=True,
+                                stdin=subprocess.DEVNULL, timeout=timeout)
+    except (OSError, subprocess.SubprocessError):
+        return None, False
+    return result.stdout.strip() or result.stderr.strip() or None, result.returncode == 0
+
+
+def tool_versions(commands=VERSION_COMMANDS, cache=None, timeout=PROBE_TIMEOUT):
+    """Version of each tool and the binary it was read from
+
+    Binaries are found in-process; only those new or changed since they
+    were cached are run, all at once (the JVM and Python tools each take
+    seconds to start). Returns ({tool: version}, {tool: path}).
+    """
+    cache = cache or ToolVersionCache()
+    paths = {tool: shutil.which(cmd[0]) for tool, cmd in commands.items()}
+    versions, stale = {}, []
+    for tool, cmd in commands.items():
+        binary = paths[tool]
+        if binary is None:
+            versions[tool] = UNAVAILABLE
+            continue
+        cached = cache.get(binary, cmd[1:])
+        if cached is None:
+            stale.append(tool)
+        else:
+            versions[tool] = cached
+
+    def probe(tool):
+        binary, args = paths[tool], commands[tool][1:]
+        st = os.stat(os.path.realpath(binary))
+        version, ok = probe_version(binary, args, timeout)
+        # A failing probe is retried on the next run rather than remembered
+        if version is not None and ok:
+            cache.put(binary, args, version, st)
+        return version
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=len(stale)) as pool:
+            for tool, version in zip(stale, pool.map(probe, stale)):
+                versions[tool] = version or UNAVAILABLE
+        cache.save()
+    return {tool: versions[tool] for tool in commands}, paths
@@ -10,18 +10,67 @@ import os
 import sys
 import logging
 import subprocess
+import shutil
 import time
 import json
 import configparser
 from pathlib import Path
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from metapipe.cache import StepCache, output_present
+from metapipe.autotune import (DEFAULT_PAIRS, ScalingProfiles, plan_allocation, projected_seconds, subsample_reads,
+                               thread_counts, uniform_allocation)
+from metapipe.catalog import Catalogue
+from metapipe.checksums import ALGORITHMS, ChecksumCache, DEFAULT_CACHE, verify_reads
+from metapipe.dbresidency import KrakenDBResidency
+from metapipe.engine import ProcessEngine
+from metapipe.executors import BACKENDS, FileQueueExecutor, LocalExecutor, SlurmExecutor
+from metapipe.fastq_stats import FastqStatsSidecar, retention_rate
+from metapipe.lifecycle import Artifact, CompressionPolicy, LifecycleManager, ScratchSpace
+from metapipe import coverage, eggnog_batch, kraken_out, kraken_table, prokka_queue, shards
+from metapipe.profiling import MetricsRecorder
+from metapipe.read_qc import qc_files
+from metapipe.resources import GB, MemoryModel, STAGE_MEMORY, available_memory, input_size
+from metapipe.scheduler import DAGScheduler, Task, current_task, run_in_task
+from metapipe.staging import STAGING_MODES, Stager, create_project_dirs, select_reads
+from metapipe.toolinfo import DEFAULT_CACHE as TOOL_CACHE, REQUIRED_TOOLS, ToolVersionCache, locate, tool_versions
+
+# Stage order and per-sample dependencies used by the DAG scheduler
+PIPELINE_STAGES = ['qc', 'rmHost', 'taxAssignment', 'normalize', 'assembly', 'binning', 'taxMags',
+                   'geneAnnotation', 'funcAnnotation']
+STAGE_DEPENDENCIES = {
+    'qc': [],
+    'rmHost': ['qc'],
+    'taxAssignment': ['rmHost'],
+    'normalize': ['rmHost'],
+    'assembly': ['normalize'],
+    'binning': ['assembly'],
+    'taxMags': ['binning'],
+    'geneAnnotation': ['taxMags'],
+    'funcAnnotation': ['binning'],
+}
+
+# Tools whose version is part of each stage's cache key
+STAGE_TOOLS = {
+    'qc': ['fastqc', 'trimmomatic'],
+    'rmHost': ['bowtie2', 'samtools'],
+    'taxAssignment': ['kraken2'],
+    'assembly': ['spades'],
+    'binning': ['bowtie2', 'checkm'],
+}
+
+# Stages that can run on shards of a sample's reads, merged afterwards
+SHARDED_STAGES = ['rmHost', 'taxAssignment']
 
 class MetaPipeline:
     def __init__(self):
         self.script_dir = Path(__file__).parent.absolute()
-        self.config_file = self.script_dir / "config" / "pipeline.conf"
+        # METAPIPELINE_CONFIG points a run (e.g. a benchmark) at another configuration
+        self.config_file = Path(os.environ.get('METAPIPELINE_CONFIG') or self.script_dir / "config" / "pipeline.conf")
         self.log_dir = self.script_dir / "logs"
         self.log_dir.mkdir(exist_ok=True)
+        self.run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
         
         # Setup logging
         self.setup_logging()
@@ -37,10 +86,45 @@ class MetaPipeline:
             'steps_failed': [],
             'current_step': None
         }
+        
+        # Samples, assemblies and MAGs of the project, opened by open_catalogue
+        self.catalogue = None
+        
+        # Step cache, opened by run_full_pipeline
+        self.cache = None
+        self.tool_versions = {}
+        
+        # Shared Kraken2 database, opened by open_kraken_db
+        self.kraken_db = None
+        
+        # Peak memory estimates, opened by run_full_pipeline
+        self.memory_model = None
+        
+        # Threads per task of each stage in mode 'all', set by allocate_threads
+        self.stage_threads = {}
+        
+        # Resource metrics of every command
+        self.metrics = self.setup_metrics()
+        
+        # Where commands run: DAG tasks use the configured backend, everything
+        # else (single-stage modes, environment creation) runs on this host,
+        # through the process engine unless local_engine = blocking
+        self.engine = self.setup_engine()
+        self.local_executor = self.setup_executor('local')
+        self.executor = self.setup_executor()
+        
+        # Intermediate files and scratch space, opened by run_full_pipeline
+        self.lifecycle = None
+        self.scratch = None
+        self.compression = CompressionPolicy(
+            self.config.getint('DEFAULT', 'transient_compression', fallback=1),
+            self.config.getint('DEFAULT', 'archive_compression', fallback=6),
+            self.config.getboolean('DEFAULT', 'parallel_compression', fallback=True),
+        )
     
     def setup_logging(self):
         """Setup logging configuration"""
-        log_file = self.log_dir / f"metapipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+        log_file = self.log_dir / f"metapipeline_{self.run_id}.log"
         
         logging.basicConfig(
             level=logging.INFO,
@@ -63,6 +147,70 @@ class MetaPipeline:
             self.logger.warning(f"Configuration file not found: {self.config_file}")
         return config
     
+    def setup_metrics(self):
+        """Resource metrics recorder from the [METRICS] settings, or None when disabled"""
+        if not self.config.getboolean('METRICS', 'enabled', fallback=True):
+            return None
+        events_log = self.config.get('METRICS', 'events_log', fallback='') or self.log_dir / "step_metrics.jsonl"
+        textfile = self.config.get('METRICS', 'prometheus_textfile', fallback='') or None
+        self.metrics_interval = self.config.getfloat('METRICS', 'sample_interval', fallback=1.0)
+        return MetricsRecorder(events_log, textfile, self.run_id)
+    
+    def setup_engine(self):
+        """Asyncio process engine for local commands, or None for blocking subprocess calls"""
+        mode = self.config.get('EXECUTOR', 'local_engine', fallback='async')
+        if mode == 'blocking':
+            return None
+        if mode != 'async':
+            raise ValueError(f"Unknown local_engine: {mode} (choose from async, blocking)")
+        log_dir = self.config.get('EXECUTOR', 'task_log_dir', fallback='') or self.log_dir / "tasks" / self.run_id
+        return ProcessEngine(
+            log_dir,
+            max_log_bytes=int(self.config.getfloat('EXECUTOR', 'task_log_mb', fallback=64) * 2 ** 20),
+            log_backups=self.config.getint('EXECUTOR', 'task_log_backups', fallback=3),
+            grace=self.config.getfloat('EXECUTOR', 'kill_grace_seconds', fallback=10),
+            interval=getattr(self, 'metrics_interval', 1.0),
+            logger=self.logger,
+        )
+    
+    def stage_timeout(self, stage):
+        """Time limit in seconds of one command of a stage ([EXECUTOR] <stage>_timeout_hours), or None"""
+        if stage is None:
+            return None
+        hours = self.config.getfloat('EXECUTOR', f'{stage}_timeout_hours', fallback=0)
+        return hours * 3600 if hours > 0 else None
+    
+    def setup_executor(self, backend=None):
+        """Command executor from the [EXECUTOR] settings"""
+        backend = backend or self.config.get('EXECUTOR', 'backend', fallback='local')
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown executor backend: {backend} (choose from {', '.join(BACKENDS)})")
+        timeout_hours = self.config.getfloat('EXECUTOR', 'timeout_hours', fallback=0)
+        options = {
+            'retries': self.config.getint('EXECUTOR', 'retries', fallback=0),
+            'retry_delay': self.config.getfloat('EXECUTOR', 'retry_delay', fallback=30),
+            'timeout': timeout_hours * 3600 if timeout_hours > 0 else None,
+            'logger': self.logger,
+            'on_metrics': self.record_metrics,
+        }
+        if backend == 'local':
+            idle_minutes = self.config.getfloat('EXECUTOR', 'idle_timeout_minutes', fallback=0)
+            return LocalExecutor(profile=self.metrics is not None, interval=getattr(self, 'metrics_interval', 1.0),
+                                 engine=self.engine, idle_timeout=idle_minutes * 60 if idle_minutes > 0 else None,
+                                 **options)
+        job_dir = self.config.get('EXECUTOR', 'job_dir', fallback='') or self.log_dir / "jobs" / self.run_id
+        options['poll_interval'] = self.config.getfloat('EXECUTOR', 'poll_interval', fallback=15)
+        if backend == 'slurm':
+            return SlurmExecutor(
+                job_dir,
+                partition=self.config.get('EXECUTOR', 'slurm_partition', fallback='') or None,
+                account=self.config.get('EXECUTOR', 'slurm_account', fallback='') or None,
+                extra=self.config.get('EXECUTOR', 'slurm_options', fallback=''),
+                **options,
+            )
+        return FileQueueExecutor(job_dir, workers=self.config.getint('EXECUTOR', 'filequeue_workers', fallback=2),
+                                 **options)
+    
     def get_threads(self, user_threads=None):
         """Get number of threads to use"""
         if user_threads:
@@ -75,31 +223,244 @@ class MetaPipeline:
             return str(multiprocessing.cpu_count())
         return config_threads
     
-    def run_command(self, cmd, step_name, check_output=False):
-        """Run a command with error handling and logging"""
+    def memory_budget(self):
+        """Memory the scheduler may hand out: [RESOURCES] memory_gb or 90% of available memory"""
+        if self.executor.remote:
+            # The batch scheduler places jobs by the memory they request
+            return None
+        memory_gb = self.config.getfloat('RESOURCES', 'memory_gb', fallback=0)
+        if memory_gb > 0:
+            return int(memory_gb * GB)
+        available = available_memory()
+        return int(available * 0.9) if available else None
+    
+    def open_memory_model(self):
+        """Peak memory model from the [RESOURCES] settings"""
+        overrides = {}
+        for stage in STAGE_MEMORY:
+            memory_gb = self.config.getfloat('RESOURCES', f'{stage}_memory_gb', fallback=0)
+            if memory_gb > 0:
+                overrides[stage] = int(memory_gb * GB)
+        history = self.config.get('RESOURCES', 'memory_history', fallback='~/.cache/metapipeline/memory_history.json')
+        self.memory_model = MemoryModel(history, overrides)
+        return self.memory_model
+    
+    def get_jobs(self, user_jobs, n_samples, threads):
+        """Get number of tasks the scheduler may run at the same time"""
+        if user_jobs:
+            return int(user_jobs)
+        
+        config_jobs = self.config.getint('SCHEDULER', 'jobs', fallback=0)
+        if config_jobs > 0:
+            return config_jobs
+        # Auto: one job per sample, but never fewer than 4 cores per job
+        return max(1, min(n_samples, int(threads) // 4))
+    
+    def open_thread_profiles(self):
+        """Per-stage thread scaling measured by mode 'autotune' ([AUTOTUNE] profiles)"""
+        return ScalingProfiles(self.config.get('AUTOTUNE', 'profiles', fallback='results/thread_profiles.json'))
+    
+    def raw_read_bytes(self, args, sample):
+        """Size of a sample's raw read pair"""
+        return input_size([Path("raw-reads") / f"{sample}{p}.{args.extension}" for p in (args.pForward, args.pReverse)])
+    
+    def allocate_threads(self, args, samples, threads, jobs):
+        """Threads per task of each stage and the concurrent tasks for a complete run
+        
+        Without autotune profiles every task gets threads / jobs cores. With
+        them, each profiled stage gets the split between threads per task and
+        concurrent tasks that finishes it soonest, unless the number of jobs
+        was set explicitly; the projected wall-clock is logged either way.
+        """
+        task_threads = max(1, threads // jobs)
+        self.stage_threads = dict.fromkeys(PIPELINE_STAGES + ['shard'], task_threads)
+        profiles = self.open_thread_profiles()
+        stages = [stage for stage in PIPELINE_STAGES if stage in profiles.stages()]
+        if not stages:
+            return jobs
+        sizes = [self.raw_read_bytes(args, sample) for sample in samples]
+        uniform = uniform_allocation(profiles, stages, sizes, threads, task_threads)
+        fixed_jobs = bool(args.jobs) or self.config.getint('SCHEDULER', 'jobs', fallback=0) > 0
+        if fixed_jobs or not self.config.getboolean('AUTOTUNE', 'use_profiles', fallback=True):
+            self.logger.info(f"Projected wall-clock with {task_threads} threads per task: "
+                             f"{timedelta(seconds=round(projected_seconds(uniform)))}")
+            return jobs
+        plan = plan_allocation(profiles, stages, sizes, threads)
+        for stage, (stage_threads, slots, seconds) in plan.items():
+            self.stage_threads[stage] = stage_threads
+            self.logger.info(f"Autotuned {stage}: {stage_threads} threads x {slots} concurrent tasks, "
+                             f"projected {timedelta(seconds=round(seconds))}")
+        self.logger.info(f"Projected wall-clock: {timedelta(seconds=round(projected_seconds(plan)))} "
+                         f"({timedelta(seconds=round(projected_seconds(uniform)))} with {task_threads} threads "
+                         f"per task; stages may overlap, so the run can finish sooner)")
+        return max([jobs] + [slots for _, slots, _ in plan.values()])
+    
+    def discover_samples(self, pattern_f, extension):
+        """List sample names the same way the stage scripts derive them"""
+        suffix = f"{pattern_f}.{extension}"
+        samples = []
+        for read in sorted(Path("raw-reads").glob(f"*{pattern_f}*.{extension}")):
+            name = read.name
+            samples.append(name[:-len(suffix)] if name.endswith(suffix) else name)
+        return samples
+    
+    def stage_env(self, sample, shard=None):
+        """Environment restricting a stage script to a single sample (or one shard of it)"""
+        if sample is None and self.catalogue is None:
+            return None
+        env = os.environ.copy()
+        if self.catalogue is not None:
+            # Absolute: the stage scripts run from results/
+            env['METAPIPELINE_CATALOGUE'] = str(self.catalogue.path.resolve())
+        if sample is None:
+            return env
+        env['METAPIPELINE_SAMPLE'] = sample
+        if shard is not None:
+            env['METAPIPELINE_SHARD'] = shard
+        task = current_task()
+        memory_cap = None
+        if task is not None:
+            # Memory limit for tools that accept one (metaSPAdes -m): the
+            # memory reserved for the task, which is also what a batch job requests
+            memory_cap = task.memory if self.executor.remote else task.memory_cap
+        if memory_cap:
+            env['METAPIPELINE_MEMORY_GB'] = str(max(1, memory_cap // GB))
+        if task is not None and self.scratch is not None:
+            # Scratch files of sort/assembly tools go to the configured temp dir
+            env['TMPDIR'] = str(self.scratch.path(task.name).resolve())
+        env.update(self.compression.env(task.cores if task is not None else 1))
+        return env
+    
+    def open_catalogue(self):
+        """Open the catalogue the stages query for their samples and MAGs"""
+        path = self.config.get('DEFAULT', 'catalogue', fallback='results/catalogue.sqlite')
+        self.catalogue = Catalogue(path)
+        return self.catalogue
+    
+    def update_catalogue(self, stage, sample=None):
+        """Record what a finished stage produced, for one sample or every assembled one"""
+        assemblies = Path("results") / "assemblies"
+        if sample is not None:
+            samples = [sample]
+        else:
+            samples = sorted(d.name for d in assemblies.iterdir() if d.is_dir()) if assemblies.is_dir() else []
+        for name in samples:
+            if stage == 'assembly':
+                self.catalogue.record_assembly(name, assemblies / name / f"{name}-scaffolds.fasta")
+            elif stage == 'binning':
+                self.catalogue_bins(name)
+            elif stage == 'taxMags':
+                table = prokka_queue.genus_table(Path("results"), name)
+                if table is not None:
+                    self.catalogue.record_taxonomy(name, prokka_queue.load_genus_map(table))
+    
+    def catalogue_bins(self, sample):
+        """List a sample's MaxBin directory once and catalogue its bins, with genera when known"""
+        results = Path("results")
+        genera = prokka_queue.load_genus_map(prokka_queue.genus_table(results, sample))
+        return self.catalogue.scan_bins(sample, results / "assemblies" / sample / "maxbin", genera)
+    
+    def mag_bins(self, sample):
+        """Catalogued bins of a sample, scanned the first time they are asked for"""
+        if not self.catalogue.has_bins(sample):
+            self.catalogue_bins(sample)
+        return self.catalogue.bins(sample)
+    
+    def catalogue_samples(self, sample=None):
+        """Make sure the bins a stage script lists are catalogued, for one sample or every assembled one"""
+        if self.catalogue is None:
+            return
+        assemblies = Path("results") / "assemblies"
+        if sample is not None:
+            samples = [sample]
+        else:
+            samples = sorted(d.name for d in assemblies.iterdir() if d.is_dir()) if assemblies.is_dir() else []
+        for name in samples:
+            self.mag_bins(name)
+    
+    def open_lifecycle(self, args, samples):
+        """Track the intermediates of every sample and set up the scratch space"""
+        keep = self.config.getboolean('DEFAULT', 'keep_intermediate', fallback=False)
+        on_release = self.cache.release if self.cache is not None else None
+        self.lifecycle = LifecycleManager(keep, self.logger, on_release)
+        self.scratch = ScratchSpace(self.config.get('DEFAULT', 'temp_dir', fallback='./tmp'), self.run_id)
+        
+        results = Path("results")
+        for sample in samples:
+            # Unpaired reads dropped by Trimmomatic: nothing reads them
+            self.lifecycle.register(Artifact(
+                f"unpaired:{sample}",
+                [results / "untrimmed-reads" / sample / f"{sample}_{i}.unpaired.fq.gz" for i in (1, 2)],
+                f"qc:{sample}", []))
+            self.lifecycle.register(Artifact(
+                f"trimmed:{sample}",
+                [results / "trimmed-reads" / sample / f"{sample}_{i}.trim.fq.gz" for i in (1, 2)],
+                f"qc:{sample}", [f"rmHost:{sample}"]))
+            # Name-sorted BAM of the host-free pairs (non-streaming host removal)
+            self.lifecycle.register(Artifact(
+                f"host-bam:{sample}",
+                [results / "host_removed" / sample / f"{sample}_sorted.bam.gz"],
+                f"rmHost:{sample}", []))
+            names = shards.shard_names(self.shard_count(args, sample))
+            if len(names) > 1:
+                # Shards of the trimmed reads, then each shard's host-free
+                # reads and Kraken output until the merges have run. A sample
+                # classified unsharded has no Kraken shards
+                classify_merged = self.classify_merged(args, sample)
+                self.lifecycle.register(Artifact(
+                    f"trimmed-shards:{sample}",
+                    [results / "trimmed-reads" / sample / "shards"],
+                    f"shard:{sample}", [f"rmHost:{sample}/{name}" for name in names]))
+                for name in names:
+                    self.lifecycle.register(Artifact(
+                        f"host-shard:{sample}/{name}",
+                        [results / "host_removed" / sample / "shards" / name],
+                        f"rmHost:{sample}/{name}",
+                        [f"rmHost:{sample}"] + ([] if classify_merged else [f"taxAssignment:{sample}/{name}"])))
+                    if classify_merged:
+                        continue
+                    self.lifecycle.register(Artifact(
+                        f"kraken-shard:{sample}/{name}",
+                        [results / "taxonomy" / "reads" / "kraken" / sample / "shards" / name],
+                        f"taxAssignment:{sample}/{name}", [f"taxAssignment:{sample}"]))
+            if self.normalization_enabled():
+                self.lifecycle.register(Artifact(
+                    f"normalized:{sample}",
+                    [results / "normalized" / sample / f"{sample}_normalized_R{i}.fastq.gz" for i in (1, 2)],
+                    f"normalize:{sample}", [f"assembly:{sample}"]))
+        if keep:
+            self.logger.info("keep_intermediate is set: intermediate files are kept")
+        return self.lifecycle
+    
+    def run_command(self, cmd, step_name, check_output=False, env=None, cwd=None, cores=None):
+        """Run a command with error handling and logging (cores: request less than the whole task)"""
         self.status['current_step'] = step_name
         self.logger.info(f"Starting step: {step_name}")
         self.logger.info(f"Command: {' '.join(cmd)}")
         
         start_time = time.time()
+        task = current_task()
+        executor = self.executor if task is not None else self.local_executor
         
         try:
-            if check_output:
-                result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-                self.logger.info(f"Step completed: {step_name}")
-                self.status['steps_completed'].append(step_name)
-                return result.stdout
-            else:
-                result = subprocess.run(cmd, check=True)
-                self.logger.info(f"Step completed: {step_name}")
-                self.status['steps_completed'].append(step_name)
-                return True
+            stdout = executor.run(cmd, step_name, env=env, cwd=cwd, capture_output=check_output,
+                                  cores=cores or (task.cores if task is not None else 1),
+                                  memory=task.memory if task is not None else 0,
+                                  timeout=self.stage_timeout(task.stage if task is not None else None))
+            self.logger.info(f"Step completed: {step_name}")
+            self.status['steps_completed'].append(step_name)
+            return stdout if check_output else True
                 
         except subprocess.CalledProcessError as e:
             error_msg = f"Step failed: {step_name} - Error: {e}"
             self.logger.error(error_msg)
             self.status['steps_failed'].append(step_name)
             raise RuntimeError(error_msg)
+        except subprocess.TimeoutExpired as e:
+            error_msg = f"Step timed out: {step_name} - {e}"
+            self.logger.error(error_msg)
+            self.status['steps_failed'].append(step_name)
+            raise RuntimeError(error_msg)
         except FileNotFoundError as e:
             error_msg = f"Command not found for step: {step_name} - {e}"
             self.logger.error(error_msg)
@@ -109,19 +470,27 @@ class MetaPipeline:
             elapsed = time.time() - start_time
             self.logger.info(f"Step {step_name} took {elapsed:.2f} seconds")
     
-    def check_dependencies(self):
+    def record_metrics(self, cmd, step_name, env, metrics):
+        """Record the resource metrics the executor measured for a command"""
+        sample = env.get('METAPIPELINE_SAMPLE') if env else None
+        step = step_name.removesuffix(f" [{sample}]") if sample else step_name
+        self.metrics.record(step, sample, ' '.join(cmd), metrics)
+        task = current_task()
+        if task is not None:
+            task.peak_memory = max(task.peak_memory, metrics['max_rss_bytes'], metrics['peak_tree_rss_bytes'])
+        self.logger.info(f"Resources for {step_name}: CPU {metrics['cpu_utilisation']:.2f} cores, "
+                         f"peak RSS {metrics['max_rss_bytes'] / 1e9:.2f} GB, "
+                         f"read {metrics['read_bytes'] / 1e9:.2f} GB, written {metrics['written_bytes'] / 1e9:.2f} GB")
+    
+    def check_dependencies(self, tools=None):
         """Check if required tools are available"""
-        required_tools = [
-            'fastqc', 'trimmomatic', 'bowtie2', 'samtools', 
-            'kraken2', 'spades.py', 'checkm'
-        ]
+        required_tools = tools or REQUIRED_TOOLS
         
         missing_tools = []
-        for tool in required_tools:
-            try:
-                subprocess.run(['which', tool], capture_output=True, check=True)
+        for tool, path in locate(required_tools).items():
+            if path:
                 self.logger.info(f"✓ {tool} is available")
-            except subprocess.CalledProcessError:
+            else:
                 missing_tools.append(tool)
                 self.logger.warning(f"✗ {tool} is not available")
         
@@ -139,25 +508,13 @@ class MetaPipeline:
             'python_version': sys.version,
             'working_directory': str(Path.cwd()),
             'script_directory': str(self.script_dir),
-            'tools': {}
+            'tools': {},
+            'tool_paths': {}
         }
         
-        # Get tool versions
-        tools_version_cmd = {
-            'fastqc': ['fastqc', '--version'],
-            'trimmomatic': ['trimmomatic', '-version'],
-            'bowtie2': ['bowtie2', '--version'],
-            'samtools': ['samtools', '--version'],
-            'kraken2': ['kraken2', '--version'],
-            'spades': ['spades.py', '--version']
-        }
-        
-        for tool, cmd in tools_version_cmd.items():
-            try:
-                result = subprocess.run(cmd, capture_output=True, text=True)
-                env_info['tools'][tool] = result.stdout.strip() or result.stderr.strip()
-            except:
-                env_info['tools'][tool] = "Version not available"
+        # Versions are probed concurrently and cached by binary path and mtime
+        cache = ToolVersionCache(self.config.get('DEFAULT', 'tool_cache', fallback=str(TOOL_CACHE)))
+        env_info['tools'], env_info['tool_paths'] = tool_versions(cache=cache)
         
         # Save environment info
         env_file = self.log_dir / f"environment_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
@@ -165,48 +522,836 @@ class MetaPipeline:
             json.dump(env_info, f, indent=2)
         
         self.logger.info(f"Environment information saved to {env_file}")
+        self.tool_versions = env_info['tools']
+        return env_info
     
-    def quality_check(self, threads, pattern_f, pattern_r, extension):
+    def quality_check(self, threads, pattern_f, pattern_r, extension, sample=None):
         """Quality control step"""
+        engine = self.config.get('QUALITY_CONTROL', 'qc_engine', fallback='fastqc')
+        if engine not in ('fastqc', 'numpy', 'both'):
+            raise ValueError(f"Unknown qc_engine: {engine}")
+        
         script_path = self.script_dir / "src" / "1_qualityCheck.sh"
-        cmd = [str(script_path), threads, pattern_f, pattern_r, extension]
-        return self.run_command(cmd, "Quality Check")
+        run_fastqc = 'true' if engine in ('fastqc', 'both') else 'false'
+        cmd = [str(script_path), threads, pattern_f, pattern_r, extension, run_fastqc]
+        if engine == 'fastqc':
+            return self.run_command(cmd, self.step_label("Quality Check", sample), env=self.stage_env(sample))
+        
+        # The numpy engine reads the raw files while Trimmomatic runs, then
+        # reports on the trimmed output. The task's cores are split between
+        # the two: QC gets 1-2 decompression threads, Trimmomatic the rest
+        samples = [sample] if sample else self.discover_samples(pattern_f, extension)
+        qc_threads = 1 if int(threads) <= 2 else 2
+        cmd[1] = str(max(1, int(threads) - qc_threads))
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            before = pool.submit(self.read_qc_reports, samples, 'before', qc_threads, pattern_f, pattern_r, extension)
+            result = self.run_command(cmd, self.step_label("Quality Check", sample), env=self.stage_env(sample))
+            before.result()
+        self.read_qc_reports(samples, 'after', threads)
+        return result
     
-    def host_removal(self, threads, pattern_f, extension, bowtie_db):
+    def read_qc_reports(self, samples, when, threads, pattern_f=None, pattern_r=None, extension=None):
+        """Vectorized QC reports of raw ('before') or trimmed ('after') reads"""
+        results = Path("results")
+        for name in samples:
+            if when == 'before':
+                reads = [Path("raw-reads") / f"{name}{p}.{extension}" for p in (pattern_f, pattern_r)]
+                output = results / "fastqc" / "beforeTrimQC" / name
+            else:
+                reads = [results / "trimmed-reads" / name / f"{name}_{i}.trim.fq.gz" for i in (1, 2)]
+                output = results / "fastqc" / "trimQC" / name
+            for report in qc_files(reads, output, int(threads)):
+                self.logger.info(f"QC report written: {report}")
+    
+    def host_removal(self, threads, pattern_f, extension, bowtie_db, sample=None, shard=None):
         """Host removal step"""
-        script_path = self.script_dir / "src" / "2_hostRemove.sh"
-        cmd = [str(script_path), threads, pattern_f, extension, bowtie_db]
-        return self.run_command(cmd, "Host Removal")
+        if self.config.getboolean('HOST_REMOVAL', 'streaming', fallback=False):
+            # Bowtie2 piped straight to paired FASTQ, no SAM/BAM intermediates
+            script_path = self.script_dir / "src" / "2_hostRemove_streaming.sh"
+            keep_bam = 'true' if self.config.getboolean('HOST_REMOVAL', 'keep_bam', fallback=False) else 'false'
+            bowtie2_params = self.config.get('HOST_REMOVAL', 'bowtie2_params', fallback='')
+            cmd = [str(script_path), threads, pattern_f, extension, bowtie_db, keep_bam, bowtie2_params]
+        else:
+            script_path = self.script_dir / "src" / "2_hostRemove.sh"
+            cmd = [str(script_path), threads, pattern_f, extension, bowtie_db]
+        return self.run_command(cmd, self.step_label("Host Removal", sample, shard), env=self.stage_env(sample, shard))
     
-    def taxonomic_assignment(self, threads, pattern_f, extension, kraken_db):
+    def taxonomic_assignment(self, threads, pattern_f, extension, kraken_db, sample=None, memory_mapping=False,
+                             shard=None):
         """Taxonomic assignment step"""
         script_path = self.script_dir / "src" / "3_taxonomicAssignmentHostRemoved.sh"
-        cmd = [str(script_path), threads, pattern_f, extension, kraken_db]
-        return self.run_command(cmd, "Taxonomic Assignment")
+        cmd = [str(script_path), threads, pattern_f, extension, kraken_db, str(memory_mapping).lower()]
+        return self.run_command(cmd, self.step_label("Taxonomic Assignment", sample, shard),
+                                env=self.biom_env(self.stage_env(sample, shard)))
+    
+    def shard_count(self, args, sample):
+        """Number of shards the reads of a sample are split into (1 = not sharded)"""
+        count = self.config.getint('SCHEDULER', 'shards', fallback=1)
+        # Only the streaming host removal reads and writes shard directories
+        if count <= 1 or not self.config.getboolean('HOST_REMOVAL', 'streaming', fallback=False):
+            return 1
+        min_gb = self.config.getfloat('SCHEDULER', 'shard_min_gb', fallback=2)
+        raw = Path("raw-reads") / f"{sample}{args.pForward}.{args.extension}"
+        if raw.exists() and raw.stat().st_size < min_gb * 1e9:
+            return 1
+        return count
+    
+    def step_stale(self, args, step):
+        """Whether a cached DAG step (stage:sample or stage:sample/shard) will run"""
+        stage, _, rest = step.partition(':')
+        sample, _, shard = rest.partition('/')
+        if shard or stage == 'shard':
+            # Shard tasks run when a merged result downstream is out of date
+            return self.shards_needed(stage, args, sample, shard or None)
+        inputs, _, params = self.stage_io(stage, args, sample)
+        return not self.cache.is_current(step, self.cache.step_key(inputs, params))
+    
+    def merge_stale(self, stage, args, sample):
+        """Whether the merged result of a sharded stage (cached as stage:sample) is out of date"""
+        inputs, _, params = self.stage_io(stage, args, sample)
+        return not self.cache.is_current(f"{stage}:{sample}", self.cache.step_key(inputs, params))
+    
+    def shards_needed(self, stage, args, sample, shard=None):
+        """Whether the shard tasks of a stage (or one shard) have work left: that stage's merged result is out of date
+        
+        The split and the host removal shards follow the rmHost merge. Kraken2
+        shards classify the host-free shards, so they only run while those are
+        rebuilt or still on disk (see classify_merged).
+        """
+        if self.cache is None:
+            return True
+        if stage != 'taxAssignment':
+            return self.merge_stale('rmHost', args, sample)
+        if not self.merge_stale('taxAssignment', args, sample):
+            return False
+        names = [shard] if shard is not None else shards.shard_names(self.shard_count(args, sample))
+        return self.merge_stale('rmHost', args, sample) or all(
+            path.exists() for name in names for path in self.stage_io('taxAssignment', args, sample, name)[0])
+    
+    def classify_merged(self, args, sample):
+        """Whether a sharded sample is classified in one run on its merged host-free reads
+        
+        Only the taxAssignment merge is out of date and the host-free shards
+        were released: an unsharded Kraken2 run gives the merged outputs
+        without redoing the split and host removal.
+        """
+        return self.cache is not None and self.merge_stale('taxAssignment', args, sample) and \
+            not self.shards_needed('taxAssignment', args, sample)
+    
+    def split_reads(self, threads, args, sample):
+        """Split the trimmed reads of a sample into record-aligned shards"""
+        inputs, outputs, _ = self.stage_io('shard', args, sample)
+        step_name = self.step_label("Shard Reads", sample)
+        self.logger.info(f"Starting step: {step_name}")
+        start_time = time.time()
+        
+        # The read count usually comes from the sidecar filled after trimming
+        first, second = self.read_stats(sample, inputs, int(threads))
+        if first['reads'] != second['reads']:
+            raise RuntimeError(f"{inputs[0]} and {inputs[1]} do not hold the same number of reads")
+        shutil.rmtree(Path("results") / "trimmed-reads" / sample / "shards", ignore_errors=True)
+        pairs = [outputs[i:i + 2] for i in range(0, len(outputs), 2)]
+        for out1, _ in pairs:
+            out1.parent.mkdir(parents=True, exist_ok=True)
+        shards.split_pairs(inputs[0], inputs[1], pairs, first['reads'],
+                           self.compression.transient(int(threads)), int(threads))
+        
+        self.logger.info(f"{sample}: {first['reads']} read pairs split into {len(pairs)} shards "
+                         f"in {time.time() - start_time:.1f} seconds")
+        self.status['steps_completed'].append(step_name)
+        return True
     
-    def metagenome_assembly(self, threads, pattern_f, extension):
+    def merge_shards(self, stage, args, sample):
+        """Merge the per-shard outputs of a stage into the outputs of an unsharded run"""
+        names = shards.shard_names(self.shard_count(args, sample))
+        _, outputs, _ = self.stage_io(stage, args, sample)
+        parts = [self.stage_io(stage, args, sample, name)[1] for name in names]
+        step_name = self.step_label(f"Merge {stage} Shards", sample)
+        self.logger.info(f"Starting step: {step_name}")
+        start_time = time.time()
+        
+        if stage == 'rmHost':
+            # Shards hold contiguous read ranges: concatenated gzip members
+            # are the host-free reads of the whole sample, in input order
+            for i, output in enumerate(outputs):
+                shards.concat_files([part[i] for part in parts], output)
+            out_dir = outputs[0].parent
+            shard_dirs = [part[0].parent for part in parts]
+            shards.merge_flagstat([d / f"{sample}_flagstat.txt" for d in shard_dirs],
+                                  out_dir / f"{sample}_flagstat.txt")
+            shards.merge_bowtie2_logs([d / f"{sample}_bowtie2.log" for d in shard_dirs],
+                                      out_dir / f"{sample}_bowtie2.log")
+            if self.config.getboolean('HOST_REMOVAL', 'keep_bam', fallback=False):
+                bams = [str(d / f"{sample}_host_aligned.bam") for d in shard_dirs]
+                self.run_command(['samtools', 'cat', '-o', str(out_dir / f"{sample}_host_aligned.bam")] + bams,
+                                 self.step_label("Merge Audit BAMs", sample))
+        elif stage == 'taxAssignment':
+            wdir = outputs[-1].parent
+            wdir.mkdir(parents=True, exist_ok=True)
+            shards.concat_files([part[0] for part in parts], wdir / f"{sample}.kraken.out")
+            shards.merge_kraken_reports([part[1] for part in parts], outputs[-1])
+            self.compact_kraken_outputs(sample)
+        else:
+            raise ValueError(f"Stage {stage} cannot be sharded")
+        
+        self.logger.info(f"Step {step_name} took {time.time() - start_time:.2f} seconds")
+        self.status['steps_completed'].append(step_name)
+        return True
+    
+    def metagenome_assembly(self, threads, pattern_f, extension, sample=None, phase='all'):
         """Metagenome assembly step"""
         script_path = self.script_dir / "src" / "4_metagenomeAssembly.sh"
-        cmd = [str(script_path), threads, pattern_f, extension]
-        return self.run_command(cmd, "Metagenome Assembly")
+        # metaSPAdes assembles the normalized reads when normalization is on
+        reads = 'normalized' if self.normalization_enabled() else 'host_removed'
+        cmd = [str(script_path), threads, pattern_f, extension, phase, '', reads]
+        return self.run_command(cmd, self.step_label("Metagenome Assembly", sample), env=self.stage_env(sample))
+    
+    def normalization_enabled(self):
+        """Whether reads are digitally normalized before assembly"""
+        method = self.config.get('ASSEMBLY', 'normalization', fallback='off')
+        if method not in ('off', 'diginorm'):
+            raise ValueError(f"Unknown normalization: {method}")
+        return method == 'diginorm'
+    
+    def normalize_reads(self, threads, sample=None):
+        """Digital normalization of host-removed reads ahead of assembly"""
+        results = Path("results")
+        host_removed = results / "host_removed"
+        samples = [sample] if sample else sorted(d.name for d in host_removed.iterdir() if d.is_dir())
+        for name in samples:
+            reads = [host_removed / name / f"{name}_host_removed_R{i}.fastq.gz" for i in (1, 2)]
+            output_dir = results / "normalized" / name
+            output_dir.mkdir(parents=True, exist_ok=True)
+            prefix = output_dir / f"{name}_normalized"
+            cmd = [sys.executable, '-m', 'metapipe.normalize', str(reads[0]), str(reads[1]), '-o', str(prefix),
+                   '-k', self.config.get('ASSEMBLY', 'normalization_kmer', fallback='20'),
+                   '-C', self.config.get('ASSEMBLY', 'normalization_coverage', fallback='20'),
+                   '-M', self.config.get('ASSEMBLY', 'normalization_memory_gb', fallback='4'),
+                   '-t', str(threads), '-z', str(self.compression.transient_level)]
+            env = self.stage_env(name)
+            env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(self.script_dir), env.get('PYTHONPATH')]))
+            self.run_command(cmd, self.step_label("Read Normalization", name), env=env)
+            
+            with open(f"{prefix}.normalization.json") as f:
+                stats = json.load(f)
+            self.logger.info(f"Read normalization [{name}]: kept {stats['pairs_kept']} of {stats['pairs_in']} pairs "
+                             f"({stats['kept_percent']}%), {stats['bases_kept'] / 1e9:.2f} of "
+                             f"{stats['bases_in'] / 1e9:.2f} Gbases; sketch {stats['sketch_bytes'] / GB:.1f} GB, "
+                             f"{100 * stats['sketch_occupancy']:.1f}% occupied")
+        return True
+    
+    def coverage_enabled(self):
+        """Whether binning uses the shared coverage table instead of MaxBin's own read mapping"""
+        return self.config.getboolean('ASSEMBLY', 'coverage_table', fallback=False)
+    
+    def coverage_read_sets(self, sample):
+        """{sample: (R1, R2)} of the reads mapped to one assembly, its own first"""
+        host_removed = Path("results") / "host_removed"
+        
+        def reads(name):
+            return tuple(host_removed / name / f"{name}_host_removed_R{i}.fastq.gz" for i in (1, 2))
+        
+        read_sets = {sample: reads(sample)}
+        if self.config.get('ASSEMBLY', 'coverage_samples', fallback='self') == 'all':
+            # Differential coverage across every sample whose host removal succeeded
+            for directory in sorted(host_removed.iterdir()) if host_removed.is_dir() else []:
+                if directory.name != sample and all(output_present(p) for p in reads(directory.name)):
+                    read_sets[directory.name] = reads(directory.name)
+        return read_sets
+    
+    def contig_coverage(self, threads, sample):
+        """Map reads to a sample's contigs once and save the per-contig depth table"""
+        assembly_dir = Path("results") / "assemblies" / sample
+        scaffolds = assembly_dir / f"{sample}-scaffolds.fasta"
+        coverage_dir = assembly_dir / "coverage"
+        index_dir = coverage_dir / "index"
+        index_dir.mkdir(parents=True, exist_ok=True)
+        
+        lengths = coverage.contig_lengths(scaffolds)
+        self.run_command(coverage.index_command(scaffolds, index_dir / sample, threads),
+                         self.step_label("Contig Index", sample))
+        table = coverage.CoverageTable(lengths)
+        for read_sample, (reads1, reads2) in self.coverage_read_sets(sample).items():
+            step_name = f"Contig Coverage [{sample} <- {read_sample}]"
+            self.logger.info(f"Starting step: {step_name}")
+            start_time = time.time()
+            try:
+                depth, reads = coverage.map_depth(index_dir / sample, reads1, reads2, lengths, threads,
+                                                  coverage_dir / f"{read_sample}_bowtie2.log",
+                                                  index_dir / f"{read_sample}.sort")
+            except (OSError, subprocess.CalledProcessError) as e:
+                self.status['steps_failed'].append(step_name)
+                raise RuntimeError(f"Step failed: {step_name} - Error: {e}")
+            table.add(read_sample, depth, reads)
+            self.logger.info(f"{step_name}: {sum(reads.values())} alignments on {len(lengths)} contigs "
+                             f"in {time.time() - start_time:.2f} seconds")
+        shutil.rmtree(index_dir)
+        table.save(coverage_dir / f"{sample}_coverage.tsv")
+        return table
+    
+    def binning(self, threads, pattern_f, extension, sample=None):
+        """Binning step: MaxBin, CheckM and the MAG length filter on assembled samples"""
+        if not self.coverage_enabled():
+            return self.metagenome_assembly(threads, pattern_f, extension, sample, phase='bin')
+        
+        assemblies = Path("results") / "assemblies"
+        samples = [sample] if sample else sorted(eggnog_batch.batch_inputs(assemblies))
+        script_path = self.script_dir / "src" / "4_metagenomeAssembly.sh"
+        for name in samples:
+            table = self.contig_coverage(threads, name)
+            coverage_dir = assemblies / name / "coverage"
+            abund_list = table.write_maxbin_abundance(coverage_dir)
+            # The script runs from results/
+            cmd = [str(script_path), threads, pattern_f, extension, 'bin', str(abund_list.relative_to("results"))]
+            self.run_command(cmd, self.step_label("Binning", name), env=self.stage_env(name))
+            
+            maxbin = assemblies / name / "maxbin"
+            self.update_catalogue('binning', name)
+            fastas = [Path(row['fasta']) for row in self.catalogue.bins(name)]
+            checkm_coverage = coverage_dir / "checkm_coverage.tsv"
+            table.write_checkm_coverage(checkm_coverage, eggnog_batch.bin_membership(maxbin, fastas))
+            self.run_command(['checkm', 'profile', '--tab_table', '-f', str(coverage_dir / f"{name}_checkm_profile.tsv"),
+                              str(checkm_coverage)], self.step_label("CheckM Profile", name))
+            report = table.write_mag_abundance(assemblies / name / f"{name}_mag_abundance.tsv", maxbin, fastas)
+            self.logger.info(f"MAG abundance [{name}]: {len(report)} MAGs over {len(table.samples)} read sets")
+        return True
     
-    def taxonomic_assignment_mags(self, threads, phylophlan_db, prefix, option):
+    
+    def taxonomic_assignment_mags(self, threads, phylophlan_db, prefix, option, sample=None, kraken_db=None):
         """Taxonomic assignment of MAGs step"""
         script_path = self.script_dir / "src" / "5_taxonomicAssignmentMAGs_Update.sh"
         cmd = [str(script_path), threads, phylophlan_db, prefix, option]
-        return self.run_command(cmd, "Taxonomic Assignment MAGs")
+        if kraken_db:
+            # Option 2 classifies contigs with Kraken2
+            cmd.append(kraken_db)
+        return self.run_command(cmd, self.step_label("Taxonomic Assignment MAGs", sample),
+                                env=self.biom_env(self.stage_env(sample)))
     
-    def gene_annotation(self, threads):
+    def gene_annotation(self, threads, sample=None):
         """Gene annotation step"""
+        if self.config.get('ANNOTATION', 'gene_annotation_engine', fallback='script') == 'queue':
+            return self.gene_annotation_queue(threads, sample)
+        # Projects binned by a single-stage run or before the catalogue existed
+        self.catalogue_samples(sample)
         script_path = self.script_dir / "src" / "6_geneAnnotation.sh"
         cmd = [str(script_path), threads]
-        return self.run_command(cmd, "Gene Annotation")
+        return self.run_command(cmd, self.step_label("Gene Annotation", sample), env=self.stage_env(sample))
     
-    def functional_annotation(self, threads, prefix, eggnog_db, profile, ko_list):
+    def gene_annotation_queue(self, threads, sample=None):
+        """Gene annotation of every MAG as a packed queue of small Prokka runs"""
+        results = Path("results")
+        samples = [sample] if sample else sorted(d.name for d in (results / "assemblies").iterdir() if d.is_dir())
+        jobs = [job for s in samples for job in prokka_queue.mag_jobs(results, s, self.mag_bins(s))]
+        step_name = self.step_label("Gene Annotation", sample)
+        if not jobs:
+            self.logger.warning(f"{step_name}: no filtered MAGs to annotate")
+            return True
+        
+        # The Prokka runs are commands of this task: same backend, stage
+        # timeout and scratch space, each requesting only its own cores
+        task = current_task()
+        
+        def run(cmd, job, cores):
+            run_in_task(task, lambda: self.run_command(cmd, f"Gene Annotation [{job['sample']}/{job['mag']}]",
+                                                       env=self.stage_env(job['sample']), cores=cores))
+        
+        cores_per_job = self.config.getint('ANNOTATION', 'prokka_cpus', fallback=4)
+        annotated, skipped, failed = prokka_queue.annotate_mags(jobs, int(threads), cores_per_job, run, self.logger)
+        self.logger.info(f"{step_name}: {len(annotated)} MAGs annotated, {len(skipped)} up to date, "
+                         f"{len(failed)} failed")
+        if failed:
+            raise RuntimeError(f"Step failed: {step_name} - Prokka failed for {', '.join(sorted(failed))}")
+        self.status['steps_completed'].append(step_name)
+        return True
+    
+    def functional_annotation(self, threads, prefix, eggnog_db, profile, ko_list, sample=None):
         """Functional annotation step"""
+        self.catalogue_samples(sample)
         script_path = self.script_dir / "src" / "7_functionalAnnotation.sh"
         cmd = [str(script_path), threads, prefix, eggnog_db, profile, ko_list]
-        return self.run_command(cmd, "Functional Annotation")
+        return self.run_command(cmd, self.step_label("Functional Annotation", sample), env=self.stage_env(sample))
+    
+    def functional_annotation_batch(self, threads, eggnog_db, samples=None):
+        """Functional annotation of all assembled samples in one deduplicated emapper run"""
+        results = Path("results")
+        eggnog_dir = results / "functionalAnnotation" / "eggNOG"
+        assemblies = eggnog_batch.batch_inputs(results / "assemblies", samples)
+        if not assemblies:
+            raise RuntimeError("No assembled samples to annotate")
+        
+        batch_dir = eggnog_dir / "batch"
+        batch_dir.mkdir(parents=True, exist_ok=True)
+        query = batch_dir / "query.fasta"
+        provenance = eggnog_batch.build_query(assemblies, query, batch_dir / "query_provenance.tsv")
+        contigs = sum(len(origins) for origins in provenance)
+        self.logger.info(f"eggNOG batch: {len(provenance)} distinct sequences from {contigs} contigs "
+                         f"of {len(assemblies)} samples")
+        
+        cmd = eggnog_batch.emapper_command(
+            query, batch_dir, "batch", eggnog_db, threads,
+            block_size=self.config.get('ANNOTATION', 'eggnog_block_size', fallback=''),
+            index_chunks=self.config.get('ANNOTATION', 'eggnog_index_chunks', fallback=''),
+        )
+        self.run_command(cmd, "Functional Annotation (batch)")
+        
+        memberships = {sample: eggnog_batch.bin_membership(results / "assemblies" / sample / "maxbin",
+                                                           [Path(row['fasta']) for row in self.mag_bins(sample)])
+                       for sample in assemblies}
+        written = eggnog_batch.split_results(batch_dir, "batch", provenance, memberships, eggnog_dir)
+        self.logger.info(f"eggNOG batch hits split into {len(written)} per-sample and per-MAG files")
+        return True
+    
+    def batch_annotation_task(self, args, samples, threads):
+        """Cached task annotating every assembled sample in one batch"""
+        def run():
+            assemblies = eggnog_batch.batch_inputs(Path("results") / "assemblies", samples)
+            output = Path("results") / "functionalAnnotation" / "eggNOG" / "batch" / "batch.emapper.seed_orthologs"
+            params = {
+                'stage': 'funcAnnotation:batch',
+                'eggNOGDB': args.eggNOGDB,
+                'block_size': self.config.get('ANNOTATION', 'eggnog_block_size', fallback=''),
+            }
+            inputs = list(assemblies.values())
+            result = self.run_cached("funcAnnotation:batch",
+                                     lambda: self.functional_annotation_batch(threads, args.eggNOGDB, samples),
+                                     inputs, [output], params)
+            task = current_task()
+            if self.memory_model is not None and task is not None:
+                self.memory_model.observe('funcAnnotation', input_size(inputs), task.peak_memory)
+            return result
+        return run
+    
+    def biom_engine(self):
+        """Configured BIOM table builder: kraken-biom or native"""
+        return self.config.get('TAXONOMY', 'biom_engine', fallback='kraken-biom')
+    
+    def biom_env(self, env):
+        """Stage environment telling the taxonomy scripts which BIOM builder to use"""
+        env = dict(env if env is not None else os.environ)
+        env['METAPIPELINE_BIOM_ENGINE'] = self.biom_engine()
+        return env
+    
+    def kraken_biom(self, reports, output, step_name):
+        """Merge Kraken reports into a single BIOM table"""
+        reports = sorted(str(r) for r in reports)
+        if not reports:
+            raise RuntimeError(f"No Kraken reports found for {output}")
+        engine = self.biom_engine()
+        if engine == 'native' and kraken_table.np is None:
+            self.logger.warning("numpy is not installed, falling back to kraken-biom")
+            engine = 'kraken-biom'
+        if engine == 'native':
+            return self.kraken_matrix(reports, output, step_name)
+        cmd = ['kraken-biom'] + reports + ['-o', str(output), '--fmt', 'json']
+        return self.run_command(cmd, step_name)
+    
+    def kraken_matrix(self, reports, output, step_name):
+        """Update the sample x taxon matrix next to output and export it as BIOM JSON"""
+        matrix_path = Path(output).with_suffix('.npz')
+        self.logger.info(f"Starting step: {step_name}")
+        start_time = time.time()
+        matrix, added, removed = kraken_table.build_table(reports, str(matrix_path), str(output), prune=True)
+        self.logger.info(f"{matrix_path}: {len(matrix.samples)} samples, {len(matrix.taxids)} taxa "
+                         f"({len(added)} reports parsed, {len(removed)} samples dropped)")
+        self.logger.info(f"Step {step_name} took {time.time() - start_time:.2f} seconds")
+        self.status['steps_completed'].append(step_name)
+        return True
+    
+    def classify_reads(self, threads, args, sample=None, shard=None):
+        """Kraken2 read classification against the shared database"""
+        self.with_kraken_db(args.krakenDB, lambda db, mmap: self.taxonomic_assignment(
+            threads, args.pForward, args.extension, db, sample, mmap, shard))
+        if shard is not None:
+            # Shard outputs stay plain text until they are merged
+            return True
+        return self.compact_kraken_outputs(sample)
+    
+    def compact_kraken_outputs(self, sample=None):
+        """Replace per-read .kraken.out files with the compact format when configured"""
+        if not self.config.getboolean('TAXONOMY', 'compact_kraken_out', fallback=False):
+            return True
+        keep_lca = self.config.getboolean('TAXONOMY', 'compact_kraken_lca', fallback=False)
+        pattern = f"taxonomy/reads/kraken/{sample or '*'}/hostRemoved/*.kraken.out"
+        for path in sorted(Path("results").glob(pattern)):
+            output = path.with_suffix('.npz')
+            start_time = time.time()
+            reads = kraken_out.compact_kraken_output(path, output, keep_lca)
+            saved = path.stat().st_size - output.stat().st_size
+            path.unlink()
+            self.logger.info(f"Compacted {path} ({reads} reads, {saved / 1e9:.2f} GB saved) "
+                             f"in {time.time() - start_time:.1f} seconds")
+        return True
+    
+    def open_kraken_db(self, kraken_db):
+        """Set up the shared Kraken2 database from the [TAXONOMY] settings"""
+        if not kraken_db:
+            return None
+        memory_gb = self.config.getfloat('TAXONOMY', 'kraken2_db_memory_gb', fallback=0)
+        self.kraken_db = KrakenDBResidency(
+            kraken_db,
+            mode=self.config.get('TAXONOMY', 'kraken2_db_residency', fallback='off'),
+            stage_dir=self.config.get('TAXONOMY', 'kraken2_db_stage_dir', fallback='/dev/shm/metapipeline-kraken2'),
+            memory_budget=int(memory_gb * 1e9) if memory_gb > 0 else None,
+            logger=self.logger,
+        )
+        return self.kraken_db
+    
+    def with_kraken_db(self, kraken_db, func):
+        """Call func(db_path, memory_mapping) while holding the shared Kraken2 database"""
+        if self.kraken_db is None:
+            return func(kraken_db, False)
+        db_path = self.kraken_db.acquire()
+        try:
+            return func(db_path, self.kraken_db.memory_mapping)
+        finally:
+            self.kraken_db.release()
+    
+    def release_kraken_db(self, force=False):
+        """Drop the shared Kraken2 database once its last consumer finished"""
+        if self.kraken_db is not None:
+            self.kraken_db.close(force)
+        return True
+    
+    def step_label(self, step_name, sample, shard=None):
+        """Step name, qualified by sample (and shard) when running per sample"""
+        if shard is not None:
+            return f"{step_name} [{sample}/{shard}]"
+        return f"{step_name} [{sample}]" if sample else step_name
+    
+    def stage_task(self, stage, args, threads, sample, shard=None):
+        """Callable running one stage of the pipeline for one sample (or one shard of it)"""
+        # taxMags option 2 classifies contigs against the Kraken2 database
+        kraken_mags = str(args.option) != '1'
+        calls = {
+            'qc': lambda: self.quality_check(threads, args.pForward, args.pReverse, args.extension, sample),
+            'shard': lambda: self.split_reads(threads, args, sample),
+            'rmHost': lambda: self.host_removal(threads, args.pForward, args.extension, args.bowtieDB, sample, shard),
+            'taxAssignment': lambda: self.classify_reads(threads, args, sample, shard),
+            'normalize': lambda: self.normalize_reads(threads, sample),
+            'assembly': lambda: self.metagenome_assembly(threads, args.pForward, args.extension, sample, 'assemble'),
+            'binning': lambda: self.binning(threads, args.pForward, args.extension, sample),
+            'taxMags': lambda: self.taxonomic_assignment_mags(threads, args.phylophlanDB, args.prefix, args.option, sample)
+                if not kraken_mags else self.with_kraken_db(args.krakenDB, lambda db, mmap: self.taxonomic_assignment_mags(
+                    threads, args.phylophlanDB, args.prefix, args.option, sample, db)),
+            'geneAnnotation': lambda: self.gene_annotation(threads, sample),
+            'funcAnnotation': lambda: self.functional_annotation(threads, args.prefix, args.eggNOGDB, args.koProfiles, args.koList, sample),
+        }
+        return calls[stage]
+    
+    def stage_io(self, stage, args, sample, shard=None):
+        """Inputs, outputs and cache parameters of one stage for one sample (or one shard of it)"""
+        results = Path("results")
+        # The reads and outputs of a shard live in shards/<shard>/ below the sample's directories
+        part = Path("shards", shard) if shard is not None else Path()
+        trimmed = [results / "trimmed-reads" / sample / part / f"{sample}_{i}.trim.fq.gz" for i in (1, 2)]
+        host_removed = [results / "host_removed" / sample / part / f"{sample}_host_removed_R{i}.fastq.gz"
+                        for i in (1, 2)]
+        normalized = [results / "normalized" / sample / f"{sample}_normalized_R{i}.fastq.gz" for i in (1, 2)]
+        scaffolds = results / "assemblies" / sample / f"{sample}-scaffolds.fasta"
+        maxbin = results / "assemblies" / sample / "maxbin"
+        
+        if stage == 'qc':
+            inputs = [Path("raw-reads") / f"{sample}{p}.{args.extension}" for p in (args.pForward, args.pReverse)]
+            outputs = trimmed
+            params = {
+                'trimmomatic': self.config.get('QUALITY_CONTROL', 'trimmomatic_params', fallback=''),
+                'qc_engine': self.config.get('QUALITY_CONTROL', 'qc_engine', fallback='fastqc'),
+            }
+        elif stage == 'shard':
+            inputs = trimmed
+            outputs = [results / "trimmed-reads" / sample / "shards" / name / f"{sample}_{i}.trim.fq.gz"
+                       for name in shards.shard_names(self.shard_count(args, sample)) for i in (1, 2)]
+            params = {'shards': self.shard_count(args, sample), 'compression': self.compression.transient_level}
+        elif stage == 'rmHost':
+            inputs = trimmed
+            outputs = host_removed
+            params = {
+                'bowtieDB': args.bowtieDB,
+                'streaming': self.config.getboolean('HOST_REMOVAL', 'streaming', fallback=False),
+                'bowtie2': self.config.get('HOST_REMOVAL', 'bowtie2_params', fallback=''),
+            }
+        elif stage == 'taxAssignment':
+            inputs = host_removed
+            wdir = results / "taxonomy" / "reads" / "kraken" / sample / part / "hostRemoved"
+            per_read = ".kraken.npz" if shard is None and \
+                self.config.getboolean('TAXONOMY', 'compact_kraken_out', fallback=False) else ".kraken.out"
+            outputs = [wdir / f"{sample}{per_read}", wdir / f"{sample}.kraken.report"]
+            params = {'krakenDB': args.krakenDB, 'per_read': per_read}
+        elif stage == 'normalize':
+            inputs = host_removed
+            outputs = normalized
+            params = {option: self.config.get('ASSEMBLY', option, fallback='')
+                      for option in ('normalization_kmer', 'normalization_coverage', 'normalization_memory_gb')}
+        elif stage == 'assembly':
+            inputs = normalized if self.normalization_enabled() else host_removed
+            outputs = [scaffolds]
+            params = {'spades': self.config.get('ASSEMBLY', 'spades_params', fallback='')}
+        elif stage == 'binning':
+            inputs = [scaffolds]
+            outputs = [maxbin, results / "assemblies" / sample / "checkm"]
+            params = {'coverage_table': self.coverage_enabled()}
+            if self.coverage_enabled():
+                read_sets = self.coverage_read_sets(sample)
+                inputs += [reads for pair in read_sets.values() for reads in pair]
+                outputs += [results / "assemblies" / sample / "coverage" / f"{sample}_coverage.tsv",
+                            results / "assemblies" / sample / f"{sample}_mag_abundance.tsv"]
+                params['coverage_samples'] = sorted(read_sets)
+            else:
+                inputs += host_removed
+        elif stage == 'taxMags':
+            inputs = [Path(row['fasta']) for row in self.mag_bins(sample)]
+            if str(args.option) == '1':
+                outputs = [results / "taxonomy" / "MAGS" / "phylophlan" / sample / f"{sample}_metagenomic.tsv"]
+            else:
+                inputs = [scaffolds]
+                outputs = [results / "taxonomy" / "contigs" / f"{sample}.kraken.report"]
+            params = {'phylophlanDB': args.phylophlanDB, 'option': args.option}
+        elif stage == 'geneAnnotation':
+            inputs = [Path(row['filtered']) for row in self.mag_bins(sample) if row['filtered']]
+            # Genus hints for Prokka: a new taxonomy invalidates the annotation
+            inputs.append(prokka_queue.genus_table(results, sample) or
+                          results / "taxonomy" / "MAGS" / "phylophlan" / sample / f"{sample}_metagenomic.tsv")
+            outputs = [results / "geneAnnotation" / sample]
+            params = {}
+        elif stage == 'funcAnnotation':
+            inputs = [scaffolds] + [Path(row['fasta']) for row in self.mag_bins(sample)]
+            outputs = [results / "functionalAnnotation" / "eggNOG" / sample]
+            params = {'eggNOGDB': args.eggNOGDB}
+        else:
+            raise ValueError(f"Unknown stage: {stage}")
+        
+        params['stage'] = stage
+        params['tools'] = {tool: self.tool_versions.get(tool) for tool in STAGE_TOOLS.get(stage, [])}
+        return inputs, outputs, params
+    
+    def run_cached(self, name, func, inputs, outputs, params):
+        """Run a step unless the cache holds a result for the same inputs and parameters"""
+        if self.cache is None:
+            return func()
+        
+        key = self.cache.step_key(inputs, params)
+        if self.cache.is_current(name, key):
+            self.logger.info(f"Cached: {name} is up to date, skipping")
+            self.status['steps_completed'].append(name)
+            return True
+        
+        self.cache.invalidate(name)
+        result = func()
+        missing = [str(o) for o in outputs if not output_present(o)]
+        if missing:
+            self.logger.warning(f"{name} did not produce {', '.join(missing)}; result not cached")
+        else:
+            self.cache.record(name, key, outputs)
+        return result
+    
+    def read_stats(self, sample, files, threads=2):
+        """Read statistics of FASTQ files, kept in the sample's sidecar JSON"""
+        sidecar = FastqStatsSidecar(Path("results") / "stats" / f"{sample}.fastq_stats.json")
+        return sidecar.stats([str(f) for f in files], threads)
+    
+    def log_read_retention(self, stage, args, sample, threads):
+        """Log read counts and retention after the read-filtering stages"""
+        if stage not in ('qc', 'rmHost'):
+            return
+        inputs, outputs, _ = self.stage_io(stage, args, sample)
+        try:
+            before_r1, _, after_r1, after_r2 = self.read_stats(sample, inputs[:2] + outputs[:2], int(threads))
+        except (OSError, RuntimeError) as e:
+            self.logger.warning(f"Read statistics unavailable for {stage}:{sample} - {e}")
+            return
+        self.logger.info(f"{stage}:{sample} read counts - R1: {after_r1['reads']}, R2: {after_r2['reads']}, "
+                         f"N50: {after_r1['n50']}, retention rate: {retention_rate(before_r1, after_r1)}%")
+    
+    def cached_stage_task(self, stage, args, threads, sample, shard=None, merge=False):
+        """Stage task that consults the step cache before running
+        
+        With a shard the stage runs on that shard's reads; with merge=True
+        the task merges the shard outputs into the sample's usual outputs,
+        cached under the same key as an unsharded run.
+        """
+        if merge:
+            func = lambda: self.merge_shards(stage, args, sample)
+        else:
+            func = self.stage_task(stage, args, threads, sample, shard)
+        
+        def run():
+            name = f"{stage}:{sample}" if shard is None else f"{stage}:{sample}/{shard}"
+            # Inputs are resolved when the task starts, after upstream stages ran
+            inputs, outputs, params = self.stage_io(stage, args, sample, shard)
+            stage_name = stage if shard is None else f"{stage}/{shard}"
+            try:
+                if (shard is not None or stage == 'shard') and not self.shards_needed(stage, args, sample, shard):
+                    # Sharded or not, the merged outputs are cached under the same key
+                    self.logger.info(f"Cached: {name} skipped, the merged outputs of {sample} are up to date")
+                    result = True
+                else:
+                    result = self.run_cached(name, func, inputs, outputs, params)
+            except Exception:
+                if self.catalogue is not None:
+                    self.catalogue.set_status(sample, stage_name, 'failed')
+                raise
+            finally:
+                if self.scratch is not None:
+                    self.scratch.clean(name)
+            if self.catalogue is not None:
+                # Cached steps are catalogued too, so later stages never glob
+                self.update_catalogue(stage, sample)
+                self.catalogue.set_status(sample, stage_name, 'done')
+            if shard is None:
+                self.log_read_retention(stage, args, sample, threads)
+            task = current_task()
+            if self.memory_model is not None and task is not None and not merge:
+                self.memory_model.observe(stage, input_size(inputs), task.peak_memory)
+            if self.lifecycle is not None:
+                self.lifecycle.task_succeeded(name)
+            return result
+        return run
+    
+    def task_memory(self, stage, args, sample, shard=None):
+        """Callable estimating the peak memory of one stage for one sample (or one shard of it)"""
+        def estimate():
+            inputs, _, _ = self.stage_io(stage, args, sample, shard)
+            memory = self.memory_model.estimate(stage, input_size(inputs))
+            if stage == 'taxAssignment' and self.kraken_db is not None and not self.kraken_db.memory_mapping:
+                # Without --memory-mapping every kraken2 process loads the database
+                memory += self.kraken_db.db_size()
+            return memory
+        return estimate
+    
+    def biom_task(self, name, pattern, output, step_name):
+        """Cached task merging every Kraken report matching pattern under results/"""
+        def run():
+            reports = sorted(Path("results").glob(pattern))
+            params = {'stage': name, 'engine': self.biom_engine(), 'tools': {'kraken-biom': None}}
+            return self.run_cached(name, lambda: self.kraken_biom(reports, output, step_name),
+                                   reports, [output], params)
+        return run
+    
+    def build_pipeline_dag(self, args, samples, total_threads, jobs):
+        """Build the (sample, stage) task graph for a complete run"""
+        max_memory = self.memory_budget()
+        scheduler = DAGScheduler(total_threads, max_workers=jobs, logger=self.logger, max_memory=max_memory)
+        if max_memory:
+            self.logger.info(f"Memory budget for concurrent tasks: {max_memory / 1e9:.1f} GB")
+        task_threads = max(1, total_threads // jobs)
+        # Per-stage threads from the autotune profiles, when allocate_threads set them
+        stage_threads = lambda stage: self.stage_threads.get(stage, task_threads)
+        batch_annotation = self.config.getboolean('ANNOTATION', 'eggnog_batch', fallback=False)
+        # Differential coverage maps the reads of every sample, so binning
+        # waits for all host removals, whether or not they succeeded
+        cross_coverage = self.coverage_enabled() and \
+            self.config.get('ASSEMBLY', 'coverage_samples', fallback='self') == 'all'
+        
+        # Stages switched off in the configuration get no tasks; their
+        # dependents depend on what they depended on instead
+        disabled = set()
+        if batch_annotation:
+            disabled.add('funcAnnotation')
+        if not self.normalization_enabled():
+            disabled.add('normalize')
+        
+        def dependencies(stage):
+            return [d for dep in STAGE_DEPENDENCIES[stage] for d in (dependencies(dep) if dep in disabled else [dep])]
+        
+        for sample in samples:
+            # A sharded sample runs host removal and classification once per
+            # shard of its trimmed reads; the merge keeps the stage's task name
+            names = shards.shard_names(self.shard_count(args, sample))
+            sharded = len(names) > 1
+            classify_merged = sharded and self.classify_merged(args, sample)
+            if classify_merged:
+                self.logger.info(f"{sample}: host-free shards were released, classifying the merged reads unsharded")
+            if sharded:
+                scheduler.add_task(Task(
+                    f"shard:{sample}",
+                    self.cached_stage_task('shard', args, str(stage_threads('shard')), sample),
+                    sample=sample,
+                    stage='shard',
+                    deps=[f"{dep}:{sample}" for dep in dependencies('rmHost')],
+                    cores=stage_threads('shard'),
+                ))
+            for stage in PIPELINE_STAGES:
+                if stage in disabled:
+                    continue
+                if sharded and stage in SHARDED_STAGES and not (stage == 'taxAssignment' and classify_merged):
+                    for name in names:
+                        scheduler.add_task(Task(
+                            f"{stage}:{sample}/{name}",
+                            self.cached_stage_task(stage, args, str(stage_threads(stage)), sample, name),
+                            sample=sample,
+                            stage=stage,
+                            deps=[f"{dep}:{sample}/{name}" if dep in SHARDED_STAGES else f"shard:{sample}"
+                                  for dep in dependencies(stage)],
+                            cores=stage_threads(stage),
+                            memory=self.task_memory(stage, args, sample, name) if self.memory_model is not None else 0,
+                        ))
+                    scheduler.add_task(Task(
+                        f"{stage}:{sample}",
+                        self.cached_stage_task(stage, args, str(stage_threads(stage)), sample, merge=True),
+                        sample=sample,
+                        stage=stage,
+                        deps=[f"{stage}:{sample}/{name}" for name in names],
+                    ))
+                    continue
+                scheduler.add_task(Task(
+                    f"{stage}:{sample}",
+                    self.cached_stage_task(stage, args, str(stage_threads(stage)), sample),
+                    sample=sample,
+                    stage=stage,
+                    deps=[f"{dep}:{sample}" for dep in dependencies(stage)],
+                    cores=stage_threads(stage),
+                    memory=self.task_memory(stage, args, sample) if self.memory_model is not None else 0,
+                    after=[f"rmHost:{other}" for other in samples] if stage == 'binning' and cross_coverage else None,
+                ))
+        
+        # Project-level tables are built from whichever samples succeeded
+        results = Path("results")
+        scheduler.add_task(Task(
+            "taxAssignment:biom",
+            self.biom_task("taxAssignment:biom", "taxonomy/reads/kraken/*/hostRemoved/*.report",
+                           results / "taxonomy" / "taxonomy_kraken.json", "Kraken-biom Reads"),
+            stage='taxAssignment',
+            deps=[f"taxAssignment:{sample}" for sample in samples],
+            require_all=False,
+        ))
+        if str(args.option) != '1':
+            scheduler.add_task(Task(
+                "taxMags:biom",
+                self.biom_task("taxMags:biom", "taxonomy/contigs/*.report",
+                               results / "taxonomy" / "contigs" / "taxonomy_krakenCONTIGS.json", "Kraken-biom Contigs"),
+                stage='taxMags',
+                deps=[f"taxMags:{sample}" for sample in samples],
+                require_all=False,
+            ))
+        
+        # One eggNOG search over all assembled samples, with every core
+        if batch_annotation:
+            def batch_memory():
+                assemblies = eggnog_batch.batch_inputs(results / "assemblies", samples)
+                return self.memory_model.estimate('funcAnnotation', input_size(assemblies.values()))
+            scheduler.add_task(Task(
+                "funcAnnotation:batch",
+                self.batch_annotation_task(args, samples, str(total_threads)),
+                stage='funcAnnotation',
+                deps=[f"binning:{sample}" for sample in samples],
+                cores=total_threads,
+                require_all=False,
+                memory=batch_memory if self.memory_model is not None else 0,
+            ))
+        
+        # The shared Kraken2 database is released after its last consumer
+        if self.kraken_db is not None:
+            consumers = [f"taxAssignment:{sample}" for sample in samples]
+            if str(args.option) != '1':
+                consumers += [f"taxMags:{sample}" for sample in samples]
+            scheduler.add_task(Task(
+                "taxAssignment:release-db",
+                self.release_kraken_db,
+                stage='taxAssignment',
+                deps=consumers,
+                always=True,
+            ))
+        return scheduler
     
     def run_full_pipeline(self, args):
         """Run the complete pipeline"""
@@ -217,22 +1362,64 @@ class MetaPipeline:
             self.check_dependencies()
             self.create_environment_info()
             
-            threads = self.get_threads(args.cpus)
+            threads = int(self.get_threads(args.cpus))
+            samples = self.discover_samples(args.pForward, args.extension)
+            if not samples:
+                raise RuntimeError(f"No samples found in raw-reads/ matching *{args.pForward}*.{args.extension}")
             
-            # Run all steps
-            self.quality_check(threads, args.pForward, args.pReverse, args.extension)
-            self.host_removal(threads, args.pForward, args.extension, args.bowtieDB)
-            self.taxonomic_assignment(threads, args.pForward, args.extension, args.krakenDB)
-            self.metagenome_assembly(threads, args.pForward, args.extension)
-            self.taxonomic_assignment_mags(threads, args.phylophlanDB, args.prefix, args.option)
-            self.gene_annotation(threads)
-            self.functional_annotation(threads, args.prefix, args.eggNOGDB, args.koProfiles, args.koList)
+            jobs = self.get_jobs(args.jobs, len(samples), threads)
+            if self.catalogue is not None:
+                self.catalogue.add_samples({
+                    sample: (Path("raw-reads") / f"{sample}{args.pForward}.{args.extension}",
+                             Path("raw-reads") / f"{sample}{args.pReverse}.{args.extension}")
+                    for sample in samples
+                })
+            
+            self.cache = StepCache(Path("results") / "pipeline_cache.json", self.logger)
+            if args.force:
+                self.cache.reset()
+            self.open_kraken_db(args.krakenDB)
+            self.open_memory_model()
+            self.open_lifecycle(args, samples)
+            self.lifecycle.revive(self.cache, lambda step: self.step_stale(args, step))
+            jobs = self.allocate_threads(args, samples, threads, jobs)
+            self.logger.info(f"Scheduling {len(samples)} samples on {threads} cores ({jobs} concurrent tasks)")
+            if self.executor.remote:
+                self.logger.info(f"Task commands are submitted as batch jobs, scripts in {self.executor.job_dir}")
+                self.logger.info(f"In-process steps (QC, shard split/merge, coverage, tables) run on this host; "
+                                 f"the {threads} cores bound the batch jobs held at once")
+            
+            # Run all (sample, stage) tasks through the DAG scheduler
+            scheduler = self.build_pipeline_dag(args, samples, threads, jobs)
+            try:
+                summary = scheduler.run()
+            finally:
+                # A staged database copy must not outlive an interrupted or failed run
+                self.release_kraken_db(force=True)
+                self.scratch.close()
+                self.executor.close()
+                self.save_timeline(scheduler)
+            retried = sorted(name for name, job in self.executor.status().items() if job.get('attempt', 1) > 1)
+            if retried:
+                self.logger.warning(f"Commands retried: {', '.join(retried)}")
+            self.cache.save()
+            self.memory_model.save()
+            if self.lifecycle.freed_bytes:
+                self.logger.info(f"Intermediate files released: {self.lifecycle.freed_bytes / 1e9:.2f} GB")
+            held = {name: consumers for name, consumers in self.lifecycle.pending().items() if consumers}
+            if held:
+                self.logger.info(f"Intermediates kept for unfinished consumers: {', '.join(sorted(held))}")
             
             self.status['end_time'] = datetime.now()
             elapsed = self.status['end_time'] - self.status['start_time']
             
-            self.logger.info(f"Pipeline completed successfully in {elapsed}")
             self.logger.info(f"Steps completed: {len(self.status['steps_completed'])}")
+            if summary['skipped']:
+                self.logger.warning(f"Skipped tasks: {', '.join(summary['skipped'])}")
+            if summary['failed']:
+                raise RuntimeError(f"Failed tasks: {', '.join(summary['failed'])}")
+            
+            self.logger.info(f"Pipeline completed successfully in {elapsed}")
             
         except Exception as e:
             self.status['end_time'] = datetime.now()
@@ -241,20 +1428,156 @@ class MetaPipeline:
                 self.logger.error(f"Failed steps: {', '.join(self.status['steps_failed'])}")
             raise
     
-    def setup_project(self, reads_dir, working_dir, pattern, extension, prefix=None):
+    def save_timeline(self, scheduler):
+        """Write when each task ran and on how many cores ([SCHEDULER] timeline)"""
+        path = Path(self.config.get('SCHEDULER', 'timeline', fallback='') or
+                    self.log_dir / f"task_timeline_{self.run_id}.json")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(scheduler.timeline(), f, indent=1)
+        os.replace(tmp_path, path)
+        self.logger.info(f"Task timeline saved to {path}")
+        return path
+    
+    def autotune_config(self, project, work_dir):
+        """Configuration of one profiling run: its own timeline, no sharding, no profiles"""
+        config = configparser.ConfigParser(interpolation=None)
+        config.read(self.config_file)
+        for section in ('RESOURCES', 'METRICS', 'SCHEDULER', 'AUTOTUNE'):
+            if not config.has_section(section):
+                config.add_section(section)
+        config['SCHEDULER']['timeline'] = str(project / "timeline.json")
+        config['SCHEDULER']['jobs'] = '1'
+        config['SCHEDULER']['shards'] = '1'
+        config['AUTOTUNE']['use_profiles'] = 'false'
+        # Subsample runs must not skew the memory history of real runs
+        config['RESOURCES']['memory_history'] = str(work_dir / "memory_history.json")
+        config['METRICS']['events_log'] = str(work_dir / "step_metrics.jsonl")
+        path = project / "pipeline.conf"
+        with open(path, 'w') as f:
+            config.write(f)
+        return path
+    
+    def autotune(self, args):
+        """Measure the speedup of every stage with the thread count on a subsample of the reads
+        
+        The complete pipeline runs once per thread count, one task at a time,
+        on the first [AUTOTUNE] sample_pairs read pairs of the largest sample;
+        the per-stage times from each run's task timeline are stored in
+        [AUTOTUNE] profiles for mode 'all' to plan its core allocation.
+        """
+        self.logger.info("Starting step: Thread scaling autotune")
+        start_time = time.time()
+        cores = int(self.get_threads(args.cpus))
+        samples = self.discover_samples(args.pForward, args.extension)
+        if not samples:
+            raise RuntimeError(f"No samples found in raw-reads/ matching *{args.pForward}*.{args.extension}")
+        sample = max(samples, key=lambda name: self.raw_read_bytes(args, name))
+        pairs = self.config.getint('AUTOTUNE', 'sample_pairs', fallback=DEFAULT_PAIRS)
+        counts = thread_counts(cores, self.config.get('AUTOTUNE', 'thread_counts', fallback='').replace(',', ' ').split())
+        work_dir = Path(self.config.get('AUTOTUNE', 'work_dir', fallback='') or Path("results") / "autotune").absolute()
+        
+        reads_dir = work_dir / "raw-reads"
+        reads_dir.mkdir(parents=True, exist_ok=True)
+        subset = []
+        for pattern in (args.pForward, args.pReverse):
+            name = f"{sample}{pattern}.{args.extension}"
+            subset.append(subsample_reads(Path("raw-reads") / name, reads_dir / name, pairs))
+        profiles = self.open_thread_profiles()
+        profiles.reset(input_size(subset), sample, pairs)
+        self.logger.info(f"Profiling {sample} ({pairs} read pairs) with {', '.join(map(str, counts))} threads")
+        
+        forwarded = [(flag, value) for flag, value in (
+            ('-p1', args.pForward), ('-p2', args.pReverse), ('-e', args.extension), ('-bDB', args.bowtieDB),
+            ('-kDB', args.krakenDB), ('-pDB', args.phylophlanDB), ('-opt', args.option), ('-n', args.prefix),
+            ('-eDB', args.eggNOGDB), ('-profile', args.koProfiles), ('-kL', args.koList)) if value is not None]
+        for threads in counts:
+            project = work_dir / f"threads_{threads}"
+            if project.exists():
+                shutil.rmtree(project)
+            create_project_dirs(project, [sample])
+            (project / "raw-reads").mkdir()
+            for path in subset:
+                (project / "raw-reads" / path.name).symlink_to(path)
+            env = os.environ.copy()
+            env['METAPIPELINE_CONFIG'] = str(self.autotune_config(project, work_dir))
+            cmd = [sys.executable, str(Path(__file__).absolute()), "metapipeline", "-m", "all",
+                   "-t", str(threads), "-j", "1", "--force"] + [item for pair in forwarded for item in pair]
+            try:
+                self.run_command(cmd, f"Autotune [{threads} threads]", env=env, cwd=project)
+            except RuntimeError:
+                # Small subsamples may not assemble into bins; the stages that finished are still measured
+                self.logger.warning(f"Profiling run with {threads} threads had failed stages; "
+                                    f"only the stages that finished are profiled")
+            timeline_path = project / "timeline.json"
+            if not timeline_path.exists():
+                continue
+            with open(timeline_path) as f:
+                timeline = json.load(f)
+            for task in timeline['tasks']:
+                if task['state'] == 'done' and task['name'] == f"{task['stage']}:{sample}":
+                    profiles.record(task['stage'], threads, task['end'] - task['start'])
+        profiles.save()
+        
+        for stage in PIPELINE_STAGES:
+            timings = profiles.measured(stage)
+            if timings:
+                curve = [f"{t} threads {seconds:.1f} s (x{profiles.speedup(stage, t):.2f})"
+                         for t, seconds in sorted(timings.items())]
+                self.logger.info(f"{stage}: {', '.join(curve)}")
+        if not self.config.getboolean('DEFAULT', 'keep_intermediate', fallback=False):
+            shutil.rmtree(work_dir, ignore_errors=True)
+        self.logger.info(f"Thread profiles saved to {profiles.path} in {time.time() - start_time:.2f} seconds")
+        self.status['steps_completed'].append("Thread scaling autotune")
+        return profiles
+    
+    def setup_project(self, reads_dir, working_dir, pattern, extension, prefix=None, mode=None, threads=None,
+                      reverse_pattern=None):
         """Setup project directory structure"""
-        script_path = self.script_dir / "src" / "setup3.sh"
-        cmd = [str(script_path), reads_dir, working_dir, pattern, extension]
-        if prefix:
-            cmd.append(prefix)
+        self.logger.info("Starting step: Project Setup")
+        start_time = time.time()
+        
+        samples = select_reads(reads_dir, pattern, extension, prefix, reverse_pattern)
+        if not samples:
+            raise RuntimeError(f"No reads matching *{pattern}.{extension} found in {reads_dir}")
+        
+        # Stage only the selected samples' reads, linking instead of copying where possible
+        mode = mode or self.config.get('SETUP', 'staging', fallback='auto')
+        algorithm = self.config.get('SETUP', 'checksum_algorithm', fallback='md5')
+        stager = Stager(mode, algorithm, self.checksum_cache(), self.logger)
+        files = [read for reads in samples.values() for read in reads]
+        methods = stager.stage(files, Path(working_dir) / "raw-reads", int(self.get_threads(threads)))
         
-        return self.run_command(cmd, "Project Setup")
+        create_project_dirs(working_dir, samples)
+        
+        used = {method: list(methods.values()).count(method) for method in set(methods.values())}
+        self.logger.info(f"Staged {len(files)} files for {len(samples)} samples "
+                         f"({', '.join(f'{n} {m}' for m, n in sorted(used.items()))}) "
+                         f"in {time.time() - start_time:.2f} seconds")
+        self.status['steps_completed'].append("Project Setup")
+        return True
+    
+    def checksum_cache(self, path=None):
+        """Checksum cache shared by the md5 and setup subcommands"""
+        path = path or self.config.get('DEFAULT', 'checksum_cache', fallback=str(DEFAULT_CACHE))
+        return ChecksumCache(path)
     
-    def md5_check(self, reads_dir, md5_file, extension, output):
+    def md5_check(self, reads_dir, md5_file, extension, output, algorithm='md5', threads=None, cache_path=None):
         """Check MD5 sums of reads"""
-        script_path = self.script_dir / "src" / "raw_readsCheck2.sh"
-        cmd = [str(script_path), reads_dir, md5_file, extension, output]
-        return self.run_command(cmd, "MD5 Check")
+        self.logger.info(f"Starting step: MD5 Check ({algorithm})")
+        start_time = time.time()
+        
+        rows = verify_reads(reads_dir, md5_file, extension, output, algorithm,
+                            int(self.get_threads(threads)), self.checksum_cache(cache_path))
+        
+        failed = [row['sample'] for row in rows if row['result'] != 'correct']
+        self.logger.info(f"Checked {len(rows)} files in {time.time() - start_time:.2f} seconds, "
+                         f"report saved to {output}.csv")
+        if failed:
+            self.logger.warning(f"Checksum mismatch or missing from manifest: {', '.join(failed)}")
+        self.status['steps_completed'].append("MD5 Check")
+        return True
 
 def create_parser():
     """Create argument parser"""
@@ -291,6 +1614,10 @@ Examples:
     md5_parser.add_argument("md5_file", help="MD5 sum file")
     md5_parser.add_argument("extension", help="File extension")
     md5_parser.add_argument("output", help="Output file name")
+    md5_parser.add_argument("--algorithm", default="md5", choices=ALGORITHMS,
+                           help="Checksum algorithm used in the manifest (default: md5)")
+    md5_parser.add_argument("-t", "--threads", type=int, help="Files hashed concurrently")
+    md5_parser.add_argument("--cache", help="Checksum cache file (default: [DEFAULT] checksum_cache)")
     
     # Project setup
     setup_parser = subparsers.add_parser("setup", help="Setup project directory")
@@ -299,13 +1626,23 @@ Examples:
     setup_parser.add_argument("pattern", help="Read pattern (e.g., _R1)")
     setup_parser.add_argument("extension", help="File extension")
     setup_parser.add_argument("--prefix", help="Sample prefix")
+    setup_parser.add_argument("-p2", "--reverse-pattern",
+                             help="Reverse read pattern (default: pattern with its last 1 as 2, e.g. _R2)")
+    setup_parser.add_argument("--mode", choices=STAGING_MODES,
+                             help="How reads are placed in raw-reads/ (default: [SETUP] staging)")
+    setup_parser.add_argument("-t", "--threads", type=int, help="Files staged concurrently")
     
     # Main pipeline
     pipeline_parser = subparsers.add_parser("metapipeline", help="Run MetaGenomics pipeline")
     pipeline_parser.add_argument("-m", "--mode", required=True,
-                                choices=["all", "qc", "rmHost", "taxAssignment", "assembly", "taxMags", "geneAnnotation", "funcAnnotation"],
+                                choices=["all", "autotune", "qc", "rmHost", "taxAssignment", "normalize", "assembly", "binning", "taxMags",
+                                         "geneAnnotation", "funcAnnotation"],
                                 help="Pipeline mode")
     pipeline_parser.add_argument("-t", "--cpus", type=int, help="Number of threads")
+    pipeline_parser.add_argument("-j", "--jobs", type=int,
+                                help="Tasks run concurrently in mode 'all' (default: auto)")
+    pipeline_parser.add_argument("--force", action="store_true",
+                                help="Rerun every step in mode 'all', ignoring the step cache")
     pipeline_parser.add_argument("-p1", "--pForward", help="Forward read pattern")
     pipeline_parser.add_argument("-p2", "--pReverse", help="Reverse read pattern")
     pipeline_parser.add_argument("-e", "--extension", help="File extension")
@@ -326,6 +1663,9 @@ def main():
     args = parser.parse_args()
     
     pipeline = MetaPipeline()
+    if pipeline.engine is not None:
+        # SIGINT/SIGTERM kill every running command's process group first
+        pipeline.engine.install_signal_handlers()
     
     try:
         if args.subcommand == 'env':
@@ -340,33 +1680,71 @@ def main():
             pipeline.run_command(cmd, "Environment Creation")
             
         elif args.subcommand == "md5":
-            pipeline.md5_check(args.reads, args.md5_file, args.extension, args.output)
+            pipeline.md5_check(args.reads, args.md5_file, args.extension, args.output,
+                               args.algorithm, args.threads, args.cache)
             
         elif args.subcommand == "setup":
-            pipeline.setup_project(args.reads, args.working_dir, args.pattern, args.extension, args.prefix)
+            pipeline.setup_project(args.reads, args.working_dir, args.pattern, args.extension, args.prefix,
+                                   args.mode, args.threads, args.reverse_pattern)
             
         elif args.subcommand == "metapipeline":
             threads = pipeline.get_threads(args.cpus)
+            pipeline.open_catalogue()
+            if args.mode != "all":
+                # Mode 'all' checks the tools and writes the manifest itself
+                pipeline.create_environment_info()
             
             if args.mode == "qc":
                 pipeline.quality_check(threads, args.pForward, args.pReverse, args.extension)
             elif args.mode == "rmHost":
                 pipeline.host_removal(threads, args.pForward, args.extension, args.bowtieDB)
             elif args.mode == "taxAssignment":
-                pipeline.taxonomic_assignment(threads, args.pForward, args.extension, args.krakenDB)
+                pipeline.open_kraken_db(args.krakenDB)
+                try:
+                    pipeline.classify_reads(threads, args)
+                finally:
+                    pipeline.release_kraken_db()
+            elif args.mode == "normalize":
+                pipeline.normalize_reads(threads)
             elif args.mode == "assembly":
-                pipeline.metagenome_assembly(threads, args.pForward, args.extension)
+                if pipeline.normalization_enabled():
+                    pipeline.normalize_reads(threads)
+                if pipeline.coverage_enabled():
+                    pipeline.metagenome_assembly(threads, args.pForward, args.extension, phase='assemble')
+                    pipeline.binning(threads, args.pForward, args.extension)
+                else:
+                    pipeline.metagenome_assembly(threads, args.pForward, args.extension)
+            elif args.mode == "binning":
+                pipeline.binning(threads, args.pForward, args.extension)
             elif args.mode == "taxMags":
-                pipeline.taxonomic_assignment_mags(threads, args.phylophlanDB, args.prefix, args.option)
+                kraken_db = args.krakenDB if str(args.option) != '1' else None
+                pipeline.taxonomic_assignment_mags(threads, args.phylophlanDB, args.prefix, args.option,
+                                                   kraken_db=kraken_db)
             elif args.mode == "geneAnnotation":
                 pipeline.gene_annotation(threads)
             elif args.mode == "funcAnnotation":
-                pipeline.functional_annotation(threads, args.prefix, args.eggNOGDB, args.koProfiles, args.koList)
+                if pipeline.config.getboolean('ANNOTATION', 'eggnog_batch', fallback=False):
+                    pipeline.functional_annotation_batch(threads, args.eggNOGDB)
+                else:
+                    pipeline.functional_annotation(threads, args.prefix, args.eggNOGDB, args.koProfiles, args.koList)
             elif args.mode == "all":
                 pipeline.run_full_pipeline(args)
+            elif args.mode == "autotune":
+                pipeline.autotune(args)
             else:
                 raise ValueError(f"Unknown mode: {args.mode}")
+            
+            # Single-stage runs cover every sample; catalogue what they produced
+            if args.mode == "assembly":
+                pipeline.update_catalogue('assembly')
+            if args.mode == "binning" or (args.mode == "assembly" and pipeline.coverage_enabled()):
+                pipeline.update_catalogue('binning')
+            elif args.mode == "taxMags":
+                pipeline.update_catalogue('taxMags')
                 
+    except KeyboardInterrupt:
+        pipeline.logger.error("Pipeline interrupted")
+        sys.exit(130)
     except Exception as e:
         pipeline.logger.error(f"Pipeline execution failed: {e}")
         sys.exit(1)
@@ -57,6 +57,7 @@ cp package.sh "$PACKAGE_DIR/"
 
 # Directories
 cp -r src/ "$PACKAGE_DIR/"
+cp -r metapipe/ "$PACKAGE_DIR/"
 cp -r config/ "$PACKAGE_DIR/"
 cp -r docs/ "$PACKAGE_DIR/"
 cp -r docker/ "$PACKAGE_DIR/"
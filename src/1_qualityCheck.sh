@@ -4,6 +4,13 @@ threads=$1
 patternF=$2
 patternR=$3
 extension=$4
+runFastqc=${5:-true} #Run FastQC before and after trimming (true/false)
+sample=${METAPIPELINE_SAMPLE:-} #Optional: restrict the run to one sample (set by the scheduler)
+
+readsF="*$patternF*"
+if [ -n "$sample" ]; then
+    readsF="$sample$patternF"
+fi
 
 echo "----------------------------- METAPIPELINE :--------------------------------------"
 echo "                              QUALITY CHECK                                       "
@@ -13,15 +20,17 @@ echo "--------------------------------------------------------------------------
 # Iterate through the folders
 cd results/
 #Create bases for each sample
-for R1 in ../raw-reads/*$patternF*.$extension;
+for R1 in ../raw-reads/$readsF.$extension;
     do
         base=$(basename $R1 $patternF.$extension) #This will deleate any prefix up to the last "/" and the pattern and file extension
                                                    #in order to keep the sample name
 
 
-        fastqc  ../raw-reads/$base*.$extension -o fastqc/beforeTrimQC/$base/ -t $threads > fastqc/beforeTrimQC/$base/fastqc_verbose.txt
+        if [ "$runFastqc" == "true" ]; then
+            fastqc  ../raw-reads/$base*.$extension -o fastqc/beforeTrimQC/$base/ -t $threads > fastqc/beforeTrimQC/$base/fastqc_verbose.txt
 
-        echo $base 'Samples QC Done'
+            echo $base 'Samples QC Done'
+        fi
     #2: Clean the reads: -------------------------------------------------------------------------
     # Usage:
     #       PE [-version] [-threads <threads>] [-phred33|-phred64] [-trimlog <trimLogFile>] 
@@ -52,6 +61,8 @@ for R1 in ../raw-reads/*$patternF*.$extension;
     done
 #3: Second quality check after trimming: --------------------------------------------------------
 #Quality control
-fastqc -o fastqc/trimQC/ -t $threads trimmed-reads/*/*.fq.gz
-echo 'QC after trimming Done'
+if [ "$runFastqc" == "true" ]; then
+    fastqc -o fastqc/trimQC/ -t $threads trimmed-reads/${sample:-*}/*.fq.gz
+    echo 'QC after trimming Done'
+fi
 cd ..
@@ -4,6 +4,14 @@ threads=$1
 patternF=$2
 extension=$3
 bowtieDB=$4
+sample=${METAPIPELINE_SAMPLE:-} #Optional: restrict the run to one sample (set by the scheduler)
+transientGzip=${METAPIPELINE_GZIP:-gzip -9} #Compressor for intermediates (set from the compression policy)
+archiveLevel=${METAPIPELINE_ARCHIVE_LEVEL:+-c $METAPIPELINE_ARCHIVE_LEVEL} #gzip level of the kept host-free reads
+
+readsF="*$patternF*"
+if [ -n "$sample" ]; then
+    readsF="$sample$patternF"
+fi
 
 echo "--------------------- METAPIPELINE:--------------------------------------"
 echo "                          Remove Host                                           "
@@ -20,7 +28,7 @@ echo "--------------------------------------------------------------------------
 #  -p/--threads <int> number of alignment threads to launch (1)
 
 cd results/
-for R1 in ../raw-reads/*$patternF*.$extension;
+for R1 in ../raw-reads/$readsF.$extension;
     do
         base=$(basename $R1 $patternF.$extension) #This will deleate any prefix up to the last "/" and the pattern and file extension
                                                    #in order to keep the sample name
@@ -62,13 +70,14 @@ for R1 in ../raw-reads/*$patternF*.$extension;
 
         #Sort BAM file
         samtools sort -n -@ $threads \
+        -T ${TMPDIR:-host_removed/$base}/${base}_sort \
         host_removed/$base/${base}_bothEndsUnmapped.bam \
         -o host_removed/$base/${base}_sorted.bam
 
         echo $base 'Sort BAM file Done'
 
         #Split pared-end reads into separated fastq files
-        samtools fastq -@ $threads host_removed/$base/${base}_sorted.bam \
+        samtools fastq -@ $threads $archiveLevel host_removed/$base/${base}_sorted.bam \
                 -1 host_removed/$base/${base}_host_removed_R1.fastq.gz \
                 -2 host_removed/$base/${base}_host_removed_R2.fastq.gz \
         
@@ -77,7 +86,7 @@ for R1 in ../raw-reads/*$patternF*.$extension;
         rm host_removed/${base}/${base}_results.sam
         rm host_removed/$base/${base}_results.bam
         rm host_removed/$base/${base}_bothEndsUnmapped.bam 
-        gzip -9 host_removed/$base/${base}_sorted.bam
+        $transientGzip host_removed/$base/${base}_sorted.bam
         echo $base 'Compress sorted BAM file Done'
         done
 cd ..
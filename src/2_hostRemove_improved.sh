@@ -76,14 +76,15 @@ get_file_size() {
     fi
 }
 
+# Single-pass FASTQ statistics module
+FASTQ_STATS="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)/metapipe/fastq_stats.py"
+
 # Function to count reads in fastq file
+# Statistics are stored in the per-sample sidecar stats/<sample>.fastq_stats.json,
+# so a file is decompressed only once across all stages
 count_reads() {
     local file="$1"
-    if [[ "$file" == *.gz ]]; then
-        echo $(($(zcat "$file" | wc -l) / 4))
-    else
-        echo $(($(wc -l < "$file") / 4))
-    fi
+    python3 "$FASTQ_STATS" --count -t "$THREADS" --sidecar "stats/${base}.fastq_stats.json" "$file"
 }
 
 # Function to check Bowtie2 database
@@ -0,0 +1,104 @@
+#!/bin/bash
+
+threads=$1
+patternF=$2
+extension=$3
+bowtieDB=$4
+keepBam=${5:-false} #Keep a BAM with the host-aligned pairs for audit (true/false)
+bowtieParams=${6:-} #Extra Bowtie2 parameters (Eg. --very-sensitive-local)
+sample=${METAPIPELINE_SAMPLE:-} #Optional: restrict the run to one sample (set by the scheduler)
+shard=${METAPIPELINE_SHARD:-} #Optional: process one shard of the sample's reads, in shards/<shard>/ (set by the scheduler)
+archiveLevel=${METAPIPELINE_ARCHIVE_LEVEL:+-c $METAPIPELINE_ARCHIVE_LEVEL} #gzip level of the kept host-free reads
+
+set -o pipefail
+
+echo "--------------------- METAPIPELINE:--------------------------------------"
+echo "                     Remove Host (streaming)                                      "
+echo "----------------------------------------------------------------------------------"
+
+# Bowtie2 writes read pairs next to each other, so its SAM stream can go
+# straight to samtools fastq without a name sort. No SAM/BAM is written to
+# disk unless keepBam is true, and the alignment statistics are collected
+# from the same stream with samtools flagstat.
+#
+#   -f 12     read unmapped and mate unmapped (both ends unmapped)
+#   -F 256    drop secondary alignments
+#   -G 12     (audit BAM) drop pairs where both ends are unmapped
+
+readsF="*$patternF*"
+if [ -n "$sample" ]; then
+    readsF="$sample$patternF"
+fi
+
+# The side readers must start, otherwise tee would block on their pipes
+for tool in bowtie2 samtools; do
+    if ! command -v $tool > /dev/null; then
+        echo "Required command '$tool' not found"
+        exit 1
+    fi
+done
+
+failed=0
+cd results/
+for R1 in ../raw-reads/$readsF.$extension;
+    do
+        base=$(basename $R1 $patternF.$extension) #This will deleate any prefix up to the last "/" and the pattern and file extension
+                                                   #in order to keep the sample name
+
+        echo "Initializing streaming host remove for" $base
+        R1=$base\_1.trim.fq.gz
+        R2=$base\_2.trim.fq.gz
+        in=trimmed-reads/$base${shard:+/shards/$shard}
+        out=host_removed/$base${shard:+/shards/$shard}
+        mkdir -p $out
+
+        # Side readers of the SAM stream are fed through named pipes
+        statsFifo=$out/.${base}_flagstat.fifo
+        rm -f $statsFifo && mkfifo $statsFifo
+        samtools flagstat $statsFifo > $out/${base}_flagstat.txt &
+        pids=($!)
+        teeTargets=($statsFifo)
+
+        if [ "$keepBam" == "true" ]; then
+            auditFifo=$out/.${base}_audit.fifo
+            rm -f $auditFifo && mkfifo $auditFifo
+            samtools view -b -G 12 --threads 2 -o $out/${base}_host_aligned.bam $auditFifo &
+            pids+=($!)
+            teeTargets+=($auditFifo)
+        fi
+
+        bowtie2 \
+        -p $threads \
+        -x $bowtieDB \
+        -1 $in/$R1 \
+        -2 $in/$R2 \
+        $bowtieParams \
+        2> $out/${base}_bowtie2.log \
+        | tee "${teeTargets[@]}" \
+        | samtools fastq -@ $threads $archiveLevel -f 12 -F 256 \
+                -1 $out/${base}_host_removed_R1.fastq.gz \
+                -2 $out/${base}_host_removed_R2.fastq.gz \
+                -0 /dev/null -s /dev/null - \
+                2> $out/${base}_samtools_fastq.log
+        status=$?
+
+        # Side readers finish once tee closes the pipes
+        for pid in "${pids[@]}"; do
+            wait $pid || status=1
+        done
+        rm -f "${teeTargets[@]}"
+
+        if [ $status -ne 0 ]; then
+            echo $base 'streaming host removal FAILED (see' $out/${base}_bowtie2.log ')'
+            failed=$((failed + 1))
+            continue
+        fi
+
+        echo $base 'streaming host removal Done'
+        grep "overall alignment rate" $out/${base}_bowtie2.log
+    done
+cd ..
+
+if [ $failed -gt 0 ]; then
+    exit 1
+fi
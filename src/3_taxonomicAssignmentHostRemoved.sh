@@ -8,11 +8,26 @@ threads=$1
 patternF=$2
 extension=$3
 krakenDB=$4
+memoryMapping=${5:-false} #Use --memory-mapping to share a resident database (true/false)
+sample=${METAPIPELINE_SAMPLE:-} #Optional: restrict the run to one sample (set by the scheduler)
+shard=${METAPIPELINE_SHARD:-} #Optional: classify one shard of the sample's reads, in shards/<shard>/ (set by the scheduler)
+biomEngine=${METAPIPELINE_BIOM_ENGINE:-kraken-biom} #BIOM table builder: kraken-biom or native ([TAXONOMY] biom_engine)
+KRAKEN_TABLE="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)/metapipe/kraken_table.py"
+
+readsF="*$patternF*"
+if [ -n "$sample" ]; then
+    readsF="$sample$patternF"
+fi
+
+mmapOption=""
+if [ "$memoryMapping" == "true" ]; then
+    mmapOption="--memory-mapping"
+fi
 
 
 # Taxonomic assignment ---------------------------------------------------
 cd results/
-for R1 in ../raw-reads/*$patternF*.$extension;
+for R1 in ../raw-reads/$readsF.$extension;
     do
         base=$(basename $R1 $patternF.$extension) #This will deleate any prefix up to the last "/" and the pattern and file extension
                                                    #in order to keep the sample name
@@ -23,7 +38,8 @@ for R1 in ../raw-reads/*$patternF*.$extension;
 		#echo $R2
 
 
-		wdir=taxonomy/reads/kraken/${base}/hostRemoved
+		wdir=taxonomy/reads/kraken/${base}${shard:+/shards/$shard}/hostRemoved
+		reads=host_removed/$base${shard:+/shards/$shard}
 			
 		if [ -d "$wdir" ]; then 
 			echo IMPORTANT:
@@ -31,18 +47,25 @@ for R1 in ../raw-reads/*$patternF*.$extension;
 			echo The directory ${wdir} will be deleted 
 			rm -r $wdir
 		fi
-		mkdir $wdir
+		mkdir -p $wdir
 		echo New directory ${wdir} created for sample ${base}
 
 		kraken2 --db $krakenDB \
 			--threads $threads \
+			$mmapOption \
 			--gzip-compressed \
 			--output ${wdir}/${base}.kraken.out \
 			--report ${wdir}/${base}.kraken.report \
-			--paired host_removed/$base/$R1 host_removed/$base/$R2 
+			--paired $reads/$R1 $reads/$R2 
 
 		echo $base 'taxonomy assignment Done'
 	done
+
+# In per-sample runs the BIOM table is built once all samples are classified
+if [ -n "$sample" ]; then
+	cd ..
+	exit 0
+fi
 	echo "---------------------- METAPIPELINE ---------------------------------------"
 	echo "                       PARSING KRAKEN'S OUTPUT                                     "
 	echo "-----------------------------------------------------------------------------------"
@@ -52,8 +75,19 @@ for R1 in ../raw-reads/*$patternF*.$extension;
 #	 at least phylum taxa, but this can also be filtered during
 #	 the R analysis
 
-kraken-biom taxonomy/reads/kraken/*/hostRemoved/*.report \
-	-o taxonomy/taxonomy_kraken.json \
-	--fmt json  
+#	 With biom_engine = native (and numpy installed) the built-in aggregator
+#	 is used instead: it keeps the matrix in taxonomy_kraken.npz and only
+#	 parses new or changed reports.
+
+if [ "$biomEngine" = native ] && python3 -c "import numpy" 2>/dev/null; then
+	python3 "$KRAKEN_TABLE" taxonomy/reads/kraken/*/hostRemoved/*.report \
+		--matrix taxonomy/taxonomy_kraken.npz \
+		--biom taxonomy/taxonomy_kraken.json \
+		--prune
+else
+	kraken-biom taxonomy/reads/kraken/*/hostRemoved/*.report \
+		-o taxonomy/taxonomy_kraken.json \
+		--fmt json
+fi
 echo 'Kraken-biom file created'
 cd ..
\ No newline at end of file
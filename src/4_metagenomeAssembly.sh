@@ -7,32 +7,61 @@ echo "--------------------------------------------------------------------------
 threads=$1
 patternF=$2
 extension=$3
+sample=${METAPIPELINE_SAMPLE:-} #Optional: restrict the run to one sample (set by the scheduler)
+memoryGB=${METAPIPELINE_MEMORY_GB:-} #Optional: memory limit in GB granted by the scheduler
+phase=${4:-all} #all, assemble (metaSPAdes only) or bin (MaxBin, CheckM and the MAG length filter only)
+abundList=${5:-} #Optional (bin phase): MaxBin -abund_list built from a shared coverage table, relative to results/
+assemblyReads=${6:-host_removed} #Reads given to metaSPAdes: host_removed, or normalized after digital normalization
+
+readsF="*$patternF*"
+if [ -n "$sample" ]; then
+    readsF="$sample$patternF"
+fi
+
+memoryOption=""
+if [ -n "$memoryGB" ]; then
+    memoryOption="-m $memoryGB"
+fi
+
+tmpOption=""
+if [ -n "$TMPDIR" ]; then
+    tmpOption="--tmp-dir $TMPDIR"
+fi
 
 
 # GENOME ASSEMBLY ---------------------------------------------------------------
 
 cd results/
-for R1 in ../raw-reads/*$patternF*.$extension;
+if [ "$phase" != "bin" ]; then
+for R1 in ../raw-reads/$readsF.$extension;
         do
                 base=$(basename $R1 $patternF.$extension) #This will deleate any prefix up to the last "/" and the pattern and file extension
                 #                                         #in order to keep the sample name
-                R1=$base\_host_removed_R1.fastq.gz 
-                R2=$base\_host_removed_R2.fastq.gz 
+                R1=$base\_${assemblyReads}_R1.fastq.gz
+                R2=$base\_${assemblyReads}_R2.fastq.gz
 
-                metaspades.py -1 host_removed/$base/$R1 -2 host_removed/$base/$R2 \
+                metaspades.py -1 $assemblyReads/$base/$R1 -2 $assemblyReads/$base/$R2 \
                         -o assemblies/$base \
                         --threads $threads \
+                        $memoryOption \
+                        $tmpOption \
                         > assemblies/$base/metaspades_$base\_verbose.txt
 
                 echo $base 'Assembly Done'
         done
 
-for d in assemblies/$prefix*;
+for d in assemblies/${sample:-$prefix*};
         do
                 base=${d:11}
                 cp ${d}/scaffolds.fasta assemblies/${base}/${base}-scaffolds.fasta
                 rm ${d}/scaffolds.fasta
         done
+fi
+
+if [ "$phase" == "assemble" ]; then
+        cd ..
+        exit 0
+fi
 
 echo "--------------------- METAPIPELINE ---------------------------------------"
 echo "                           BINNING                                                "
@@ -41,17 +70,23 @@ echo "--------------------------------------------------------------------------
 
 # BINNING  ---------------------------------------------------------------------
 
-for d in assemblies/*;
+for d in assemblies/${sample:-*};
         do
                 # # Create a working directory for maxbin
                 base=${d:11}
                 mkdir assemblies/${base}/maxbin
 
-                # MaxBin call
+                # MaxBin call: depths from the shared coverage table when given,
+                # otherwise MaxBin maps the reads itself
+                if [ -n "$abundList" ]; then
+                        abundance=(-abund_list $abundList)
+                else
+                        abundance=(-reads host_removed/$base/${base}_host_removed_R1.fastq.gz \
+                                -reads2 host_removed/$base/${base}_host_removed_R2.fastq.gz)
+                fi
                 run_MaxBin.pl -thread $threads \
                         -contig assemblies/${base}/${base}-scaffolds.fasta \
-                        -reads host_removed/$base/${base}_host_removed_R1.fastq.gz \
-                        -reads2 host_removed/$base/${base}_host_removed_R2.fastq.gz \
+                        "${abundance[@]}" \
                         -out assemblies/${base}/maxbin/${base} \
                                 > assemblies/${base}/maxbin/maxbin_${base}.log
 
@@ -67,7 +102,7 @@ echo "--------------------------------------------------------------------------
 
 # QUALITY OF THE BINNING ---------------------------------------------------------------
 
-for d in assemblies/$prefix*;
+for d in assemblies/${sample:-$prefix*};
        do
                 # Create a working directory for checkm
                 base=${d:11}
@@ -84,7 +119,7 @@ for d in assemblies/$prefix*;
         done
 
 
-for d in assemblies/*;
+for d in assemblies/${sample:-*};
     do
     base=${d:11}
     for mags in assemblies/${base}/maxbin/$base\.*.fasta;
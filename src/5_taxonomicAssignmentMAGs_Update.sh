@@ -8,11 +8,14 @@ threads=$1
 phylophlanDB=$2
 prefix=$3
 option=$4
+sample=${METAPIPELINE_SAMPLE:-} #Optional: restrict the run to one sample (set by the scheduler)
+biomEngine=${METAPIPELINE_BIOM_ENGINE:-kraken-biom} #BIOM table builder: kraken-biom or native ([TAXONOMY] biom_engine)
+KRAKEN_TABLE="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)/metapipe/kraken_table.py"
 
 cd results/
 
 if (($option == 1)); then
-    for d in assemblies/$prefix*;
+    for d in assemblies/${sample:-$prefix*};
         do
         base=${d:11}
             #echo $base
@@ -45,7 +48,7 @@ if (($option == 1)); then
 
         # echo 'heatmaps MAGs Done'
 else
-    for d in assemblies/$prefix*;
+    for d in assemblies/${sample:-$prefix*};
         do
         base=${d:11}
         krakenDB=$5
@@ -59,10 +62,20 @@ else
         echo $base 'taxonomy assignment Done'
         done
 
-    kraken-biom taxonomy/contigs/*.report \
-    -o taxonomy/contigs/taxonomy_krakenCONTIGS.json \
-    --fmt json  
-    echo 'Kraken-biom file created'
+    # In per-sample runs the BIOM table is built once all samples are classified
+    if [ -z "$sample" ]; then
+        if [ "$biomEngine" = native ] && python3 -c "import numpy" 2>/dev/null; then
+            python3 "$KRAKEN_TABLE" taxonomy/contigs/*.report \
+            --matrix taxonomy/contigs/taxonomy_krakenCONTIGS.npz \
+            --biom taxonomy/contigs/taxonomy_krakenCONTIGS.json \
+            --prune
+        else
+            kraken-biom taxonomy/contigs/*.report \
+            -o taxonomy/contigs/taxonomy_krakenCONTIGS.json \
+            --fmt json
+        fi
+        echo 'Kraken-biom file created'
+    fi
 fi  
 
 
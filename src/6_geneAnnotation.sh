@@ -5,21 +5,47 @@ echo "                       GENE ANNOTATION
 echo "----------------------------------------------------------------------------------"
 
 threads=$1
+sample=${METAPIPELINE_SAMPLE:-} #Optional: restrict the run to one sample (set by the scheduler)
+catalogue=${METAPIPELINE_CATALOGUE:-} #Optional: catalogue of bins and genera (set by the pipeline)
+CATALOGUE="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)/metapipe/catalog.py"
+
+# Bins of a sample as "bin MAG genus" lines: from the catalogue when it has
+# rows for the sample, else by globbing the MaxBin directory and grepping the
+# PhyloPhlAn table
+list_mags() {
+    local listed=""
+    if [ -n "$catalogue" ]; then
+        listed=$(python3 "$CATALOGUE" "$catalogue" bins "$1")
+    fi
+    if [ -n "$listed" ]; then
+        printf '%s\n' "$listed"
+    else
+        # Table written by taxMags, or where older releases looked for it
+        local table=taxonomy/MAGS/phylophlan/$1/$1\_metagenomic.tsv
+        [ -e "$table" ] || table=taxonomy/phylophlan/$1/$1\_metagenomic.tsv
+        for mags in assemblies/$1/maxbin/$1.*.fasta;
+            do
+            [ -e "$mags" ] || continue
+            sample1=$(basename "$mags"| sed 's/\.fasta$//') # name for MAG assembled
+            sample=$(basename "$mags"| sed 's/\./\_/'| cut -d. -f1 ) #Directory Name for MAGS
+            #Extrar Genus information for annotation
+            genus=$(grep "$sample1" "$table" 2>/dev/null | grep -o 'g__[^|]*' | sed 's/g__//')
+            printf '%s\t%s\t%s\n' "$sample1" "$sample" "$genus"
+            done
+    fi
+}
 
 cd results/
-for d in assemblies/*;
+for d in assemblies/${sample:-*};
     do
     base=${d:11}
-    for mags in assemblies/${base}/maxbin/$base.*.fasta;
+    # fd 3, so Prokka cannot read the list from stdin
+    while IFS=$'\t' read -r -u 3 sample1 sample genus;
         do
-        sample1=$(basename "$mags"| sed 's/\.fasta$//') # name for MAG assembled
-        sample=$(basename "$mags"| sed 's/\./\_/'| cut -d. -f1 ) #Directory Name for MAGS
         echo $sample
         mkdir geneAnnotation/$base/$sample # Create MAGS directories
-        #Extrar Genus information for annotation
-        genus=$(grep "$sample1" taxonomy/phylophlan/$base/$base\_metagenomic.tsv | grep -o 'g__[^|]*' | sed 's/g__//') 
         # Check if the substring exists in the string
-        if [[ $genus == *"GGB"* ]]; then
+        if [[ -z $genus || $genus == *"GGB"* ]]; then
             prokka \
             --outdir geneAnnotation/$base/$sample \
             --metagenome \
@@ -44,7 +70,7 @@ for d in assemblies/*;
             --force \
             assemblies/${base}/maxbin/$sample\_filtered.fasta.gz
         fi
-        done
+        done 3< <(list_mags "$base")
     echo $base 'Gene annotation Done'
     done
 cd ..
\ No newline at end of file
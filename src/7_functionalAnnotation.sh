@@ -9,18 +9,40 @@ prefix=$2
 eggnogDB=$3
 profile=$4
 koList=$5
+sample=${METAPIPELINE_SAMPLE:-} #Optional: restrict the run to one sample (set by the scheduler)
+catalogue=${METAPIPELINE_CATALOGUE:-} #Optional: catalogue of bins (set by the pipeline)
+CATALOGUE="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)/metapipe/catalog.py"
+
+# Bins of a sample as "bin MAG" lines: from the catalogue when it has rows
+# for the sample, else by globbing the MaxBin directory
+list_mags() {
+    local listed=""
+    if [ -n "$catalogue" ]; then
+        listed=$(python3 "$CATALOGUE" "$catalogue" bins "$1" | cut -f1,2)
+    fi
+    if [ -n "$listed" ]; then
+        printf '%s\n' "$listed"
+    else
+        for mags in assemblies/$1/maxbin/$1\.*.fasta;
+            do
+            [ -e "$mags" ] || continue
+            sample1=$(basename "$mags"| sed 's/\.fasta$//') # name for MAG assembled
+            sample=$(basename "$mags"| sed 's/\./\_/'| cut -d. -f1 ) #Directory Name for MAGS
+            printf '%s\t%s\n' "$sample1" "$sample"
+            done
+    fi
+}
 
 cd results/
 start_time=$(date +"%T")
 echo $start_time
 
-for d in assemblies/*;
+for d in assemblies/${sample:-*};
     do
     base=${d:11}
-    for mags in assemblies/${base}/maxbin/$base\.*.fasta;
+    # fd 3, so emapper cannot read the list from stdin
+    while IFS=$'\t' read -r -u 3 sample1 sample;
         do
-        sample1=$(basename "$mags"| sed 's/\.fasta$//') # name for MAG assembled
-        sample=$(basename "$mags"| sed 's/\./\_/'| cut -d. -f1 ) #Directory Name for MAGS
 
         mkdir functionalAnnotation/eggNOG/$base/$sample # Create MAGS directories
         emapper.py \
@@ -38,7 +60,7 @@ for d in assemblies/*;
         --output_dir functionalAnnotation/eggNOG/$base/$sample
 
     
-        done
+        done 3< <(list_mags "$base")
     echo $base 'Functional eggnog annotation done'
     done
 # for d in assemblies/*;
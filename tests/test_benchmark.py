@@ -0,0 +1,18 @@
+import json
+
+from metapipe.benchmark import Benchmark
+
+
+def test_sharded_audit_variant_runs(tmp_path):
+    """Sharded streaming host removal with keep_bam merges the audit BAMs of the shards"""
+    benchmark = Benchmark(tmp_path, pairs=500, read_length=100, genomes=2, genome_length=10000, keep=True)
+    benchmark.prepare(1)
+    record = benchmark.run(1, 2, variant='sharded-audit')
+    assert record['returncode'] == 0, record['failed_tasks']
+    assert record['variant'] == 'sharded-audit'
+
+    run_dir = tmp_path / "runs" / "n1_c2_r0_sharded-audit"
+    timeline = json.loads((run_dir / "timeline.json").read_text())
+    assert {'rmHost:S1/000', 'rmHost:S1/001'} <= {task['name'] for task in timeline['tasks']}
+    bam = (run_dir / "project" / "results" / "host_removed" / "S1" / "S1_host_aligned.bam").read_text()
+    assert bam.startswith('@') and sum(line.startswith('@SQ') for line in bam.splitlines()) == 1
@@ -0,0 +1,79 @@
+from metapipe.cache import StepCache
+from metapipe.lifecycle import Artifact, LifecycleManager
+
+
+def trimmed_project(tmp_path):
+    """qc wrote trimmed reads, rmHost consumed them and the reads were released"""
+    cache = StepCache(tmp_path / "pipeline_cache.json")
+    raw = tmp_path / "S1_R1.fastq"
+    raw.write_text("@r1\nACGT\n+\nIIII\n")
+    trimmed = tmp_path / "trimmed" / "S1_1.trim.fq"
+    trimmed.parent.mkdir()
+    trimmed.write_text("@r1\nACG\n+\nIII\n")
+    host_removed = tmp_path / "S1_host_removed_R1.fastq"
+    host_removed.write_text("@r1\nACG\n+\nIII\n")
+
+    cache.record("qc:S1", cache.step_key([raw], {'stage': 'qc'}), [trimmed])
+    cache.record("rmHost:S1", cache.step_key([trimmed], {'bowtieDB': 'host-v1'}), [host_removed])
+
+    lifecycle = LifecycleManager(on_release=cache.release)
+    lifecycle.register(Artifact("trimmed:S1", [trimmed], "qc:S1", ["rmHost:S1"]))
+    lifecycle.task_succeeded("qc:S1")
+    lifecycle.task_succeeded("rmHost:S1")
+    assert not trimmed.exists()
+    return cache, raw, trimmed
+
+
+def stale_steps(cache, keys):
+    return lambda step: not cache.is_current(step, keys[step]())
+
+
+def test_released_output_keeps_producer_cached(tmp_path):
+    cache, raw, trimmed = trimmed_project(tmp_path)
+    keys = {
+        "qc:S1": lambda: cache.step_key([raw], {'stage': 'qc'}),
+        "rmHost:S1": lambda: cache.step_key([trimmed], {'bowtieDB': 'host-v1'}),
+    }
+    lifecycle = LifecycleManager()
+    lifecycle.register(Artifact("trimmed:S1", [trimmed], "qc:S1", ["rmHost:S1"]))
+    assert lifecycle.revive(cache, stale_steps(cache, keys)) == []
+    assert cache.is_current("qc:S1", keys["qc:S1"]())
+    assert cache.is_current("rmHost:S1", keys["rmHost:S1"]())
+
+
+def test_stale_consumer_reruns_producer_of_released_output(tmp_path):
+    cache, raw, trimmed = trimmed_project(tmp_path)
+    # A new host database: rmHost has to run again on the deleted reads
+    keys = {
+        "qc:S1": lambda: cache.step_key([raw], {'stage': 'qc'}),
+        "rmHost:S1": lambda: cache.step_key([trimmed], {'bowtieDB': 'host-v2'}),
+    }
+    lifecycle = LifecycleManager()
+    lifecycle.register(Artifact("trimmed:S1", [trimmed], "qc:S1", ["rmHost:S1"]))
+    assert lifecycle.revive(cache, stale_steps(cache, keys)) == ["qc:S1"]
+    assert not cache.is_current("qc:S1", keys["qc:S1"]())
+
+    # qc regenerates the reads: they are no longer a released intermediate
+    trimmed.write_text("@r1\nACG\n+\nIII\n")
+    cache.record("qc:S1", keys["qc:S1"](), [trimmed])
+    assert not cache.was_released(trimmed)
+    assert lifecycle.revive(cache, stale_steps(cache, keys)) == []
+
+
+def test_revive_follows_the_chain(tmp_path):
+    cache, raw, trimmed = trimmed_project(tmp_path)
+    host_removed = tmp_path / "S1_host_removed_R1.fastq"
+    normalized = tmp_path / "S1_normalized_R1.fastq"
+    normalized.write_text("@r1\nACG\n+\nIII\n")
+    cache.record("normalize:S1", cache.step_key([host_removed], {}), [normalized])
+    cache.release(host_removed)
+    host_removed.unlink()
+    keys = {
+        "qc:S1": lambda: cache.step_key([raw], {'stage': 'qc'}),
+        "rmHost:S1": lambda: cache.step_key([trimmed], {'bowtieDB': 'host-v1'}),
+        "normalize:S1": lambda: cache.step_key([host_removed], {'kmer': 31}),
+    }
+    lifecycle = LifecycleManager()
+    lifecycle.register(Artifact("trimmed:S1", [trimmed], "qc:S1", ["rmHost:S1"]))
+    lifecycle.register(Artifact("host-removed:S1", [host_removed], "rmHost:S1", ["normalize:S1"]))
+    assert sorted(lifecycle.revive(cache, stale_steps(cache, keys))) == ["qc:S1", "rmHost:S1"]
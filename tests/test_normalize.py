@@ -0,0 +1,72 @@
+import gzip
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from metapipe.normalize import Normalizer, normalize_pairs
+
+MEMORY = 1 << 20
+
+
+def random_seq(rng, length=80):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+def write_pairs(directory, pairs):
+    paths = [directory / "in_R1.fastq", directory / "in_R2.fastq"]
+    for mate, path in enumerate(paths):
+        with open(path, 'w') as f:
+            for i, pair in enumerate(pairs):
+                f.write(f"@p{i}/{mate + 1}\n{pair[mate]}\n+\n{'I' * len(pair[mate])}\n")
+    return paths
+
+
+def read_names(path):
+    with gzip.open(path, 'rt') as f:
+        return [line[1:].split('/')[0] for i, line in enumerate(f) if i % 4 == 0]
+
+
+def deep_library(seed=7):
+    """Unique pairs interleaved with many copies of a few pairs"""
+    rng = random.Random(seed)
+    repeated = [(random_seq(rng), random_seq(rng)) for _ in range(3)]
+    pairs = []
+    for _ in range(40):
+        pairs.append((random_seq(rng), random_seq(rng)))
+        pairs.append(rng.choice(repeated))
+    return pairs, repeated
+
+
+def test_duplicate_pairs_dropped_past_target_coverage():
+    rng = random.Random(1)
+    pair = (random_seq(rng), random_seq(rng))
+    normalizer = Normalizer(k=15, coverage=2, memory_bytes=MEMORY)
+    seq1 = [pair[0].encode() + b"\n"] * 5
+    seq2 = [pair[1].encode() + b"\n"] * 5
+    assert normalizer.keep_batch(seq1, seq2).tolist() == [True, True, False, False, False]
+    assert normalizer.stats()['pairs_kept'] == 2
+
+
+def test_mates_kept_or_dropped_together(tmp_path):
+    pairs, repeated = deep_library()
+    reads1, reads2 = write_pairs(tmp_path, pairs)
+    out1, out2 = tmp_path / "out_R1.fastq.gz", tmp_path / "out_R2.fastq.gz"
+    stats = normalize_pairs(reads1, reads2, out1, out2, k=15, coverage=3, memory_bytes=MEMORY)
+    names = read_names(out1)
+    assert names == read_names(out2)
+    # Every unique pair and at most 3 copies of each repeated pair
+    assert stats['pairs_in'] == 80 and stats['pairs_kept'] == len(names)
+    assert 40 < len(names) <= 40 + 3 * len(repeated)
+
+
+def test_batches_keep_the_same_pairs_as_streaming(tmp_path):
+    pairs, _ = deep_library(seed=11)
+    reads1, reads2 = write_pairs(tmp_path, pairs)
+    kept = []
+    for batch_pairs in (1, 7, 1000):
+        out1, out2 = tmp_path / f"b{batch_pairs}_R1.fastq.gz", tmp_path / f"b{batch_pairs}_R2.fastq.gz"
+        normalize_pairs(reads1, reads2, out1, out2, k=15, coverage=3, memory_bytes=MEMORY, batch_pairs=batch_pairs)
+        kept.append(read_names(out1))
+    assert kept[0] == kept[1] == kept[2]
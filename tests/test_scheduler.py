@@ -0,0 +1,40 @@
+import threading
+
+from metapipe.scheduler import DAGScheduler, Task, current_task
+
+BUDGET = 1000
+
+
+def run_concurrently(tasks, started, max_memory=BUDGET):
+    """Run tasks that wait until started tasks are all running, recording their memory caps"""
+    scheduler = DAGScheduler(max_cores=8, max_memory=max_memory)
+    caps, barrier = {}, threading.Barrier(started, timeout=10)
+
+    def body():
+        task = current_task()
+        caps[task.name] = task.memory_cap
+        if started > 1:
+            barrier.wait()
+
+    for name, memory in tasks:
+        scheduler.add_task(Task(name, body, cores=1, memory=memory))
+    summary = scheduler.run()
+    assert not summary['failed'], [scheduler.tasks[name].error for name in summary['failed']]
+    return caps
+
+
+def test_tools_get_their_own_reservation():
+    # Both tasks run at once: together their caps must fit the budget
+    caps = run_concurrently([("assembly:S1", 400), ("binning:S2", 500)], started=2)
+    assert caps == {"assembly:S1": 400, "binning:S2": 500}
+    assert sum(caps.values()) <= BUDGET
+
+
+def test_task_over_the_budget_is_capped_at_the_budget():
+    assert run_concurrently([("assembly:S1", 5000)], started=1) == {"assembly:S1": BUDGET}
+
+
+def test_task_without_estimate_gets_the_unreserved_memory():
+    caps = run_concurrently([("assembly:S1", 300), ("shard:S1", 0)], started=2)
+    assert caps["shard:S1"] in (BUDGET - 300, BUDGET)
+    assert caps["assembly:S1"] == 300
@@ -0,0 +1,41 @@
+from metapipe.staging import Stager, mate_pattern, select_reads
+
+
+def write_reads(directory, samples, pattern_f='_R1', pattern_r='_R2', extension='fastq.gz'):
+    for sample in samples:
+        for pattern in (pattern_f, pattern_r):
+            (directory / f"{sample}{pattern}.{extension}").write_bytes(f"{sample}{pattern}".encode())
+
+
+def test_mate_pattern():
+    assert mate_pattern('_R1') == '_R2'
+    assert mate_pattern('_1') == '_2'
+    assert mate_pattern('_L001_R1') == '_L001_R2'
+
+
+def test_select_reads_matches_exact_sample_names(tmp_path):
+    write_reads(tmp_path, ['S1', 'S10', 'S11', 'S12'])
+    samples = select_reads(tmp_path, '_R1', 'fastq.gz')
+    assert sorted(samples) == ['S1', 'S10', 'S11', 'S12']
+    assert [p.name for p in samples['S1']] == ['S1_R1.fastq.gz', 'S1_R2.fastq.gz']
+    assert sum(len(files) for files in samples.values()) == 8
+
+
+def test_select_reads_prefix(tmp_path):
+    write_reads(tmp_path, ['S1', 'S10', 'T1'])
+    samples = select_reads(tmp_path, '_R1', 'fastq.gz', prefix='S1')
+    assert sorted(samples) == ['S1', 'S10']
+    assert [p.name for p in samples['S1']] == ['S1_R1.fastq.gz', 'S1_R2.fastq.gz']
+
+
+def test_stage_copy_once_per_destination(tmp_path):
+    reads = tmp_path / "delivery"
+    reads.mkdir()
+    write_reads(reads, ['S1', 'S10', 'S11', 'S12'])
+    samples = select_reads(reads, '_R1', 'fastq.gz')
+    files = [read for sample_reads in samples.values() for read in sample_reads]
+    # A file listed twice must still be staged once
+    methods = Stager('copy').stage(files + files[:2], tmp_path / "raw-reads", threads=4)
+    assert len(methods) == 8
+    for read in files:
+        assert (tmp_path / "raw-reads" / read.name).read_bytes() == read.read_bytes()
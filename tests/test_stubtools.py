@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+from metapipe import stubtools
+
+HEADER = "@SQ\tSN:host\tLN:1000\n"
+
+
+def sam_record(name, flag=77):
+    return f"{name}\t{flag}\t*\t0\t0\t*\t*\t0\t0\tACGT\tIIII\n"
+
+
+def test_samtools_cat_keeps_the_first_header(tmp_path):
+    bin_dir = stubtools.install(tmp_path / "bin")
+    parts = []
+    for i in range(3):
+        part = tmp_path / f"part{i}.bam"
+        part.write_text(HEADER + sam_record(f"r{i}a") + sam_record(f"r{i}b", 141))
+        parts.append(str(part))
+    merged = tmp_path / "merged.bam"
+    subprocess.run([sys.executable, str(bin_dir / "samtools"), 'cat', '-o', str(merged)] + parts, check=True)
+    lines = merged.read_text().splitlines(keepends=True)
+    assert lines[0] == HEADER
+    assert [line.split('\t')[0] for line in lines[1:]] == ['r0a', 'r0b', 'r1a', 'r1b', 'r2a', 'r2b']
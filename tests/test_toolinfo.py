@@ -0,0 +1,41 @@
+import os
+
+from metapipe.toolinfo import ToolVersionCache, tool_versions
+
+
+def write_launcher(directory):
+    """One script answering --version with the name it was called by"""
+    launcher = directory / "launcher"
+    launcher.write_text('#!/bin/sh\necho "$(basename "$0") version 1.0"\n')
+    launcher.chmod(0o755)
+    return launcher
+
+
+def test_tools_linked_to_one_file_keep_their_versions(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    launcher = write_launcher(tmp_path)
+    for tool in ('bowtie2', 'samtools'):
+        (bin_dir / tool).symlink_to(launcher)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    commands = {'bowtie2': ['bowtie2', '--version'], 'samtools': ['samtools', '--version']}
+    expected = {'bowtie2': "bowtie2 version 1.0", 'samtools': "samtools version 1.0"}
+
+    cache_path = tmp_path / "tool_versions.json"
+    versions, paths = tool_versions(commands, ToolVersionCache(cache_path))
+    assert versions == expected
+    # The second run answers from the cache, still per tool name
+    cache = ToolVersionCache(cache_path)
+    assert cache.get(paths['bowtie2'], ['--version']) == "bowtie2 version 1.0"
+    assert cache.get(paths['samtools'], ['--version']) == "samtools version 1.0"
+    assert tool_versions(commands, cache)[0] == expected
+
+
+def test_changed_binary_is_probed_again(tmp_path):
+    launcher = write_launcher(tmp_path)
+    cache = ToolVersionCache(tmp_path / "tool_versions.json")
+    cache.put(str(launcher), ['--version'], "launcher version 1.0")
+    assert cache.get(str(launcher), ['--version']) == "launcher version 1.0"
+    launcher.write_text('#!/bin/sh\necho "launcher version 2.0"\n')
+    os.utime(launcher, ns=(1, 1))
+    assert cache.get(str(launcher), ['--version']) is None